@@ -1,206 +1,127 @@
+import contextvars
+import math
 import os
 import sys
-from flask import Flask, render_template, request, jsonify
-from google.cloud import secretmanager
-from google.api_core.exceptions import GoogleAPIError
-
-# Agrupando imports de bibliotecas externas e do Google Cloud
-import google.generativeai as genai
-from google.cloud import vision
-from google.cloud import translate_v2 as translate # Usando o alias para V2
+import time
+from flask import Flask, Response, g, render_template, request, jsonify, stream_with_context
+
+# As bibliotecas do Google Cloud e da Gemini são importadas sob demanda (ver clients.py),
+# para que o Gunicorn comece a atender o quanto antes após um cold start.
+import clients
+import http_common
+import metrics
+import pipeline
+import resilience
+from jobs import PRIORITIES, JobQueue, QueueFullError
 
 # Removendo import de traceback, pois a impressão de traceback completa não é ideal para produção
 # e o App Engine já coleta logs de erro.
 # import traceback # Pode ser removido
 
-# Removendo logs de depuração de inicialização.
-# print("DEBUG: app.py iniciado. Inicializando cliente Secret Manager...", file=sys.stderr)
-
-# --- Configuração do Secret Manager ---
-# O cliente deve ser inicializado uma única vez globalmente.
-client = secretmanager.SecretManagerServiceClient()
-
-def get_secret(secret_id, project_id):
-    """Busca um segredo do Google Secret Manager."""
-    secret_name = client.secret_version_path(project_id, secret_id, "latest")
+# --- Inicialização das APIs ---
+# Os clientes de API e o modelo continuam sendo criados uma única vez por processo, mas
+# agora de forma preguiçosa e em paralelo (clients.py). CLIENT_INIT_MODE controla quando:
+#   - "background" (padrão): em uma thread de segundo plano, logo após o import;
+#   - "lazy": somente no primeiro uso (ou na requisição /_ah/warmup);
+#   - "eager": bloqueando o import, como antes (útil para comparar no benchmark de startup).
+# Com PIPELINE_BACKEND=fake (testes de carga), nenhum cliente do Google é construído.
+PIPELINE_BACKEND = pipeline.PIPELINE_BACKEND
+CLIENT_INIT_MODE = os.getenv('CLIENT_INIT_MODE', 'background')
+if PIPELINE_BACKEND == 'google' and CLIENT_INIT_MODE == 'eager':
     try:
-        # Removendo logs de depuração detalhados.
-        # print(f"DEBUG: Tentando acessar o segredo '{secret_id}' no projeto '{project_id}'...", file=sys.stderr)
-        response = client.access_secret_version(request={"name": secret_name})
-        # print(f"DEBUG: Segredo '{secret_id}' acessado com sucesso.", file=sys.stderr)
-        return response.payload.data.decode("UTF-8")
-    except GoogleAPIError as e:
-        # Mantendo um log de erro claro em caso de falha da API.
-        print(f"ERRO: Falha da API do Secret Manager ao acessar o segredo '{secret_id}': {e}", file=sys.stderr)
-        raise RuntimeError(f"Erro ao carregar o segredo: {secret_id}.")
+        clients.warm_up()
     except Exception as e:
-        # Mantendo um log de erro claro para exceções inesperadas.
-        print(f"ERRO: Erro inesperado ao acessar o segredo '{secret_id}': {e}", file=sys.stderr)
-        raise RuntimeError(f"Erro genérico ao carregar o segredo: {secret_id}.")
-
-# Removendo logs de depuração de funções definidas.
-# print("DEBUG: Funções de carregamento de segredos definidas.", file=sys.stderr)
-
-# --- Obter o ID do Projeto da Aplicação ---
-# Priorize GCP_PROJECT, que é o mais confiável no App Engine Standard.
-app_project_id = os.getenv('GCP_PROJECT')
-
-if not app_project_id:
-    app_project_id = os.getenv('GOOGLE_CLOUD_PROJECT')
-    if not app_project_id:
-        # Saída fatal se o ID do projeto não puder ser determinado.
-        print("ERRO FATAL: O ID do projeto não foi encontrado nas variáveis de ambiente (GCP_PROJECT ou GOOGLE_CLOUD_PROJECT).", file=sys.stderr)
+        print(f"ERRO FATAL: Falha ao inicializar os clientes das APIs: {e}", file=sys.stderr)
         sys.exit(1)
-
-# Removendo log de depuração do ID do projeto.
-# print(f"DEBUG: ID do Projeto da Aplicação detectado: {app_project_id}", file=sys.stderr)
-
-# --- Carregar Chave API Gemini ---
-# Removendo log de depuração.
-# print("DEBUG: Tentando carregar GOOGLE_API_KEY do Secret Manager...", file=sys.stderr)
-try:
-    gemini_api_key = get_secret("google-api-key-gemini", app_project_id)
-    # Removendo log de depuração.
-    # print("DEBUG: GOOGLE_API_KEY carregada com sucesso.", file=sys.stderr)
-except RuntimeError as e:
-    print(f"ERRO FATAL: Falha ao carregar GOOGLE_API_KEY: {e}", file=sys.stderr)
-    sys.exit(1)
-
-# --- Inicialização das APIs ---
-# Os clientes de API e modelos devem ser inicializados uma única vez globalmente
-# para evitar recriação em cada requisição, o que é ineficiente.
-
-# Removendo log de depuração.
-# print("DEBUG: Configurando API Gemini...", file=sys.stderr)
-try:
-    genai.configure(api_key=gemini_api_key)
-    # ATENÇÃO: Havia uma inconsistência aqui.
-    # A linha abaixo 'model = genai.GenerativeModel('gemini-pro-vision')'
-    # estava inicializando um modelo de visão globalmente,
-    # enquanto 'simplify_text_with_gemini' criava seu próprio 'gemini-1.5-flash'.
-    # Para consistência e eficiência, inicialize o modelo de texto AQUI,
-    # e use-o em simplify_text_with_gemini.
-    # Se você também precisar de um modelo de visão em outro lugar, inicialize-o separadamente.
-    
-    # Modelo para simplificação de texto.
-    # Use o mesmo modelo que você confirmou que funciona localmente ('gemini-1.5-flash').
-    global_text_model = genai.GenerativeModel('gemini-1.5-flash') 
-    
-    # Removendo log de depuração.
-    # print("DEBUG: API Gemini configurada e modelo inicializado.", file=sys.stderr)
-except Exception as e:
-    print(f"ERRO FATAL: Falha ao configurar API Gemini ou inicializar modelo: {e}", file=sys.stderr)
-    sys.exit(1)
-
-# Removendo log de depuração.
-# print("DEBUG: Inicializando clientes Vision e Translate...", file=sys.stderr)
-try:
-    vision_client = vision.ImageAnnotatorClient()
-    translate_client = translate.Client() # Corrigido e padronizado para Translation API V2
-    # Removendo log de depuração.
-    # print("DEBUG: Clientes Vision e Translate inicializados.", file=sys.stderr)
-except Exception as e:
-    print(f"ERRO FATAL: Falha ao inicializar clientes Vision ou Translate: {e}", file=sys.stderr)
-    sys.exit(1)
-
-# Removendo log de depuração final da inicialização.
-# print("DEBUG: Todas as APIs e segredos inicializados. Criando instância Flask...", file=sys.stderr)
+elif PIPELINE_BACKEND == 'google' and CLIENT_INIT_MODE == 'background':
+    clients.start_background_warm_up()
 
 # --- Instância da Aplicação Flask (DEVE SER APENAS UMA VEZ) ---
 app = Flask(__name__)
 
-# --- Funções de Processamento de Imagem/Texto ---
-# Agora, essas funções podem usar as instâncias globais dos clientes de API.
+# --- Modo Assíncrono (tarefas enfileiradas, ver jobs.py) ---
+# POST /jobs apenas enfileira a imagem e libera a thread da requisição; os workers abaixo
+# executam o pipeline. Cada tarefa tem seu próprio prazo e registro de tempos por etapa.
 
-def detect_text_from_image(image_content):
-    """Detecta texto em uma imagem usando Google Cloud Vision API."""
-    image = vision.Image(content=image_content)
-    response = vision_client.text_detection(image=image)
-    texts = response.text_annotations
-    if texts:
-        return texts[0].description # Retorna o texto completo
-    return None
+JOB_DEADLINE_SECONDS = float(os.getenv('JOB_DEADLINE_SECONDS', '120'))
+# Espera máxima do long polling em GET /jobs/<id>?wait=N (ocupa uma thread enquanto espera).
+JOB_MAX_WAIT_SECONDS = float(os.getenv('JOB_MAX_WAIT_SECONDS', '25'))
 
-def detect_and_translate_language(text_content):
-    """
-    Detecta o idioma de um texto e o traduz para português, se necessário.
-    Utiliza a Translation API V2.
-    """
-    if not text_content: # Adição: Verificação para texto vazio
-        return ""
-
-    result = translate_client.detect_language(text_content)
-    detected_lang = result['language']
-
-    translated_text = text_content
-    if detected_lang and detected_lang != 'pt':
-        # Removendo log de depuração detalhado.
-        # print(f"Idioma detectado: {detected_lang}. Traduzindo para português.", file=sys.stderr)
-        translation = translate_client.translate(
-            text_content,
-            target_language='pt',
-            source_language=detected_lang
-        )
-        translated_text = translation['translatedText']
-    else:
-        # Removendo log de depuração detalhado.
-        # print(f"Idioma já é português ou não detectado: {detected_lang}. Nenhuma tradução necessária.", file=sys.stderr)
-        pass # 'pass' é opcional aqui, mas bom para indicar que a condição foi tratada.
-
-    return translated_text
-
-def simplify_text_with_gemini(original_text):
+def _run_image_job(job):
+    """Executa o pipeline de uma tarefa em um contexto novo (prazo e métricas próprios)."""
+    return contextvars.Context().run(_process_image_job, job)
+
+def _process_image_job(job):
+    record = metrics.start_request(job.id)
+    resilience.start_deadline(JOB_DEADLINE_SECONDS)
+    status = 'done'
+    try:
+        result = pipeline.process_image_content(job.payload)
+        record.set_field('ocr_chars', len(result['original_text'] or ''))
+        if not result['original_text']:
+            raise ValueError(pipeline.MENSAGEM_SEM_TEXTO_NA_IMAGEM)
+        return {
+            'original_text': result['original_text'],
+            'simplified_text': result['simplified_text'],
+        }
+    except Exception:
+        status = 'failed'
+        raise
+    finally:
+        print(record.log_line(route='job', priority=job.priority, status=status,
+                              queue_wait_ms=round((job.started_at - job.created_at) * 1000, 1)), file=sys.stderr)
+
+job_queue = JobQueue(
+    _run_image_job,
+    workers=int(os.getenv('JOB_WORKERS', '4')),
+    max_queued=int(os.getenv('JOB_MAX_QUEUED', '100')),
+    # As imagens pendentes ficam em memória até o fim de cada tarefa.
+    max_queued_bytes=int(os.getenv('JOB_MAX_QUEUED_BYTES', str(128 * 1024 * 1024))),
+    ttl_seconds=float(os.getenv('JOB_RESULT_TTL_SECONDS', '900')),
+    name='tarefa',
+)
+
+# --- Instrumentação das Requisições ---
+
+@app.before_request
+def start_request_metrics():
+    """Atribui um ID à requisição, inicia o registro dos tempos por etapa e o prazo da requisição."""
+    g.request_record = http_common.start_request(request.headers)
+
+@app.after_request
+def finish_request_metrics(response):
     """
-    Simplifica e resume um texto usando a Gemini API.
-    Utiliza o modelo de texto global 'global_text_model'.
+    Adiciona X-Request-ID e Server-Timing à resposta e, ao final do envio (inclusive das
+    respostas em streaming), registra a latência e uma linha de log estruturado com as etapas.
     """
-    if not original_text: # Adição: Verificação para texto vazio
-        return "O texto fornecido para simplificação está vazio."
+    record = g.get('request_record')
+    if record is None:
+        return response
+    route = request.url_rule.rule if request.url_rule else 'desconhecida'
+    method = request.method
+    response.headers['X-Request-ID'] = record.request_id
+    if record.stages and not response.is_streamed:
+        response.headers['Server-Timing'] = record.server_timing()
+
+    def on_close():
+        metrics.REQUEST_LATENCY.observe(time.perf_counter() - record.started_at, route=route, status=response.status_code)
+        if route not in ('/metrics', '/_ah/warmup', '/static/<path:filename>'):
+            print(record.log_line(method=method, route=route, status=response.status_code), file=sys.stderr)
+
+    response.call_on_close(on_close)
+    return response
+
+def _collect_cache_metrics():
+    return (pipeline.collect_cache_metrics()
+            + metrics.gauges_from_stats('botmanut_jobs', 'Fila de tarefas assíncronas', job_queue.stats()))
+
+metrics.REGISTRY.add_collector(_collect_cache_metrics)
+
+def _resilience_error_response(error):
+    """Converte erros de resiliência em 503 (com Retry-After) ou 504, em vez de um 500 genérico."""
+    payload, status, headers = http_common.resilience_error_response(error)
+    return jsonify(payload), status, headers
 
-    try:
-        # Usando a instância de modelo inicializada globalmente.
-        # Removendo a linha 'text_model = genai.GenerativeModel('gemini-1.5-flash')' daqui.
-        
-        prompt = f"""
-        Você é um assistente especializado em manutenção de aeronaves, com a tarefa de simplificar instruções técnicas. Recebi a seguinte instrução de manutenção de um manual:
-
-        "{original_text}"
-
-        Por favor, reescreva esta instrução de forma mais simples, clara e sucinta,
-        mantendo apenas as informações essenciais para um técnico realizar a tarefa.
-        Use linguagem direta e evite jargões desnecessários, se possível.
-        """
-        response = global_text_model.generate_content(prompt) # Usando a instância global
-
-        # Removendo TODOS os logs de depuração internos da função.
-        # print(f"DEBUG: Resposta completa da Gemini API (objeto): {response}", file=sys.stderr)
-        # if hasattr(response, 'text') and response.text:
-        #     print(f"DEBUG: Resposta da Gemini API (texto direto): {response.text[:200]}...", file=sys.stderr)
-        # else:
-        #     print(f"DEBUG: Resposta da Gemini API não tem atributo 'text' ou está vazia.", file=sys.stderr)
-        # if response and hasattr(response, 'candidates') and response.candidates:
-        #     print(f"DEBUG: Candidates presentes na resposta. Total: {len(response.candidates)}", file=sys.stderr)
-        #     if response.candidates[0].content.parts:
-        #         print(f"DEBUG: Conteúdo do candidato presente. Tipo: {type(response.candidates[0].content.parts[0])}", file=sys.stderr)
-        #     else:
-        #         print(f"DEBUG: Conteúdo do candidato vazio ou sem partes.", file=sys.stderr)
-        # else:
-        #     print(f"DEBUG: Resposta da Gemini API sem candidates ou vazia.", file=sys.stderr)
-
-        if response and response.candidates and response.candidates[0].content.parts:
-            return response.candidates[0].content.parts[0].text
-        else:
-            # Mantendo um aviso no log caso a Gemini API não retorne conteúdo.
-            print("AVISO: Gemini API retornou resposta vazia ou sem conteúdo gerado na parte esperada.", file=sys.stderr)
-            return "A Gemini API não conseguiu gerar uma explicação simplificada para o texto fornecido. O texto é legível e relevante?"
-    except Exception as e:
-        # Mantendo um log de erro claro.
-        print(f"ERRO: Exceção capturada na Gemini API. Tipo: {type(e).__name__}. Mensagem: {str(e)}", file=sys.stderr)
-        # Removendo a impressão de traceback completa, pois o App Engine já registra erros e tracebacks.
-        # print("ERRO: Traceback completa para o erro da Gemini API:", file=sys.stderr)
-        # traceback.print_exc(file=sys.stderr)
-        return "Ocorreu um erro ao simplificar a instrução. Por favor, tente novamente."
-    
 # --- Rotas da Aplicação Flask ---
 
 @app.route('/')
@@ -221,33 +142,195 @@ def process_image():
     try:
         image_content = image_file.read()
 
-        # 1. Detectar texto na imagem (OCR)
-        original_text_from_ocr = detect_text_from_image(image_content)
-        if not original_text_from_ocr:
-            return jsonify({'error': 'Não foi possível detectar texto na imagem. Certifique-se de que o texto está legível.'}), 400
-
-        # Removendo logs de depuração detalhados.
-        # print(f"DEBUG: Texto detectado (OCR): \n{original_text_from_ocr[:100]}...", file=sys.stderr)
-
-        # 2. Detectar e traduzir idioma
-        processed_text = detect_and_translate_language(original_text_from_ocr)
-        # Removendo logs de depuração detalhados.
-        # print(f"DEBUG: Texto processado (após tradução): \n{processed_text[:100]}...", file=sys.stderr)
+        metrics.REQUEST_BYTES.observe(len(image_content))
+        g.request_record.set_field('request_bytes', len(image_content))
 
-        # 3. Simplificar o texto com a Gemini API
-        simplified_explanation = simplify_text_with_gemini(processed_text)
-        # Removendo logs de depuração detalhados.
-        # print(f"DEBUG: Explicação simplificada (Gemini): \n{simplified_explanation[:100]}...", file=sys.stderr)
+        result = pipeline.process_image_content(image_content)
+        g.request_record.set_field('ocr_chars', len(result['original_text'] or ''))
+        if not result['original_text']:
+            return jsonify({'error': pipeline.MENSAGEM_SEM_TEXTO_NA_IMAGEM}), 400
 
         return jsonify({
-            'original_text': original_text_from_ocr,
-            'simplified_text': simplified_explanation
+            'original_text': result['original_text'],
+            'simplified_text': result['simplified_text']
         })
 
+    except resilience.ResilienceError as e:
+        return _resilience_error_response(e)
     except Exception as e:
         print(f"ERRO: Erro durante o processamento da imagem na rota /process_image: {e}", file=sys.stderr)
         return jsonify({'error': f'Erro interno do servidor: {str(e)}'}), 500
 
+@app.route('/process_image_stream', methods=['POST'])
+def process_image_stream():
+    """
+    Variante em streaming de /process_image (NDJSON, um evento por linha):
+    'ocr' assim que o Vision responde, 'translation' após a tradução, vários
+    'simplified_chunk' com os trechos gerados pela Gemini e, por fim, 'done'
+    (ou 'error'). 'simplified_reset' descarta os trechos recebidos até ali (resposta
+    cortada pelo limite de saída e refeita). Prioriza o tempo até o primeiro byte útil para o técnico.
+    Observação: o App Engine Standard entrega a resposta de uma só vez; o
+    streaming incremental vale para execução local, Cloud Run e afins.
+    """
+    if 'image' not in request.files:
+        return jsonify({'error': 'Nenhuma imagem fornecida'}), 400
+
+    image_file = request.files['image']
+    if image_file.filename == '':
+        return jsonify({'error': 'Nenhum arquivo selecionado'}), 400
+
+    image_content = image_file.read()
+    metrics.REQUEST_BYTES.observe(len(image_content))
+    g.request_record.set_field('request_bytes', len(image_content))
+
+    def generate():
+        try:
+            for event, payload in pipeline.iter_image_events(image_content):
+                yield http_common.ndjson_event(event, **payload)
+
+        except resilience.ResilienceError as e:
+            print(f"AVISO: Streaming interrompido pela camada de resiliência: {e}", file=sys.stderr)
+            yield http_common.ndjson_event('error', error=str(e))
+        except Exception as e:
+            print(f"ERRO: Erro durante o processamento da imagem na rota /process_image_stream: {e}", file=sys.stderr)
+            yield http_common.ndjson_event('error', error=f'Erro interno do servidor: {str(e)}')
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype='application/x-ndjson',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'},
+    )
+
+@app.route('/process_batch', methods=['POST'])
+def process_batch():
+    """
+    Processa várias imagens (campo 'images', repetido) de uma só vez, por exemplo
+    todas as páginas de um cartão de tarefa. Os resultados voltam por página, na ordem de envio.
+    """
+    image_files = [f for f in request.files.getlist('images') if f.filename != '']
+    if not image_files:
+        return jsonify({'error': 'Nenhuma imagem fornecida'}), 400
+    if len(image_files) > pipeline.MAX_BATCH_PAGES:
+        return jsonify({'error': f'Envie no máximo {pipeline.MAX_BATCH_PAGES} imagens por lote.'}), 400
+
+    try:
+        image_contents = [f.read() for f in image_files]
+        for content in image_contents:
+            metrics.REQUEST_BYTES.observe(len(content))
+        g.request_record.set_field('request_bytes', sum(len(content) for content in image_contents))
+        g.request_record.set_field('pages', len(image_contents))
+
+        results = pipeline.process_image_batch(image_contents)
+
+        pages = []
+        for index, (image_file, result) in enumerate(zip(image_files, results)):
+            page = {'index': index, 'filename': image_file.filename}
+            if not result['original_text']:
+                page['error'] = pipeline.MENSAGEM_SEM_TEXTO_NA_IMAGEM
+            else:
+                page['original_text'] = result['original_text']
+                page['simplified_text'] = result['simplified_text']
+            pages.append(page)
+
+        return jsonify({'pages': pages})
+
+    except resilience.ResilienceError as e:
+        return _resilience_error_response(e)
+    except Exception as e:
+        print(f"ERRO: Erro durante o processamento do lote na rota /process_batch: {e}", file=sys.stderr)
+        return jsonify({'error': f'Erro interno do servidor: {str(e)}'}), 500
+
+@app.route('/jobs', methods=['POST'])
+def submit_job():
+    """
+    Modo assíncrono: enfileira a imagem e responde imediatamente (202) com o ID da tarefa.
+    O campo opcional 'priority' aceita 'high', 'normal' (padrão) ou 'low'.
+    O resultado é consultado em GET /jobs/<job_id>.
+    """
+    if 'image' not in request.files:
+        return jsonify({'error': 'Nenhuma imagem fornecida'}), 400
+
+    image_file = request.files['image']
+    if image_file.filename == '':
+        return jsonify({'error': 'Nenhum arquivo selecionado'}), 400
+
+    priority = request.form.get('priority', 'normal')
+    if priority not in PRIORITIES:
+        return jsonify({'error': f"Prioridade inválida. Use: {', '.join(PRIORITIES)}."}), 400
+
+    image_content = image_file.read()
+    metrics.REQUEST_BYTES.observe(len(image_content))
+    g.request_record.set_field('request_bytes', len(image_content))
+
+    try:
+        job = job_queue.submit(image_content, priority)
+    except QueueFullError as e:
+        print(f"AVISO: Tarefa recusada: {e}", file=sys.stderr)
+        return jsonify({'error': str(e)}), 503, {'Retry-After': str(e.retry_after)}
+
+    g.request_record.set_field('job_id', job.id)
+    status_url = f'/jobs/{job.id}'
+    return jsonify({'job_id': job.id, 'status': job.status, 'status_url': status_url}), 202, {'Location': status_url}
+
+@app.route('/jobs/<job_id>')
+def get_job(job_id):
+    """
+    Estado de uma tarefa: 'queued', 'running', 'done' (com 'result') ou 'failed' (com 'error').
+    Com ?wait=N, espera até N segundos (limitado a JOB_MAX_WAIT_SECONDS) pelo término,
+    evitando consultas repetidas. Tarefas concluídas expiram após JOB_RESULT_TTL_SECONDS.
+    """
+    try:
+        wait = float(request.args.get('wait', 0))
+    except ValueError:
+        wait = math.nan
+    # 'nan' e 'inf' passam pelo float(); Condition.wait(nan) levantaria ValueError (500).
+    if not math.isfinite(wait):
+        return jsonify({'error': "O parâmetro 'wait' deve ser um número de segundos."}), 400
+    wait = min(max(wait, 0), JOB_MAX_WAIT_SECONDS)
+
+    job = job_queue.wait(job_id, wait) if wait else job_queue.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Tarefa não encontrada ou expirada.'}), 404
+
+    data = job.to_dict()
+    if data['status'] in ('queued', 'running'):
+        # Sugere ao cliente um intervalo entre consultas.
+        return jsonify(data), 200, {'Retry-After': '1'}
+    return jsonify(data)
+
+@app.route('/_ah/warmup')
+def warmup():
+    """
+    Requisição de aquecimento do App Engine (inbound_services: warmup): constrói os
+    clientes das APIs antes de a instância receber tráfego real.
+    """
+    try:
+        timings = clients.warm_up() if PIPELINE_BACKEND == 'google' else {}
+    except Exception as e:
+        print(f"ERRO: Falha no aquecimento da instância: {e}", file=sys.stderr)
+        return jsonify({'error': f'Falha ao inicializar os clientes: {str(e)}'}), 500
+    return jsonify({'status': 'ok', 'seconds': timings})
+
+@app.route('/metrics')
+def metrics_endpoint():
+    """Métricas no formato de texto do Prometheus (latências por etapa, erros, caches)."""
+    return Response(metrics.REGISTRY.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/cache/stats')
+def cache_stats():
+    """
+    Expõe os contadores do cache de resultados (acertos, erros e latência economizada)
+    da memória de tradução (taxa de acerto e caracteres economizados) e do cache de trechos.
+    """
+    return jsonify({
+        'result_cache': pipeline.result_cache.stats(),
+        'translation_memory': pipeline.translation_engine.stats(),
+        'chunk_cache': pipeline.chunk_cache.stats(),
+        'near_duplicate_text': pipeline.text_index.stats() if pipeline.text_index is not None else None,
+        'near_duplicate_image': pipeline.image_index.stats() if pipeline.image_index is not None else None,
+        'manual_index': pipeline.manual_index.stats() if pipeline.manual_index is not None else None,
+    })
+
 # --- Bloco de Execução Local ---
 # Este bloco é SOMENTE para rodar com `python app.py` fora do App Engine.
 # Em App Engine, Gunicorn executa o app.
@@ -0,0 +1,215 @@
+import asyncio
+import json
+import os
+import sys
+import time
+
+import tornado.web
+
+import clients
+import http_common
+import metrics
+import pipeline
+import resilience
+
+# --- Servidor Assíncrono (Tornado + asyncio) ---
+# No app.py, o Gunicorn (worker gthread) atende no máximo 8 requisições simultâneas, uma por
+# thread, e quase todo o tempo de cada uma é espera de rede pelo Vision, Translate e Gemini.
+# Aqui, um único event loop atende todas as requisições: cada etapa usa o cliente assíncrono
+# da API (gRPC asyncio no Vision e no Translate V3, generate_content_async na Gemini), e uma
+# requisição esperando a rede não ocupa thread nenhuma. Os clientes e seus canais/conexões são
+# criados uma vez e compartilhados por todas as requisições.
+#
+# O contrato JSON de /process_image é o mesmo do app.py. Em /process_image_stream, os eventos
+# têm o mesmo formato, mas são enviados juntos ao final (como já acontece no App Engine Standard).
+# As demais rotas (lotes, tarefas assíncronas) continuam apenas no app.py.
+#
+# Para usar no App Engine, troque o entrypoint do app.yaml por: python async_app.py
+# Os limites de chamadas simultâneas por backend vêm de <PREFIXO>_ASYNC_MAX_CONCURRENCY
+# (ver resilience.py), e não mais do número de threads.
+
+PIPELINE_BACKEND = pipeline.PIPELINE_BACKEND
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+# Rotas cujas requisições não entram no log estruturado (como no app.py).
+UNLOGGED_ROUTES = ('/metrics', '/_ah/warmup', '/static/')
+
+metrics.REGISTRY.add_collector(pipeline.collect_cache_metrics)
+
+
+class BaseHandler(tornado.web.RequestHandler):
+    """Instrumentação comum: ID da requisição, registro dos tempos por etapa, prazo e log."""
+
+    def prepare(self):
+        self.record = http_common.start_request(self.request.headers)
+
+    def write_json(self, data, status=200, headers=None):
+        self.set_status(status)
+        self.set_header('Content-Type', 'application/json')
+        for name, value in (headers or {}).items():
+            self.set_header(name, value)
+        self.finish(json.dumps(data, ensure_ascii=False))
+
+    def finish(self, chunk=None):
+        record = getattr(self, 'record', None)
+        if record is not None and not self._headers_written:
+            self.set_header('X-Request-ID', record.request_id)
+            if record.stages:
+                self.set_header('Server-Timing', record.server_timing())
+        return super().finish(chunk)
+
+    def on_finish(self):
+        record = getattr(self, 'record', None)
+        if record is None:
+            return
+        route = self.request.path
+        status = self.get_status()
+        metrics.REQUEST_LATENCY.observe(time.perf_counter() - record.started_at, route=route, status=status)
+        if not route.startswith(UNLOGGED_ROUTES):
+            print(record.log_line(method=self.request.method, route=route, status=status, server='async'),
+                  file=sys.stderr)
+
+    def write_error(self, status_code, **kwargs):
+        self.write_json({'error': self._reason}, status=status_code)
+
+    def image_content(self):
+        """Bytes do campo 'image' do formulário, ou None (com a resposta de erro já enviada)."""
+        image_files = self.request.files.get('image')
+        if not image_files:
+            self.write_json({'error': 'Nenhuma imagem fornecida'}, status=400)
+            return None
+        if image_files[0]['filename'] == '':
+            self.write_json({'error': 'Nenhum arquivo selecionado'}, status=400)
+            return None
+        image_content = image_files[0]['body']
+        metrics.REQUEST_BYTES.observe(len(image_content))
+        self.record.set_field('request_bytes', len(image_content))
+        return image_content
+
+    def resilience_error(self, error):
+        """Converte erros de resiliência em 503 (com Retry-After) ou 504, em vez de um 500 genérico."""
+        payload, status, headers = http_common.resilience_error_response(error)
+        self.write_json(payload, status=status, headers=headers)
+
+
+class IndexHandler(BaseHandler):
+    def get(self):
+        """Página inicial (o mesmo template do app Flask)."""
+        self.render('index.html', url_for=lambda endpoint, filename: self.static_url(filename))
+
+
+class ProcessImageHandler(BaseHandler):
+    async def post(self):
+        """Processa a imagem enviada, extrai, traduz e simplifica o texto."""
+        image_content = self.image_content()
+        if image_content is None:
+            return
+        try:
+            result = await pipeline.process_image_content_async(image_content)
+        except resilience.ResilienceError as e:
+            return self.resilience_error(e)
+        except Exception as e:
+            print(f"ERRO: Erro durante o processamento da imagem na rota /process_image: {e}", file=sys.stderr)
+            return self.write_json({'error': f'Erro interno do servidor: {str(e)}'}, status=500)
+
+        self.record.set_field('ocr_chars', len(result['original_text'] or ''))
+        if not result['original_text']:
+            return self.write_json({'error': pipeline.MENSAGEM_SEM_TEXTO_NA_IMAGEM}, status=400)
+        self.write_json({
+            'original_text': result['original_text'],
+            'simplified_text': result['simplified_text'],
+        })
+
+
+class ProcessImageStreamHandler(BaseHandler):
+    async def post(self):
+        """Mesmos eventos NDJSON de /process_image_stream no app.py, enviados ao final do pipeline."""
+        image_content = self.image_content()
+        if image_content is None:
+            return
+        self.set_header('Content-Type', 'application/x-ndjson')
+        self.set_header('Cache-Control', 'no-cache')
+        try:
+            result = await pipeline.process_image_content_async(image_content)
+        except resilience.ResilienceError as e:
+            print(f"AVISO: Streaming interrompido pela camada de resiliência: {e}", file=sys.stderr)
+            return self.finish(http_common.ndjson_event('error', error=str(e)))
+        except Exception as e:
+            print(f"ERRO: Erro durante o processamento da imagem na rota /process_image_stream: {e}", file=sys.stderr)
+            return self.finish(http_common.ndjson_event('error', error=f'Erro interno do servidor: {str(e)}'))
+
+        if not result['original_text']:
+            return self.finish(http_common.ndjson_event('error', error=pipeline.MENSAGEM_SEM_TEXTO_NA_IMAGEM))
+        self.write(http_common.ndjson_event('ocr', text=result['original_text']))
+        self.write(http_common.ndjson_event('translation', text=result['translated_text'],
+                                 translated=result['translated_text'] != result['original_text']))
+        self.write(http_common.ndjson_event('simplified_chunk', text=result['simplified_text']))
+        self.finish(http_common.ndjson_event('done', simplified_text=result['simplified_text']))
+
+
+class WarmupHandler(BaseHandler):
+    async def get(self):
+        """
+        Requisição de aquecimento do App Engine: constrói os clientes síncronos (em threads) e
+        os assíncronos (no event loop, ao qual os canais gRPC ficam associados).
+        """
+        try:
+            timings = {}
+            if PIPELINE_BACKEND == 'google':
+                timings = await asyncio.to_thread(clients.warm_up)
+                for name, build in (('vision_async', clients.get_vision_async_client),
+                                    ('translate_async', clients.get_translate_async_client)):
+                    started_at = time.perf_counter()
+                    build()
+                    timings[name] = time.perf_counter() - started_at
+        except Exception as e:
+            print(f"ERRO: Falha no aquecimento da instância: {e}", file=sys.stderr)
+            return self.write_json({'error': f'Falha ao inicializar os clientes: {str(e)}'}, status=500)
+        self.write_json({'status': 'ok', 'seconds': timings})
+
+
+class MetricsHandler(BaseHandler):
+    def get(self):
+        """Métricas no formato de texto do Prometheus."""
+        self.set_header('Content-Type', 'text/plain; version=0.0.4')
+        self.finish(metrics.REGISTRY.render())
+
+
+def make_app():
+    return tornado.web.Application(
+        [
+            (r'/', IndexHandler),
+            (r'/process_image', ProcessImageHandler),
+            (r'/process_image_stream', ProcessImageStreamHandler),
+            (r'/_ah/warmup', WarmupHandler),
+            (r'/metrics', MetricsHandler),
+        ],
+        template_path=os.path.join(ROOT, 'templates'),
+        static_path=os.path.join(ROOT, 'static'),
+    )
+
+
+async def _warm_up_clients():
+    """Constrói os clientes logo após o início, sem atrasar a abertura da porta (como CLIENT_INIT_MODE=background)."""
+    try:
+        await asyncio.to_thread(clients.warm_up)
+        clients.get_vision_async_client()
+        clients.get_translate_async_client()
+    except Exception as e:
+        # Não é fatal: a construção será tentada novamente no primeiro uso.
+        print(f"ERRO: Falha ao inicializar os clientes das APIs em segundo plano: {e}", file=sys.stderr)
+
+
+async def main():
+    port = int(os.environ.get('PORT', 8080))
+    if PIPELINE_BACKEND == 'google':
+        # A variável mantém a tarefa viva (o event loop guarda apenas uma referência fraca).
+        warm_up_task = asyncio.create_task(_warm_up_clients())
+    # Uploads de fotos de celular passam de alguns MB; o limite acompanha o do App Engine (32 MB).
+    make_app().listen(port, max_body_size=32 * 1024 * 1024)
+    print(f"Servidor assíncrono escutando na porta {port} (backends: {PIPELINE_BACKEND}).", file=sys.stderr)
+    await asyncio.Event().wait()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,481 @@
+import asyncio
+import hashlib
+import math
+import os
+import random
+import sys
+import time
+
+import clients
+from chunking import CHARS_PER_TOKEN, estimate_tokens
+
+# --- Backends do Pipeline (OCR, Tradução e LLM) ---
+# As funções do pipeline.py (detect_text_from_image, detect_and_translate_language e
+# simplify_text_with_gemini) falam com estas interfaces, e não diretamente com os clientes
+# do Google. Assim é possível trocar os serviços reais por substitutos locais, com latência
+# e taxa de erro configuráveis, para testes de carga sem acesso ao GCP e sem custo.
+#
+# PIPELINE_BACKEND=google (padrão) usa Vision, Translate e Gemini;
+# PIPELINE_BACKEND=fake usa os substitutos locais (ver FAKE_* abaixo).
+
+# Limites da chamada síncrona batch_annotate_images do Vision (16 imagens por requisição).
+VISION_BATCH_MAX_IMAGES = 16
+VISION_BATCH_MAX_BYTES = 30 * 1024 * 1024
+
+
+# Todos os métodos aceitam 'timeout' (segundos, ou None para sem limite), repassado pela
+# camada de resiliência a partir do prazo da requisição.
+# Os métodos *_async são usados pelo servidor assíncrono (async_app.py). A implementação
+# padrão executa a versão síncrona em uma thread; os backends reais e os substitutos locais
+# têm versões nativas, que não ocupam uma thread enquanto esperam a rede.
+
+class OcrBackend:
+    """Extrai o texto completo de imagens."""
+
+    name = 'ocr'
+
+    def detect_text(self, image_content, timeout=None):
+        """Retorna o texto detectado na imagem, ou None."""
+        raise NotImplementedError
+
+    def detect_texts(self, image_contents, timeout=None):
+        """Retorna, na mesma ordem, o texto detectado em cada imagem (ou None)."""
+        return [self.detect_text(content, timeout=timeout) for content in image_contents]
+
+    async def detect_text_async(self, image_content, timeout=None):
+        return await asyncio.to_thread(self.detect_text, image_content, timeout=timeout)
+
+
+class TranslationBackend:
+    """Traduz listas de textos para português."""
+
+    name = 'translate'
+
+    def translate(self, values, timeout=None):
+        """
+        Retorna uma lista de dicionários no formato da Translation API V2
+        ('translatedText' e 'detectedSourceLanguage'), na mesma ordem de 'values'.
+        """
+        raise NotImplementedError
+
+    async def translate_async(self, values, timeout=None):
+        return await asyncio.to_thread(self.translate, values, timeout=timeout)
+
+
+class Generation:
+    """Resultado de 'complete': o texto, os tokens usados e se a saída foi cortada pelo limite."""
+
+    def __init__(self, text, prompt_tokens, response_tokens, truncated=False):
+        self.text = text
+        self.prompt_tokens = prompt_tokens
+        self.response_tokens = response_tokens
+        self.truncated = truncated
+
+    @classmethod
+    def estimated(cls, prompt, text):
+        """Generation com tokens estimados, para backends que não informam o uso."""
+        return cls(text, estimate_tokens(prompt), estimate_tokens(text or ''))
+
+
+class TruncatedResponseError(RuntimeError):
+    """A resposta em streaming foi cortada pelo limite de tokens de saída (max_output_tokens)."""
+
+
+class LlmBackend:
+    """Gera texto a partir de um prompt."""
+
+    name = 'llm'
+
+    def generate(self, prompt, timeout=None):
+        """Retorna o texto gerado, ou None se o modelo não gerou conteúdo."""
+        raise NotImplementedError
+
+    async def generate_async(self, prompt, timeout=None):
+        return await asyncio.to_thread(self.generate, prompt, timeout=timeout)
+
+    def complete(self, prompt, timeout=None, model=None, max_output_tokens=None):
+        """
+        Como 'generate', mas com o modelo e o limite de tokens de saída escolhidos pelo
+        model_routing.py (None = padrão do backend). Retorna uma Generation.
+        """
+        return Generation.estimated(prompt, self.generate(prompt, timeout=timeout))
+
+    async def complete_async(self, prompt, timeout=None, model=None, max_output_tokens=None):
+        return await asyncio.to_thread(
+            self.complete, prompt, timeout=timeout, model=model, max_output_tokens=max_output_tokens)
+
+    def generate_stream(self, prompt, timeout=None, model=None, max_output_tokens=None):
+        """Produz os trechos do texto à medida que são gerados."""
+        text = self.complete(prompt, timeout=timeout, model=model, max_output_tokens=max_output_tokens).text
+        if text:
+            yield text
+
+
+# --- Backends reais (Google Cloud) ---
+
+class VisionOcrBackend(OcrBackend):
+    name = 'vision'
+
+    def detect_text(self, image_content, timeout=None):
+        from google.cloud import vision
+
+        response = clients.get_vision_client().text_detection(
+            image=vision.Image(content=image_content), timeout=timeout)
+        texts = response.text_annotations
+        if texts:
+            return texts[0].description # Retorna o texto completo
+        return None
+
+    def detect_texts(self, image_contents, timeout=None):
+        """Usa batch_annotate_images: uma chamada por grupo de até 16 imagens."""
+        from google.cloud import vision
+
+        texts = []
+        for batch in _vision_batches(image_contents):
+            batch_requests = [
+                vision.AnnotateImageRequest(
+                    image=vision.Image(content=content),
+                    features=[vision.Feature(type_=vision.Feature.Type.TEXT_DETECTION)],
+                )
+                for content in batch
+            ]
+            response = clients.get_vision_client().batch_annotate_images(requests=batch_requests, timeout=timeout)
+            for image_response in response.responses:
+                if image_response.error.message:
+                    print(f"AVISO: Vision API falhou em uma página do lote: {image_response.error.message}", file=sys.stderr)
+                    texts.append(None)
+                elif image_response.text_annotations:
+                    texts.append(image_response.text_annotations[0].description)
+                else:
+                    texts.append(None)
+        return texts
+
+    async def detect_text_async(self, image_content, timeout=None):
+        """Usa o ImageAnnotatorAsyncClient (gRPC assíncrono); o cliente assíncrono não tem o atalho text_detection."""
+        from google.cloud import vision
+
+        request = vision.AnnotateImageRequest(
+            image=vision.Image(content=image_content),
+            features=[vision.Feature(type_=vision.Feature.Type.TEXT_DETECTION)],
+        )
+        response = await clients.get_vision_async_client().batch_annotate_images(requests=[request], timeout=timeout)
+        image_response = response.responses[0]
+        if image_response.error.message:
+            print(f"AVISO: Vision API falhou na imagem: {image_response.error.message}", file=sys.stderr)
+            return None
+        if image_response.text_annotations:
+            return image_response.text_annotations[0].description
+        return None
+
+
+def _vision_batches(image_contents):
+    """Agrupa as imagens respeitando os limites de quantidade e tamanho do Vision."""
+    batch, batch_bytes = [], 0
+    for content in image_contents:
+        if batch and (len(batch) >= VISION_BATCH_MAX_IMAGES or batch_bytes + len(content) > VISION_BATCH_MAX_BYTES):
+            yield batch
+            batch, batch_bytes = [], 0
+        batch.append(content)
+        batch_bytes += len(content)
+    if batch:
+        yield batch
+
+
+class GoogleTranslationBackend(TranslationBackend):
+    name = 'translate'
+
+    def translate(self, values, timeout=None):
+        # A Translation API V2 não aceita timeout por chamada; o prazo é verificado antes da chamada.
+        # format_='text' evita que a API devolva entidades HTML (ex.: &#39;) no texto traduzido.
+        return clients.get_translate_client().translate(values, target_language='pt', format_='text')
+
+    async def translate_async(self, values, timeout=None):
+        """
+        A biblioteca da V2 não tem cliente assíncrono; usa o TranslationServiceAsyncClient da V3
+        (gRPC) e converte a resposta para o formato da V2 usado pelo restante do pipeline.
+        """
+        response = await clients.get_translate_async_client().translate_text(
+            request={
+                'parent': f'projects/{clients.get_project_id()}/locations/global',
+                'contents': values,
+                'target_language_code': 'pt',
+                'mime_type': 'text/plain',
+            },
+            timeout=timeout,
+        )
+        return [
+            {'translatedText': translation.translated_text, 'detectedSourceLanguage': translation.detected_language_code}
+            for translation in response.translations
+        ]
+
+
+class GeminiLlmBackend(LlmBackend):
+    name = 'gemini'
+
+    def generate(self, prompt, timeout=None):
+        response = clients.get_text_model().generate_content(prompt, request_options=_request_options(timeout))
+        return _response_text(response)
+
+    async def generate_async(self, prompt, timeout=None):
+        model = await _text_model_async()
+        response = await model.generate_content_async(prompt, request_options=_request_options(timeout))
+        return _response_text(response)
+
+    def complete(self, prompt, timeout=None, model=None, max_output_tokens=None):
+        response = clients.get_text_model(model).generate_content(
+            prompt, generation_config=_generation_config(max_output_tokens),
+            request_options=_request_options(timeout))
+        return _generation(prompt, response)
+
+    async def complete_async(self, prompt, timeout=None, model=None, max_output_tokens=None):
+        text_model = await _text_model_async(model)
+        response = await text_model.generate_content_async(
+            prompt, generation_config=_generation_config(max_output_tokens),
+            request_options=_request_options(timeout))
+        return _generation(prompt, response)
+
+    def generate_stream(self, prompt, timeout=None, model=None, max_output_tokens=None):
+        response = clients.get_text_model(model).generate_content(
+            prompt, stream=True, generation_config=_generation_config(max_output_tokens),
+            request_options=_request_options(timeout))
+        truncated = False
+        for chunk in response:
+            if chunk.candidates and chunk.candidates[0].content.parts:
+                piece = chunk.candidates[0].content.parts[0].text
+                if piece:
+                    yield piece
+            if chunk.candidates:
+                truncated = _is_truncated(chunk.candidates[0].finish_reason)
+        if truncated:
+            raise TruncatedResponseError(f"Resposta cortada no limite de {max_output_tokens} tokens de saída.")
+
+
+async def _text_model_async(model_name=None):
+    """
+    clients.get_text_model fora do event loop: a primeira chamada espera o warm_up e busca a
+    chave no Secret Manager (bloqueante).
+    """
+    return await asyncio.to_thread(clients.get_text_model, model_name)
+
+
+def _request_options(timeout):
+    return {'timeout': timeout} if timeout is not None else None
+
+
+def _generation_config(max_output_tokens):
+    return {'max_output_tokens': max_output_tokens} if max_output_tokens is not None else None
+
+
+def _response_text(response):
+    if response and response.candidates and response.candidates[0].content.parts:
+        return response.candidates[0].content.parts[0].text
+    return None
+
+
+def _generation(prompt, response):
+    """Generation a partir da resposta da Gemini (usage_metadata e finish_reason)."""
+    text = _response_text(response)
+    usage = getattr(response, 'usage_metadata', None)
+    if not usage:
+        generation = Generation.estimated(prompt, text)
+    else:
+        generation = Generation(text, usage.prompt_token_count, usage.candidates_token_count)
+    if response and response.candidates:
+        generation.truncated = _is_truncated(response.candidates[0].finish_reason)
+    return generation
+
+
+def _is_truncated(finish_reason):
+    return getattr(finish_reason, 'name', finish_reason) in ('MAX_TOKENS', 2)
+
+
+# --- Substitutos locais (para testes de carga) ---
+
+class FakeBackendError(RuntimeError):
+    """Erro simulado por um backend local. 'code' imita o status HTTP da API real."""
+
+    def __init__(self, message, code=503):
+        super().__init__(message)
+        self.code = code
+
+
+class LatencyModel:
+    """
+    Distribuição de latência log-normal definida pela mediana (ms) e pela dispersão 'sigma',
+    mais uma taxa de erro. Latências de APIs de rede costumam ter essa cauda longa à direita.
+    """
+
+    def __init__(self, median_ms, sigma=0.4, error_rate=0.0, error_code=503):
+        self.median_ms = median_ms
+        self.sigma = sigma
+        self.error_rate = error_rate
+        self.error_code = error_code
+
+    def sample_seconds(self):
+        if self.median_ms <= 0:
+            return 0.0
+        return random.lognormvariate(math.log(self.median_ms / 1000.0), self.sigma)
+
+    def wait(self, backend_name, scale=1.0, timeout=None):
+        """
+        Dorme pela latência sorteada e, conforme a taxa de erro, levanta FakeBackendError.
+        Se a latência passar de 'timeout', dorme apenas até o timeout e falha com código 504.
+        """
+        latency = self.sample_seconds() * scale
+        if timeout is not None and latency > timeout:
+            time.sleep(max(timeout, 0))
+            raise FakeBackendError(f"Tempo esgotado no backend '{backend_name}'.", code=504)
+        time.sleep(latency)
+        if self.error_rate and random.random() < self.error_rate:
+            raise FakeBackendError(f"Falha simulada no backend '{backend_name}'.", code=self.error_code)
+
+    async def wait_async(self, backend_name, scale=1.0, timeout=None):
+        """Como 'wait', mas sem bloquear o event loop (asyncio.sleep)."""
+        latency = self.sample_seconds() * scale
+        if timeout is not None and latency > timeout:
+            await asyncio.sleep(max(timeout, 0))
+            raise FakeBackendError(f"Tempo esgotado no backend '{backend_name}'.", code=504)
+        await asyncio.sleep(latency)
+        if self.error_rate and random.random() < self.error_rate:
+            raise FakeBackendError(f"Falha simulada no backend '{backend_name}'.", code=self.error_code)
+
+    @classmethod
+    def from_env(cls, prefix, default_median_ms):
+        """Lê FAKE_<PREFIXO>_LATENCY_MS, FAKE_<PREFIXO>_ERROR_RATE etc. (com FAKE_LATENCY_SIGMA global)."""
+        return cls(
+            median_ms=float(os.getenv(f'FAKE_{prefix}_LATENCY_MS', str(default_median_ms))),
+            sigma=float(os.getenv(f'FAKE_{prefix}_LATENCY_SIGMA', os.getenv('FAKE_LATENCY_SIGMA', '0.4'))),
+            error_rate=float(os.getenv(f'FAKE_{prefix}_ERROR_RATE', os.getenv('FAKE_ERROR_RATE', '0'))),
+            error_code=int(os.getenv(f'FAKE_{prefix}_ERROR_CODE', '503')),
+        )
+
+
+# Trechos típicos de manual, repetidos entre páginas como nos manuais reais.
+FAKE_MANUAL_LINES = [
+    "1. Make sure that the area is clean and free of foreign objects.",
+    "2. Remove the access panel 192AR.",
+    "WARNING: DO NOT OPERATE THE LANDING GEAR WITH PERSONNEL IN THE WHEEL WELL.",
+    "3. Torque the bolts to 25 - 30 lbf.in (2.8 - 3.4 N.m).",
+    "CAUTION: USE ONLY APPROVED LUBRICANTS.",
+    "4. Install the access panel 192AR.",
+    "5. Do an operational test of the system.",
+]
+
+
+class FakeOcrBackend(OcrBackend):
+    name = 'fake-ocr'
+
+    def __init__(self, latency):
+        self.latency = latency
+
+    def detect_text(self, image_content, timeout=None):
+        self.latency.wait(self.name, timeout=timeout)
+        return self._text_for(image_content)
+
+    async def detect_text_async(self, image_content, timeout=None):
+        await self.latency.wait_async(self.name, timeout=timeout)
+        return self._text_for(image_content)
+
+    def detect_texts(self, image_contents, timeout=None):
+        # Uma única "chamada" em lote, um pouco mais lenta que a individual.
+        self.latency.wait(self.name, scale=1.0 + 0.1 * len(image_contents), timeout=timeout)
+        return [self._text_for(content) for content in image_contents]
+
+    @staticmethod
+    def _text_for(image_content):
+        # Texto determinístico por imagem: linhas comuns a todas as páginas mais uma linha única.
+        digest = hashlib.sha256(image_content).hexdigest()
+        start = int(digest[:2], 16) % len(FAKE_MANUAL_LINES)
+        lines = FAKE_MANUAL_LINES[start:] + FAKE_MANUAL_LINES[:start]
+        return f"TASK {digest[:8].upper()}\n" + "\n".join(lines)
+
+
+class FakeTranslationBackend(TranslationBackend):
+    name = 'fake-translate'
+
+    def __init__(self, latency):
+        self.latency = latency
+
+    def translate(self, values, timeout=None):
+        self.latency.wait(self.name, timeout=timeout)
+        return self._translations(values)
+
+    async def translate_async(self, values, timeout=None):
+        await self.latency.wait_async(self.name, timeout=timeout)
+        return self._translations(values)
+
+    @staticmethod
+    def _translations(values):
+        return [{'translatedText': f"[pt] {value}", 'detectedSourceLanguage': 'en'} for value in values]
+
+
+class FakeLlmBackend(LlmBackend):
+    name = 'fake-llm'
+
+    # Fração da latência do modelo padrão simulada para os demais modelos (ex.: o modelo leve).
+    LIGHT_MODEL_LATENCY_SCALE = 0.5
+
+    def __init__(self, latency):
+        self.latency = latency
+
+    def generate(self, prompt, timeout=None):
+        self.latency.wait(self.name, timeout=timeout)
+        return self._summary(prompt)
+
+    async def generate_async(self, prompt, timeout=None):
+        await self.latency.wait_async(self.name, timeout=timeout)
+        return self._summary(prompt)
+
+    def complete(self, prompt, timeout=None, model=None, max_output_tokens=None):
+        self.latency.wait(self.name, scale=self._scale(model), timeout=timeout)
+        return self._generation(prompt, max_output_tokens)
+
+    async def complete_async(self, prompt, timeout=None, model=None, max_output_tokens=None):
+        await self.latency.wait_async(self.name, scale=self._scale(model), timeout=timeout)
+        return self._generation(prompt, max_output_tokens)
+
+    def generate_stream(self, prompt, timeout=None, model=None, max_output_tokens=None):
+        # A latência total é dividida entre os trechos, como no streaming real.
+        total = self.latency.sample_seconds() * self._scale(model)
+        if timeout is not None and total > timeout:
+            time.sleep(max(timeout, 0))
+            raise FakeBackendError(f"Tempo esgotado no backend '{self.name}'.", code=504)
+        generation = self._generation(prompt, max_output_tokens)
+        words = generation.text.split(" ")
+        for i in range(0, len(words), 5):
+            time.sleep(total * 5 / len(words))
+            yield " ".join(words[i:i + 5]) + " "
+        if generation.truncated:
+            raise TruncatedResponseError(f"Resposta cortada no limite de {max_output_tokens} tokens de saída.")
+        if self.latency.error_rate and random.random() < self.latency.error_rate:
+            raise FakeBackendError(f"Falha simulada no backend '{self.name}'.", code=self.latency.error_code)
+
+    def _scale(self, model):
+        return 1.0 if model is None or model == clients.GEMINI_MODEL_NAME else self.LIGHT_MODEL_LATENCY_SCALE
+
+    def _generation(self, prompt, max_output_tokens):
+        generation = Generation.estimated(prompt, self._summary(prompt))
+        if max_output_tokens is not None and generation.response_tokens > max_output_tokens:
+            generation.text = generation.text[:max_output_tokens * CHARS_PER_TOKEN]
+            generation.response_tokens = max_output_tokens
+            generation.truncated = True
+        return generation
+
+    @staticmethod
+    def _summary(prompt):
+        words = prompt.split()
+        return "Resumo simulado: " + " ".join(words[-40:])
+
+
+def create_backends(kind=None):
+    """Cria o trio (ocr, tradução, llm) conforme PIPELINE_BACKEND ('google' ou 'fake')."""
+    kind = kind or os.getenv('PIPELINE_BACKEND', 'google')
+    if kind == 'fake':
+        return (
+            FakeOcrBackend(LatencyModel.from_env('OCR', 800)),
+            FakeTranslationBackend(LatencyModel.from_env('TRANSLATE', 150)),
+            FakeLlmBackend(LatencyModel.from_env('LLM', 2500)),
+        )
+    if kind == 'google':
+        return VisionOcrBackend(), GoogleTranslationBackend(), GeminiLlmBackend()
+    raise ValueError(f"PIPELINE_BACKEND inválido: {kind!r} (use 'google' ou 'fake').")
@@ -0,0 +1,97 @@
+"""
+Benchmark da normalização de imagens antes do OCR.
+
+Compara, para cada imagem, o envio dos bytes originais com o envio normalizado
+(uma ou mais dimensões máximas): tamanho do payload, latência do Vision e
+diferença do texto reconhecido em relação ao OCR da imagem original.
+
+Uso (requer credenciais do Google Cloud com acesso à Vision API):
+    python benchmarks/benchmark_preprocessing.py fotos/*.jpg --max-dimensions 1600,2048,3000
+"""
+import argparse
+import difflib
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from google.cloud import vision
+
+from preprocessing import normalize_image_for_ocr
+
+
+def run_ocr(client, content):
+    """Executa o OCR e retorna (texto, latência em segundos)."""
+    started_at = time.perf_counter()
+    response = client.text_detection(image=vision.Image(content=content))
+    elapsed = time.perf_counter() - started_at
+    texts = response.text_annotations
+    return (texts[0].description if texts else ""), elapsed
+
+
+def text_similarity(reference, candidate):
+    """Similaridade (0 a 1) entre dois textos de OCR, comparando palavra a palavra."""
+    return difflib.SequenceMatcher(None, reference.split(), candidate.split()).ratio()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("images", nargs="+", help="Arquivos de imagem a comparar")
+    parser.add_argument("--max-dimensions", default="2048",
+                        help="Dimensões máximas a testar, separadas por vírgula (padrão: 2048)")
+    parser.add_argument("--no-grayscale", action="store_true", help="Mantém as cores na normalização")
+    parser.add_argument("--quality", type=int, default=85, help="Qualidade JPEG da recodificação")
+    parser.add_argument("--repeat", type=int, default=1, help="Repetições de cada chamada ao Vision")
+    args = parser.parse_args()
+
+    dimensions = [int(d) for d in args.max_dimensions.split(",")]
+    client = vision.ImageAnnotatorClient()
+
+    variants = ["original"] + [f"max{d}" for d in dimensions]
+    sizes = {v: [] for v in variants}
+    latencies = {v: [] for v in variants}
+    similarities = {v: [] for v in variants}
+    prep_times = {v: [] for v in variants}
+
+    for path in args.images:
+        with open(path, "rb") as f:
+            raw = f.read()
+
+        payloads = {"original": raw}
+        for d in dimensions:
+            started_at = time.perf_counter()
+            payloads[f"max{d}"] = normalize_image_for_ocr(
+                raw, max_dimension=d, grayscale=not args.no_grayscale, quality=args.quality
+            )
+            prep_times[f"max{d}"].append(time.perf_counter() - started_at)
+
+        reference_text = None
+        print(f"\n{path}")
+        for variant in variants:
+            content = payloads[variant]
+            runs = [run_ocr(client, content) for _ in range(args.repeat)]
+            text = runs[0][0]
+            latency = statistics.median(elapsed for _, elapsed in runs)
+            if reference_text is None:
+                reference_text = text
+            similarity = text_similarity(reference_text, text)
+
+            sizes[variant].append(len(content))
+            latencies[variant].append(latency)
+            similarities[variant].append(similarity)
+            print(f"  {variant:>10}: {len(content) / 1024:9.1f} KiB  vision {latency * 1000:8.1f} ms  "
+                  f"similaridade do texto {similarity:.3f}")
+
+    print("\nResumo (medianas)")
+    print(f"  {'variante':>10}  {'payload KiB':>12}  {'vision ms':>10}  {'prep ms':>8}  {'similaridade':>12}")
+    for variant in variants:
+        prep = statistics.median(prep_times[variant]) * 1000 if prep_times[variant] else 0.0
+        print(f"  {variant:>10}  {statistics.median(sizes[variant]) / 1024:12.1f}  "
+              f"{statistics.median(latencies[variant]) * 1000:10.1f}  {prep:8.1f}  "
+              f"{statistics.median(similarities[variant]):12.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+"""
+Benchmark do roteamento de modelo da simplificação (model_routing.py).
+
+Simplifica cada página (texto já traduzido, um arquivo .txt por página) duas vezes pelo
+ponto de entrada real do pipeline (pipeline.simplify_text_with_gemini, com os trechos em
+paralelo, as novas tentativas e o orçamento por página): com o roteamento e sem ele (sempre
+o modelo padrão, sem limite de saída, como antes). O cache de trechos é esvaziado antes de
+cada execução, para que uma não sirva a outra. Reporta, por página e no total, a latência,
+os tokens, o custo estimado e duas medidas de qualidade:
+  - preservação dos valores críticos: fração dos números e avisos do original que
+    aparecem na saída (um valor de torque perdido é um erro grave);
+  - similaridade com a saída sem roteamento (difflib, palavra a palavra).
+
+Por padrão usa os backends locais (PIPELINE_BACKEND=fake) e, sem arquivos, páginas sintéticas
+de vários tamanhos: mede o custo do roteamento e do paralelismo, não a qualidade. Para medir
+a qualidade nas páginas de referência, use a Gemini (requer GOOGLE_API_KEY):
+    python benchmarks/benchmark_routing.py
+    python benchmarks/benchmark_routing.py --backend google paginas/*.txt
+"""
+import argparse
+import difflib
+import os
+import re
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+NUMBER = re.compile(r"\d+(?:[.,]\d+)?")
+
+
+def synthetic_pages():
+    """
+    Páginas montadas com os trechos típicos dos substitutos locais: só passos (de 2 a 60 linhas,
+    elegíveis ao modelo leve) e com avisos (sempre no modelo padrão).
+    """
+    from backends import FAKE_MANUAL_LINES
+    from chunking import NOTICE_START
+
+    steps = [line for line in FAKE_MANUAL_LINES if not NOTICE_START.match(line)]
+    pages = {f"passos-{lines}-linhas": "\n".join(steps[i % len(steps)] for i in range(lines)) for lines in (2, 5, 60)}
+    pages["com-avisos"] = "\n".join(FAKE_MANUAL_LINES)
+    return pages
+
+
+def simplify(pipeline, text, routed):
+    """
+    Simplifica a página pelo pipeline; retorna (texto, segundos, tokens de entrada, tokens de
+    saída, custo estimado).
+    """
+    import cache
+    import metrics
+    import model_routing
+    import resilience
+
+    model_routing.ROUTING_ENABLED = routed
+    pipeline.chunk_cache = cache.ResultCache(max_entries=4096)
+    cost_before = sum(model_routing.ROUTE_COST.value(route=route) for route in ("light", "standard"))
+    record = metrics.start_request(f"benchmark-{time.monotonic_ns()}")
+    resilience.start_deadline()
+    started_at = time.perf_counter()
+    simplified = pipeline.simplify_text_with_gemini(text)
+    elapsed = time.perf_counter() - started_at
+    cost = sum(model_routing.ROUTE_COST.value(route=route) for route in ("light", "standard")) - cost_before
+    return (simplified, elapsed, record.fields.get("gemini_prompt_tokens", 0),
+            record.fields.get("gemini_response_tokens", 0), cost)
+
+
+def preserved(original, simplified):
+    """Fração dos números e avisos do original presentes na saída (1.0 se não houver nenhum)."""
+    from chunking import NOTICE_START
+
+    expected = NUMBER.findall(original) + [line.split()[0] for line in original.splitlines() if NOTICE_START.match(line)]
+    if not expected:
+        return 1.0
+    found = sum(1 for item in expected if item.lower() in simplified.lower())
+    return found / len(expected)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("pages", nargs="*", help="Arquivos .txt com o texto traduzido de cada página.")
+    parser.add_argument("--backend", choices=("fake", "google"), default="fake",
+                        help="Backends do pipeline (padrão: substitutos locais).")
+    args = parser.parse_args()
+
+    # Configuração lida no import do pipeline: sem caches em disco nem índices, para que
+    # cada execução passe pela Gemini (ou pelo substituto local).
+    os.environ.update(PIPELINE_BACKEND=args.backend, RESULT_CACHE_PATH="", TRANSLATION_MEMORY_PATH="",
+                      CHUNK_CACHE_PATH="", NEAR_DUPLICATE="0", NEAR_DUPLICATE_PATH="", MANUAL_INDEX_PATH="")
+    import pipeline
+
+    if args.pages:
+        pages = {}
+        for path in args.pages:
+            with open(path, encoding="utf-8") as f:
+                pages[os.path.basename(path)] = f.read()
+    else:
+        pages = synthetic_pages()
+
+    rows = []
+    for name, text in pages.items():
+        baseline = simplify(pipeline, text, routed=False)
+        routed = simplify(pipeline, text, routed=True)
+        similarity = difflib.SequenceMatcher(None, baseline[0].split(), routed[0].split()).ratio()
+        rows.append((baseline, routed, preserved(text, baseline[0]), preserved(text, routed[0]), similarity))
+        print(f"{name}: {baseline[1]:.2f}s -> {routed[1]:.2f}s, "
+              f"tokens {baseline[2] + baseline[3]} -> {routed[2] + routed[3]}, "
+              f"custo US$ {baseline[4]:.6f} -> {routed[4]:.6f}, "
+              f"valores preservados {rows[-1][2]:.0%} -> {rows[-1][3]:.0%}, similaridade {similarity:.2f}")
+
+    print("\nTotal de páginas:", len(rows))
+    print(f"Latência média: {statistics.mean(r[0][1] for r in rows):.2f}s -> {statistics.mean(r[1][1] for r in rows):.2f}s")
+    print(f"Tokens: {sum(r[0][2] + r[0][3] for r in rows)} -> {sum(r[1][2] + r[1][3] for r in rows)}")
+    print(f"Custo: US$ {sum(r[0][4] for r in rows):.6f} -> {sum(r[1][4] for r in rows):.6f}")
+    print(f"Valores preservados (média): {statistics.mean(r[2] for r in rows):.0%} -> {statistics.mean(r[3] for r in rows):.0%}")
+    print(f"Similaridade com a saída sem roteamento (média): {statistics.mean(r[4] for r in rows):.2f}")
+
+
+if __name__ == "__main__":
+    main()
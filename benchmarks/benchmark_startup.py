@@ -0,0 +1,64 @@
+"""
+Benchmark de inicialização (cold start) do app.py.
+
+Para cada modo de inicialização dos clientes (CLIENT_INIT_MODE), executa um processo
+Python novo e mede:
+  - import: tempo do "import app" (o que o Gunicorn espera antes de atender);
+  - primeira resposta: tempo, desde o início do processo, até a primeira resposta de "/";
+  - clientes prontos: tempo, desde o início do processo, até Vision, Translate e Gemini
+    estarem construídos (o que a primeira chamada a /process_image precisa).
+
+"eager" reproduz o comportamento anterior (tudo construído em sequência no import);
+"background" e "lazy" são os modos novos.
+
+Uso (requer credenciais do Google Cloud e GCP_PROJECT/GOOGLE_CLOUD_PROJECT configurados):
+    python benchmarks/benchmark_startup.py --modes eager,background,lazy --repeat 5
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+# Código executado em cada processo filho; imprime as medições em JSON na última linha.
+CHILD = r"""
+import json, time
+t0 = time.perf_counter()
+import app
+t_import = time.perf_counter() - t0
+app.app.test_client().get('/')
+t_first_response = time.perf_counter() - t0
+import clients
+clients.warm_up()
+t_ready = time.perf_counter() - t0
+print(json.dumps({'import': t_import, 'first_response': t_first_response, 'clients_ready': t_ready}))
+"""
+
+
+def run_once(mode):
+    env = dict(os.environ, CLIENT_INIT_MODE=mode)
+    output = subprocess.run(
+        [sys.executable, "-c", CHILD], cwd=ROOT, env=env, capture_output=True, text=True, check=True
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--modes", default="eager,background,lazy", help="Modos a comparar, separados por vírgula")
+    parser.add_argument("--repeat", type=int, default=5, help="Processos por modo")
+    args = parser.parse_args()
+
+    print(f"  {'modo':>10}  {'import ms':>10}  {'1a resposta ms':>15}  {'clientes prontos ms':>20}")
+    for mode in args.modes.split(","):
+        runs = [run_once(mode) for _ in range(args.repeat)]
+        medians = {key: statistics.median(run[key] for run in runs) * 1000 for key in runs[0]}
+        print(f"  {mode:>10}  {medians['import']:10.1f}  {medians['first_response']:15.1f}  "
+              f"{medians['clients_ready']:20.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,271 @@
+"""
+Gerador de carga para /process_image.
+
+Por padrão, sobe o app com o mesmo comando do app.yaml (Gunicorn, worker gthread,
+1 worker e 8 threads) usando os backends locais (PIPELINE_BACKEND=fake), de modo que
+nenhuma API do Google é chamada. Em seguida, dispara requisições com diferentes níveis
+de concorrência e reporta a vazão e as latências p50/p95/p99, tanto a total vista pelo
+cliente quanto a de cada etapa (lida do cabeçalho Server-Timing).
+
+Com --server async, sobe o servidor assíncrono (async_app.py, Tornado + asyncio) no lugar do
+Gunicorn, para comparar os dois modos com a mesma carga. Em ambos os casos, a memória (RSS)
+do servidor é reportada ao final de cada nível.
+
+Exemplos:
+    python benchmarks/load_test.py --concurrency 1,4,8,16,32 --duration 30
+    python benchmarks/load_test.py --server async --concurrency 8,32,64,128
+    python benchmarks/load_test.py --threads 16 --env FAKE_LLM_LATENCY_MS=4000
+    python benchmarks/load_test.py --url https://meu-app.appspot.com --concurrency 4
+
+Use --url para medir um servidor já em execução (atenção: com os backends reais, cada
+requisição é cobrada).
+"""
+import argparse
+import io
+import os
+import re
+import shlex
+import socket
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+
+def percentile(values, fraction):
+    """Percentil por interpolação linear (valores em qualquer ordem)."""
+    if not values:
+        return float("nan")
+    ordered = sorted(values)
+    position = (len(ordered) - 1) * fraction
+    lower = int(position)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+
+def sample_image(path=None):
+    """Lê a imagem informada ou gera uma pequena página sintética em JPEG."""
+    if path:
+        with open(path, "rb") as f:
+            return f.read()
+    from PIL import Image, ImageDraw
+
+    image = Image.new("L", (1200, 1600), 255)
+    draw = ImageDraw.Draw(image)
+    for line in range(40):
+        draw.text((60, 60 + line * 36), f"{line + 1}. Make sure that the area is clean. Torque to 25 Nm.", fill=0)
+    output = io.BytesIO()
+    image.save(output, format="JPEG", quality=85)
+    return output.getvalue()
+
+
+def unique_variant(image, quality=85):
+    """
+    Cópia da imagem com um código aleatório carimbado no canto. Mudar só os bytes do arquivo
+    não basta: a normalização antes do OCR recodifica a imagem e descartaria a diferença.
+    """
+    from PIL import ImageDraw
+
+    variant = image.copy()
+    ImageDraw.Draw(variant).text((10, variant.height - 20), uuid.uuid4().hex, fill=0)
+    output = io.BytesIO()
+    variant.save(output, format="JPEG", quality=quality)
+    return output.getvalue()
+
+
+def multipart_body(image_content, filename="pagina.jpg"):
+    """Monta o corpo multipart/form-data com o campo 'image'."""
+    boundary = uuid.uuid4().hex
+    body = (
+        f"--{boundary}\r\n"
+        f'Content-Disposition: form-data; name="image"; filename="{filename}"\r\n'
+        "Content-Type: image/jpeg\r\n\r\n"
+    ).encode() + image_content + f"\r\n--{boundary}--\r\n".encode()
+    return body, f"multipart/form-data; boundary={boundary}"
+
+
+def parse_server_timing(header):
+    """Converte 'ocr;dur=812.3, translate;dur=140.0' em {'ocr': 0.8123, 'translate': 0.14}."""
+    timings = {}
+    for entry in (header or "").split(","):
+        match = re.match(r"\s*([\w-]+);dur=([\d.]+)", entry)
+        if match:
+            timings[match.group(1)] = float(match.group(2)) / 1000.0
+    return timings
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def gunicorn_command(port, threads=None, workers=None):
+    """Lê o entrypoint do app.yaml e o ajusta para escutar em 127.0.0.1:<port>."""
+    with open(os.path.join(ROOT, "app.yaml"), encoding="utf-8") as f:
+        entrypoint = next(line.split(":", 1)[1].strip() for line in f if line.startswith("entrypoint:"))
+    command = shlex.split(entrypoint)
+    if threads:
+        command = [arg for arg in command if not arg.startswith("--threads")] + [f"--threads={threads}"]
+    if workers:
+        command = [arg for arg in command if not arg.startswith("--workers")] + [f"--workers={workers}"]
+    return [sys.executable, "-m"] + command + ["--bind", f"127.0.0.1:{port}"]
+
+
+def async_command():
+    """Servidor assíncrono (async_app.py); a porta é passada pela variável PORT."""
+    return [sys.executable, "async_app.py"]
+
+
+def server_memory_mb(pid):
+    """
+    Memória residente (RSS) atual e de pico, em MB, do processo e de seus filhos (o Gunicorn
+    tem um processo mestre e os workers). Só funciona no Linux; retorna None nos demais.
+    """
+    def children(process_id):
+        found = []
+        for task in os.listdir(f"/proc/{process_id}/task"):
+            with open(f"/proc/{process_id}/task/{task}/children") as f:
+                found.extend(int(child) for child in f.read().split())
+        return found
+
+    try:
+        pending, current, peak = [pid], 0, 0
+        while pending:
+            process_id = pending.pop()
+            with open(f"/proc/{process_id}/status") as f:
+                status = dict(line.split(":", 1) for line in f if ":" in line)
+            current += int(status["VmRSS"].split()[0]) / 1024
+            peak += int(status["VmHWM"].split()[0]) / 1024
+            pending.extend(children(process_id))
+        return current, peak
+    except (OSError, KeyError, ValueError):
+        return None
+
+
+def wait_until_ready(url, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            urllib.request.urlopen(url + "/", timeout=2).read()
+            return
+        except (urllib.error.URLError, ConnectionError):
+            time.sleep(0.2)
+    raise RuntimeError(f"O servidor em {url} não respondeu em {timeout}s.")
+
+
+def run_level(url, image_content, concurrency, duration, unique):
+    """Executa 'concurrency' clientes em laço fechado por 'duration' segundos."""
+    latencies, stages, statuses = [], {}, {}
+    lock = threading.Lock()
+    stop_at = time.perf_counter() + duration
+    if unique:
+        from PIL import Image
+
+        base_image = Image.open(io.BytesIO(image_content))
+        base_image.load()
+
+    def client():
+        while time.perf_counter() < stop_at:
+            # Uma imagem diferente por requisição: cada uma passa pelo pipeline inteiro, sem acertar o cache.
+            content = unique_variant(base_image) if unique else image_content
+            body, content_type = multipart_body(content)
+            req = urllib.request.Request(url + "/process_image", data=body, method="POST",
+                                         headers={"Content-Type": content_type})
+            started_at = time.perf_counter()
+            try:
+                with urllib.request.urlopen(req, timeout=120) as response:
+                    response.read()
+                    status, timing = response.status, response.headers.get("Server-Timing")
+            except urllib.error.HTTPError as e:
+                e.read()
+                status, timing = e.code, e.headers.get("Server-Timing")
+            except Exception as e:
+                status, timing = type(e).__name__, None
+            elapsed = time.perf_counter() - started_at
+            with lock:
+                statuses[status] = statuses.get(status, 0) + 1
+                if status == 200:
+                    latencies.append(elapsed)
+                    for stage, seconds in parse_server_timing(timing).items():
+                        stages.setdefault(stage, []).append(seconds)
+
+    started_at = time.perf_counter()
+    threads = [threading.Thread(target=client) for _ in range(concurrency)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return latencies, stages, statuses, time.perf_counter() - started_at
+
+
+def print_report(concurrency, latencies, stages, statuses, wall_time):
+    def row(name, values):
+        return (f"    {name:>10}  p50 {percentile(values, 0.50) * 1000:8.1f} ms  "
+                f"p95 {percentile(values, 0.95) * 1000:8.1f} ms  p99 {percentile(values, 0.99) * 1000:8.1f} ms")
+
+    print(f"\nConcorrência {concurrency}: {len(latencies) / wall_time:.2f} req/s bem-sucedidas "
+          f"em {wall_time:.1f}s; status {statuses}")
+    print(row("total", latencies))
+    for stage, values in stages.items():
+        print(row(stage, values))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", help="Servidor já em execução (se omitido, sobe o Gunicorn localmente)")
+    parser.add_argument("--server", choices=("threaded", "async"), default="threaded",
+                        help="Servidor a subir localmente: Gunicorn com threads (app.py) ou assíncrono (async_app.py)")
+    parser.add_argument("--concurrency", default="1,4,8,16", help="Níveis de concorrência, separados por vírgula")
+    parser.add_argument("--duration", type=float, default=20, help="Segundos por nível de concorrência")
+    parser.add_argument("--image", help="Imagem a enviar (padrão: página sintética)")
+    parser.add_argument("--repeat-image", action="store_true",
+                        help="Envia sempre os mesmos bytes (mede o caminho com acerto de cache)")
+    parser.add_argument("--threads", type=int, help="Sobrescreve --threads do Gunicorn")
+    parser.add_argument("--workers", type=int, help="Sobrescreve --workers do Gunicorn")
+    parser.add_argument("--env", action="append", default=[],
+                        help="Variável extra para o servidor, ex.: FAKE_LLM_ERROR_RATE=0.05 (repetível)")
+    args = parser.parse_args()
+
+    server = None
+    url = args.url
+    if not url:
+        port = free_port()
+        env = dict(os.environ, PIPELINE_BACKEND="fake", RESULT_CACHE_PATH="", TRANSLATION_MEMORY_PATH="",
+                   CHUNK_CACHE_PATH="", NEAR_DUPLICATE_PATH="")
+        if not args.repeat_image:
+            # Páginas quase iguais seriam reconhecidas pelo índice de quase duplicatas e
+            # serviriam o resultado umas das outras, sem passar pelo pipeline.
+            env.update(NEAR_DUPLICATE="0", NEAR_DUPLICATE_IMAGE="0")
+        env.update(item.split("=", 1) for item in args.env)
+        if args.server == "async":
+            env["PORT"] = str(port)
+            command = async_command()
+        else:
+            command = gunicorn_command(port, args.threads, args.workers)
+        print("Servidor:", " ".join(command))
+        server = subprocess.Popen(command, cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        url = f"http://127.0.0.1:{port}"
+
+    try:
+        wait_until_ready(url)
+        image_content = sample_image(args.image)
+        for concurrency in (int(c) for c in args.concurrency.split(",")):
+            print_report(concurrency, *run_level(url, image_content, concurrency, args.duration,
+                                                 unique=not args.repeat_image))
+            memory = server_memory_mb(server.pid) if server is not None else None
+            if memory is not None:
+                print(f"    memória do servidor: {memory[0]:.0f} MB (pico {memory[1]:.0f} MB)")
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+
+if __name__ == "__main__":
+    main()
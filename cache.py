@@ -0,0 +1,182 @@
+import hashlib
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+# --- Cache de Resultados Endereçado por Conteúdo ---
+# Cada chamada a /process_image paga três idas e voltas de rede (Vision, Translate e Gemini).
+# Como os técnicos reenviam a mesma página do manual com frequência, guardamos o resultado
+# do pipeline indexado pelo hash dos bytes da imagem, em dois níveis:
+#   1. Memória: LRU limitado em número de entradas e com TTL (o mais rápido).
+#   2. Disco: SQLite, que sobrevive a reinícios da instância (quando o caminho é persistente).
+# No App Engine Standard, /tmp (o caminho padrão) ocupa a RAM da instância: a camada em disco
+# também é limitada. A cada PRUNE_EVERY_WRITES gravações, as linhas expiradas são apagadas e,
+# acima de max_disk_entries, as mais antigas também.
+
+PRUNE_EVERY_WRITES = 100
+
+
+def content_hash(data):
+    """Retorna o hash SHA-256 (hex) de um conteúdo em bytes ou texto."""
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+    return hashlib.sha256(data).hexdigest()
+
+
+class ResultCache:
+    """
+    Cache LRU em memória com TTL, apoiado por uma camada persistente em SQLite.
+    Os valores precisam ser serializáveis em JSON. É seguro para uso entre threads
+    (o Gunicorn roda com worker gthread).
+    """
+
+    def __init__(self, db_path=None, max_entries=256, ttl_seconds=7 * 24 * 3600, table="resultados",
+                 max_disk_entries=5000):
+        self.max_entries = max_entries
+        self.max_disk_entries = max_disk_entries
+        self.ttl_seconds = ttl_seconds
+        self.table = table
+        self._memory = OrderedDict()  # chave -> (expira_em, valor, custo_segundos)
+        self._lock = threading.Lock()
+        self._stats = {
+            "memory_hits": 0,
+            "disk_hits": 0,
+            "misses": 0,
+            "stores": 0,
+            "seconds_saved": 0.0,
+            "disk_evictions": 0,
+        }
+        self._writes = 0
+
+        self._db = None
+        if db_path:
+            try:
+                self._db = sqlite3.connect(db_path, check_same_thread=False)
+                self._db.execute("PRAGMA journal_mode=WAL")
+                self._db.execute(
+                    f"CREATE TABLE IF NOT EXISTS {table} ("
+                    "chave TEXT PRIMARY KEY, valor TEXT NOT NULL, "
+                    "expira_em REAL NOT NULL, custo_segundos REAL NOT NULL DEFAULT 0)"
+                )
+                self._db.execute(f"CREATE INDEX IF NOT EXISTS {table}_expira_em ON {table} (expira_em)")
+                self._db.commit()
+                self._prune()
+            except sqlite3.Error as e:
+                # O cache em disco é uma otimização: se falhar, seguimos apenas com a memória.
+                print(f"AVISO: Cache em disco desativado ({db_path}): {e}", file=sys.stderr)
+                self._db = None
+
+    def get(self, key):
+        """Retorna o valor armazenado para a chave, ou None se ausente/expirado."""
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                expires_at, value, cost = entry
+                if expires_at > now:
+                    self._memory.move_to_end(key)
+                    self._stats["memory_hits"] += 1
+                    self._stats["seconds_saved"] += cost
+                    return value
+                del self._memory[key]
+
+            if self._db is not None:
+                try:
+                    row = self._db.execute(
+                        f"SELECT valor, expira_em, custo_segundos FROM {self.table} WHERE chave = ?",
+                        (key,),
+                    ).fetchone()
+                    if row is not None and row[1] <= now:
+                        self._db.execute(f"DELETE FROM {self.table} WHERE chave = ?", (key,))
+                        self._db.commit()
+                        row = None
+                except sqlite3.Error as e:
+                    print(f"AVISO: Falha ao ler o cache em disco: {e}", file=sys.stderr)
+                    row = None
+                if row is not None:
+                    raw_value, expires_at, cost = row
+                    value = json.loads(raw_value)
+                    self._remember(key, expires_at, value, cost)
+                    self._stats["disk_hits"] += 1
+                    self._stats["seconds_saved"] += cost
+                    return value
+
+            self._stats["misses"] += 1
+            return None
+
+    def set(self, key, value, cost_seconds=0.0):
+        """
+        Armazena um valor nas duas camadas. 'cost_seconds' é o tempo gasto para produzi-lo,
+        usado para estimar a latência economizada a cada acerto.
+        """
+        expires_at = time.time() + self.ttl_seconds
+        with self._lock:
+            self._remember(key, expires_at, value, cost_seconds)
+            self._stats["stores"] += 1
+            if self._db is not None:
+                try:
+                    self._db.execute(
+                        f"INSERT OR REPLACE INTO {self.table} (chave, valor, expira_em, custo_segundos) "
+                        "VALUES (?, ?, ?, ?)",
+                        (key, json.dumps(value, ensure_ascii=False), expires_at, cost_seconds),
+                    )
+                    self._db.commit()
+                except sqlite3.Error as e:
+                    print(f"AVISO: Falha ao gravar no cache em disco: {e}", file=sys.stderr)
+                self._writes += 1
+                if self._writes % PRUNE_EVERY_WRITES == 0:
+                    self._prune()
+
+    def _prune(self):
+        """Apaga do disco as linhas expiradas e as mais antigas além de max_disk_entries."""
+        # Chamado com o lock adquirido (ou durante a construção).
+        try:
+            expired = self._db.execute(f"DELETE FROM {self.table} WHERE expira_em <= ?", (time.time(),)).rowcount
+            # Com o mesmo TTL para todas as linhas, a que expira antes é a gravada há mais tempo.
+            trimmed = self._db.execute(
+                f"DELETE FROM {self.table} WHERE chave IN (SELECT chave FROM {self.table} "
+                "ORDER BY expira_em DESC LIMIT -1 OFFSET ?)",
+                (self.max_disk_entries,),
+            ).rowcount
+            self._db.commit()
+        except sqlite3.Error as e:
+            print(f"AVISO: Falha ao limpar o cache em disco: {e}", file=sys.stderr)
+            return
+        self._stats["disk_evictions"] += expired + trimmed
+
+    def _remember(self, key, expires_at, value, cost):
+        # Deve ser chamado com o lock adquirido.
+        self._memory[key] = (expires_at, value, cost)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def stats(self):
+        """Retorna uma cópia dos contadores de acertos/erros do cache."""
+        with self._lock:
+            stats = dict(self._stats)
+            stats["memory_entries"] = len(self._memory)
+        lookups = stats["memory_hits"] + stats["disk_hits"] + stats["misses"]
+        stats["hit_rate"] = (stats["memory_hits"] + stats["disk_hits"]) / lookups if lookups else 0.0
+        return stats
+
+
+def cache_from_env(prefix, default_path, table="resultados", max_entries=256, ttl_seconds=7 * 24 * 3600,
+                   max_disk_entries=5000):
+    """
+    Cria um ResultCache configurado por variáveis de ambiente com o prefixo informado
+    (ex.: RESULT_CACHE_PATH, RESULT_CACHE_MAX_ENTRIES, RESULT_CACHE_MAX_DISK_ENTRIES,
+    RESULT_CACHE_TTL_SECONDS).
+    Um caminho vazio desativa a camada em disco.
+    """
+    return ResultCache(
+        db_path=os.getenv(f"{prefix}_PATH", default_path) or None,
+        max_entries=int(os.getenv(f"{prefix}_MAX_ENTRIES", str(max_entries))),
+        ttl_seconds=int(os.getenv(f"{prefix}_TTL_SECONDS", str(ttl_seconds))),
+        table=table,
+        max_disk_entries=int(os.getenv(f"{prefix}_MAX_DISK_ENTRIES", str(max_disk_entries))),
+    )
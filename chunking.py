@@ -0,0 +1,116 @@
+import os
+import re
+
+# --- Divisão de Páginas Longas em Trechos ---
+# Uma página densa do manual ia inteira em um único prompt para a Gemini: a latência crescia
+# com o tamanho da página e, nas maiores, a resposta estourava o prazo ou vinha truncada.
+# Aqui o texto traduzido é dividido em blocos que respeitam a estrutura do manual (passos
+# numerados, avisos WARNING/CAUTION e parágrafos) e os blocos são agrupados em trechos dentro
+# de um orçamento de tokens. Cada trecho é simplificado separadamente (em paralelo, no pipeline.py)
+# e os resultados são unidos na ordem original.
+
+# Orçamento de tokens de entrada por trecho. Textos menores seguem em um único prompt, como antes.
+CHUNK_MAX_TOKENS = int(os.getenv('CHUNK_MAX_TOKENS', '400'))
+
+# Estimativa simples: ~4 caracteres por token em textos em inglês/português.
+CHARS_PER_TOKEN = 4
+
+# Início de passo: "1.", "2)", "3.1", "(a)", "B." etc.
+STEP_START = re.compile(r"^\s*(?:\(?\d{1,3}(?:[.)]|(?:\.\d{1,3})+[.)]?)|\(?[A-Za-z][.)])\s+\S")
+# Subitem de um passo: "(a)", "b)", "3.1" etc. Dentro de um passo, continua o mesmo bloco.
+SUBSTEP_START = re.compile(r"^\s*(?:\(\w{1,3}\)|[a-z][.)]|\d{1,3}(?:\.\d{1,3})+[.)]?)\s+\S")
+# Início de aviso, no original em inglês ou já traduzido.
+NOTICE_START = re.compile(
+    r"^\s*(?:WARNING|CAUTION|NOTE|AVISO|ATENÇÃO|ADVERTÊNCIA|CUIDADO|PRECAUÇÃO|NOTA|OBSERVAÇÃO)\b"
+)
+SENTENCE_END = re.compile(r"(?<=[^\d\s][.!?])\s+")
+
+
+def estimate_tokens(text):
+    """Estimativa do número de tokens de um texto (sem chamar a API)."""
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+def split_blocks(text):
+    """
+    Divide o texto em blocos estruturais. Retorna uma lista de pares (tipo, texto), em que
+    tipo é 'step' (passo numerado), 'notice' (WARNING/CAUTION/NOTE) ou 'paragraph'.
+    Linhas de continuação e subitens ("(a)", "3.1") pertencem ao bloco anterior; linhas em
+    branco encerram o bloco.
+    """
+    blocks = []
+    kind, lines = None, []
+
+    def close():
+        if lines:
+            blocks.append((kind, "\n".join(lines)))
+
+    for line in text.splitlines():
+        if not line.strip():
+            close()
+            kind, lines = None, []
+            continue
+        if NOTICE_START.match(line):
+            close()
+            kind, lines = 'notice', [line]
+        elif kind == 'step' and SUBSTEP_START.match(line):
+            lines.append(line)
+        elif STEP_START.match(line):
+            close()
+            kind, lines = 'step', [line]
+        else:
+            if not lines:
+                kind = 'paragraph'
+            lines.append(line)
+    close()
+    return blocks
+
+
+def _split_oversized(text, max_tokens):
+    """Divide um bloco maior que o orçamento por linhas, depois por frases e, em último caso, por palavras."""
+    for pattern in ("\n", SENTENCE_END, " "):
+        parts = text.split(pattern) if isinstance(pattern, str) else pattern.split(text)
+        if len(parts) > 1:
+            separator = pattern if isinstance(pattern, str) else " "
+            return _pack(parts, max_tokens, separator)
+    return [text]
+
+
+def _pack(units, max_tokens, separator):
+    """Agrupa unidades consecutivas em trechos de até 'max_tokens' (estimados)."""
+    chunks, current = [], []
+    for unit in units:
+        candidate = separator.join(current + [unit])
+        if current and estimate_tokens(candidate) > max_tokens:
+            chunks.append(separator.join(current))
+            current = []
+        if not current and estimate_tokens(unit) > max_tokens:
+            chunks.extend(_split_oversized(unit, max_tokens))
+            continue
+        current.append(unit)
+    if current:
+        chunks.append(separator.join(current))
+    return chunks
+
+
+def split_into_chunks(text, max_tokens=None):
+    """
+    Divide o texto em trechos de até 'max_tokens' (padrão: CHUNK_MAX_TOKENS), sem quebrar
+    passos e mantendo cada aviso junto do bloco que vem logo depois dele (o aviso se refere
+    ao passo seguinte). Textos dentro do orçamento voltam como um único trecho.
+    """
+    max_tokens = max_tokens or CHUNK_MAX_TOKENS
+    if estimate_tokens(text) <= max_tokens:
+        return [text]
+
+    units, pending_notices = [], []
+    for kind, block in split_blocks(text):
+        if kind == 'notice':
+            pending_notices.append(block)
+            continue
+        units.append("\n".join(pending_notices + [block]))
+        pending_notices = []
+    if pending_notices:
+        units.append("\n".join(pending_notices))
+
+    return _pack(units, max_tokens, "\n\n")
@@ -0,0 +1,198 @@
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# --- Inicialização Preguiçosa e Paralela dos Clientes ---
+# O app.yaml escala até zero instâncias. Antes, o app.py buscava o segredo no Secret Manager
+# e construía os três clientes (Gemini, Vision, Translate) em sequência durante o import,
+# antes de o Gunicorn poder atender qualquer requisição. Agora:
+#   - as bibliotecas pesadas (google.generativeai, google.cloud.vision etc.) só são
+#     importadas quando o cliente correspondente é construído;
+#   - os clientes são construídos uma única vez, no primeiro uso ou em segundo plano,
+#     em paralelo entre si (warm_up).
+
+GEMINI_MODEL_NAME = 'gemini-1.5-flash'
+GEMINI_SECRET_ID = 'google-api-key-gemini'
+
+_clients = {}
+# Credenciais e chave da Gemini fornecidas explicitamente (ver configure); None usa o padrão do ambiente.
+_settings = {'credentials': None, 'gemini_api_key': None}
+_locks = {name: threading.Lock()
+          for name in ('secret_manager', 'text_model', 'vision', 'translate', 'vision_async', 'translate_async')}
+_models_lock = threading.Lock()
+_warm_up_thread = None
+
+
+def configure(credentials=None, gemini_api_key=None):
+    """
+    Define credenciais explícitas para os clientes, em vez das do ambiente. Usado pelo app
+    Streamlit, que lê a conta de serviço e a chave da Gemini de st.secrets. Deve ser chamado
+    antes do primeiro uso dos clientes; os já construídos não são afetados.
+    """
+    _settings['credentials'] = credentials
+    _settings['gemini_api_key'] = gemini_api_key
+
+
+def get_project_id():
+    """Retorna o ID do projeto da aplicação (GCP_PROJECT tem prioridade no App Engine Standard)."""
+    project_id = os.getenv('GCP_PROJECT') or os.getenv('GOOGLE_CLOUD_PROJECT')
+    if not project_id:
+        raise RuntimeError("O ID do projeto não foi encontrado nas variáveis de ambiente (GCP_PROJECT ou GOOGLE_CLOUD_PROJECT).")
+    return project_id
+
+
+def get_secret(secret_id, project_id):
+    """Busca um segredo do Google Secret Manager."""
+    from google.api_core.exceptions import GoogleAPIError
+
+    client = _get('secret_manager')
+    secret_name = client.secret_version_path(project_id, secret_id, "latest")
+    try:
+        response = client.access_secret_version(request={"name": secret_name})
+        return response.payload.data.decode("UTF-8")
+    except GoogleAPIError as e:
+        print(f"ERRO: Falha da API do Secret Manager ao acessar o segredo '{secret_id}': {e}", file=sys.stderr)
+        raise RuntimeError(f"Erro ao carregar o segredo: {secret_id}.")
+    except Exception as e:
+        print(f"ERRO: Erro inesperado ao acessar o segredo '{secret_id}': {e}", file=sys.stderr)
+        raise RuntimeError(f"Erro genérico ao carregar o segredo: {secret_id}.")
+
+
+def _build_secret_manager():
+    from google.cloud import secretmanager
+    return secretmanager.SecretManagerServiceClient()
+
+
+def _build_text_model():
+    import google.generativeai as genai
+
+    # GOOGLE_API_KEY permite rodar localmente sem acesso ao Secret Manager.
+    gemini_api_key = (_settings['gemini_api_key'] or os.getenv('GOOGLE_API_KEY')
+                      or get_secret(GEMINI_SECRET_ID, get_project_id()))
+    genai.configure(api_key=gemini_api_key)
+    return genai.GenerativeModel(GEMINI_MODEL_NAME)
+
+
+def _build_vision():
+    from google.cloud import vision
+    return vision.ImageAnnotatorClient(credentials=_settings['credentials'])
+
+
+def _build_translate():
+    from google.cloud import translate_v2 as translate
+    return translate.Client(credentials=_settings['credentials'])
+
+
+# Clientes assíncronos (gRPC asyncio), usados pelo servidor assíncrono (async_app.py). O canal
+# gRPC fica preso ao event loop em que foi criado: estes clientes devem ser construídos (e
+# usados) dentro do event loop do servidor, e não no warm_up em threads. Uma vez criados, o
+# canal e suas conexões HTTP/2 são compartilhados por todas as requisições.
+def _build_vision_async():
+    from google.cloud import vision
+    return vision.ImageAnnotatorAsyncClient(credentials=_settings['credentials'])
+
+
+def _build_translate_async():
+    # A biblioteca da Translation API V2 é apenas síncrona; a V3 tem cliente gRPC assíncrono.
+    from google.cloud import translate_v3
+    return translate_v3.TranslationServiceAsyncClient(credentials=_settings['credentials'])
+
+
+_BUILDERS = {
+    'secret_manager': _build_secret_manager,
+    'text_model': _build_text_model,
+    'vision': _build_vision,
+    'translate': _build_translate,
+    'vision_async': _build_vision_async,
+    'translate_async': _build_translate_async,
+}
+
+
+def _get(name):
+    """Retorna o cliente pedido, construindo-o uma única vez (seguro entre threads)."""
+    client = _clients.get(name)
+    if client is not None:
+        return client
+    with _locks[name]:
+        client = _clients.get(name)
+        if client is None:
+            client = _BUILDERS[name]()
+            _clients[name] = client
+        return client
+
+
+def get_text_model(model_name=None):
+    """
+    Modelo Gemini usado na simplificação de texto. Com 'model_name', retorna outro modelo
+    (ex.: o modelo leve do model_routing.py), que reaproveita a chave já configurada.
+    """
+    default = _get('text_model')
+    if model_name is None or model_name == GEMINI_MODEL_NAME:
+        return default
+    name = f'text_model:{model_name}'
+    model = _clients.get(name)
+    if model is None:
+        import google.generativeai as genai
+        with _models_lock:
+            model = _clients.setdefault(name, genai.GenerativeModel(model_name))
+    return model
+
+
+def get_vision_client():
+    """Cliente da Google Cloud Vision API."""
+    return _get('vision')
+
+
+def get_translate_client():
+    """Cliente da Google Cloud Translation API V2."""
+    return _get('translate')
+
+
+def get_vision_async_client():
+    """Cliente assíncrono da Google Cloud Vision API (construir e usar dentro do event loop)."""
+    return _get('vision_async')
+
+
+def get_translate_async_client():
+    """Cliente assíncrono da Google Cloud Translation API V3 (construir e usar dentro do event loop)."""
+    return _get('translate_async')
+
+
+def is_ready():
+    """Indica se todos os clientes usados no pipeline já foram construídos."""
+    return all(name in _clients for name in ('text_model', 'vision', 'translate'))
+
+
+def warm_up():
+    """
+    Constrói em paralelo todos os clientes ainda não inicializados e aguarda a conclusão.
+    Retorna o tempo (em segundos) gasto em cada um; propaga o primeiro erro encontrado.
+    """
+    def timed(name):
+        started_at = time.perf_counter()
+        _get(name)
+        return time.perf_counter() - started_at
+
+    names = ('text_model', 'vision', 'translate')
+    with ThreadPoolExecutor(max_workers=len(names), thread_name_prefix='init-clientes') as executor:
+        futures = {name: executor.submit(timed, name) for name in names}
+        return {name: future.result() for name, future in futures.items()}
+
+
+def start_background_warm_up():
+    """Dispara o warm_up em uma thread de segundo plano (apenas uma vez por processo)."""
+    global _warm_up_thread
+
+    def run():
+        try:
+            warm_up()
+        except Exception as e:
+            # Não é fatal: a construção será tentada novamente no primeiro uso.
+            print(f"ERRO: Falha ao inicializar os clientes das APIs em segundo plano: {e}", file=sys.stderr)
+
+    if _warm_up_thread is None:
+        _warm_up_thread = threading.Thread(target=run, name='init-clientes', daemon=True)
+        _warm_up_thread.start()
+    return _warm_up_thread
@@ -0,0 +1,46 @@
+import json
+import sys
+import uuid
+
+import metrics
+import resilience
+
+# --- Partes Comuns aos Servidores HTTP ---
+# O app Flask (app.py) e o servidor assíncrono (async_app.py) respondem às mesmas rotas com o
+# mesmo contrato: o ID da requisição, a conversão dos erros de resiliência em 503/504 e o
+# formato dos eventos de streaming (NDJSON) ficam aqui, independentes do framework, para que
+# uma correção chegue aos dois servidores.
+
+
+def request_id(headers):
+    """ID da requisição: X-Request-ID, o ID do trace do App Engine ou um ID novo."""
+    value = headers.get('X-Request-ID')
+    if not value:
+        # No App Engine, o ID do trace permite correlacionar com o Cloud Trace/Logging.
+        trace_header = headers.get('X-Cloud-Trace-Context', '')
+        value = trace_header.split('/')[0] or uuid.uuid4().hex
+    return value
+
+
+def start_request(headers):
+    """Inicia o registro dos tempos por etapa e o prazo da requisição; retorna o registro."""
+    record = metrics.start_request(request_id(headers))
+    resilience.start_deadline()
+    return record
+
+
+def resilience_error_response(error):
+    """
+    Converte um erro de resiliência em (corpo JSON, status, cabeçalhos): 503 com Retry-After
+    (sobrecarga ou circuito aberto) ou 504 (prazo esgotado), em vez de um 500 genérico.
+    """
+    print(f"AVISO: Requisição interrompida pela camada de resiliência: {error}", file=sys.stderr)
+    if isinstance(error, resilience.BackendUnavailableError):
+        return {'error': str(error)}, 503, {'Retry-After': str(error.retry_after)}
+    return {'error': 'O processamento demorou mais que o esperado. Por favor, tente novamente.'}, 504, {}
+
+
+def ndjson_event(event, **payload):
+    """Serializa um evento do streaming como uma linha de JSON (NDJSON)."""
+    payload['event'] = event
+    return json.dumps(payload, ensure_ascii=False) + '\n'
@@ -0,0 +1,110 @@
+"""
+Ingestão offline de páginas de manuais no índice de páginas pré-processadas (manual_index.py).
+
+Cada imagem passa pelas mesmas etapas do app (OCR -> tradução -> simplificação), com várias
+páginas em paralelo, e o resultado é gravado no índice SQLite FTS5. Depois de enviado junto
+no deploy (MANUAL_INDEX_PATH, padrão manual_index.sqlite3 na raiz do projeto), o app devolve
+a simplificação pronta para fotos dessas páginas, sem chamar Translate nem Gemini.
+
+Exemplos:
+    python ingest_manuals.py manuais/ATR72/ --manual "ATR 72 AMM"
+    python ingest_manuals.py manuais/ --workers 8 --index /tmp/manual_index.sqlite3
+    PIPELINE_BACKEND=fake python ingest_manuals.py paginas/*.jpg
+
+Páginas já presentes no índice (mesmos bytes) são puladas, a menos que --force seja usado.
+Com os backends reais, cada página nova é cobrada uma única vez (Vision, Translate e Gemini).
+"""
+import argparse
+import contextvars
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import pipeline
+import resilience
+from cache import content_hash
+from manual_index import MANUAL_INDEX_PATH, ManualIndex
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.webp', '.tif', '.tiff', '.bmp')
+
+# Prazo por página: mais folgado que o de uma requisição, já que ninguém está esperando a resposta.
+PAGE_DEADLINE_SECONDS = float(os.getenv('INGEST_PAGE_DEADLINE_SECONDS', '180'))
+
+
+def find_images(paths):
+    """Arquivos de imagem informados diretamente ou contidos (recursivamente) nos diretórios."""
+    images = []
+    for path in paths:
+        if os.path.isdir(path):
+            for folder, _, files in os.walk(path):
+                images.extend(os.path.join(folder, name) for name in sorted(files)
+                              if name.lower().endswith(IMAGE_EXTENSIONS))
+        else:
+            images.append(path)
+    return sorted(images)
+
+
+def process_page(path):
+    """Executa o pipeline para uma página. Retorna o resultado ou levanta uma exceção com o motivo."""
+    with open(path, 'rb') as f:
+        image_content = f.read()
+    resilience.start_deadline(PAGE_DEADLINE_SECONDS)
+    original_text = pipeline.detect_text_from_image(image_content)
+    if not original_text:
+        raise ValueError(pipeline.MENSAGEM_SEM_TEXTO_NA_IMAGEM)
+    translated_text = pipeline.detect_and_translate_language(original_text)
+    simplified_text = pipeline.simplify_text_with_gemini(translated_text)
+    if simplified_text in pipeline.MENSAGENS_DE_FALHA:
+        raise RuntimeError(simplified_text)
+    return content_hash(image_content), original_text, translated_text, simplified_text
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("paths", nargs="+", help="Imagens ou diretórios com as páginas dos manuais")
+    parser.add_argument("--index", default=MANUAL_INDEX_PATH,
+                        help=f"Arquivo do índice (padrão: {MANUAL_INDEX_PATH})")
+    parser.add_argument("--manual", help="Nome do manual (padrão: nome do diretório de cada imagem)")
+    parser.add_argument("--workers", type=int, default=4, help="Páginas processadas em paralelo")
+    parser.add_argument("--force", action="store_true", help="Reprocessa páginas já presentes no índice")
+    args = parser.parse_args()
+
+    index = ManualIndex(args.index, writable=True)
+    images = find_images(args.paths)
+    pending = []
+    for path in images:
+        if not args.force:
+            with open(path, 'rb') as f:
+                if index.has_image(content_hash(f.read())):
+                    continue
+        pending.append(path)
+    print(f"{len(images)} imagens encontradas, {len(images) - len(pending)} já indexadas, "
+          f"{len(pending)} a processar com {args.workers} workers.")
+
+    started_at = time.perf_counter()
+    failures = 0
+    with ThreadPoolExecutor(max_workers=args.workers, thread_name_prefix='ingestao') as executor:
+        # Cada página roda em um contexto próprio (o prazo do resilience fica em uma ContextVar).
+        futures = {executor.submit(contextvars.Context().run, process_page, path): path for path in pending}
+        for done, future in enumerate(as_completed(futures), start=1):
+            path = futures[future]
+            try:
+                image_hash, original_text, translated_text, simplified_text = future.result()
+            except Exception as e:
+                failures += 1
+                print(f"ERRO: [{done}/{len(pending)}] {path}: {e}", file=sys.stderr)
+                continue
+            manual = args.manual or os.path.basename(os.path.dirname(os.path.abspath(path)))
+            index.add_page(image_hash, original_text, translated_text, simplified_text, manual=manual, source=path)
+            print(f"[{done}/{len(pending)}] {path}")
+
+    index.finish_ingestion()
+    elapsed = time.perf_counter() - started_at
+    print(f"{len(pending) - failures} páginas indexadas em {elapsed:.1f} s ({failures} falhas). "
+          f"Total no índice: {index.pages} páginas em {args.index}.")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,205 @@
+import heapq
+import sys
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+import metrics
+
+# --- Fila de Tarefas Assíncronas ---
+# Em /process_image, cada upload ocupa uma conexão HTTP e uma thread do Gunicorn durante todo
+# o pipeline (vários segundos), e o app.yaml limita a instância a 10 requisições simultâneas.
+# No modo assíncrono, a requisição apenas enfileira a imagem e responde com o ID da tarefa em
+# milissegundos; um conjunto fixo de workers executa o pipeline em ordem de prioridade, e o
+# cliente consulta o resultado depois (com espera opcional, long polling). Os resultados
+# concluídos ficam guardados em memória até expirarem.
+# Cada tarefa guarda a imagem enviada até terminar: além do número de tarefas, a fila limita o
+# total de bytes pendentes (fotos de celular têm de 4 a 12 MB, e a instância, poucas centenas de MB).
+
+# Estados de uma tarefa.
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+FINISHED_STATES = (DONE, FAILED)
+
+# Prioridades aceitas (menor número = atendida primeiro).
+PRIORITIES = {'high': 0, 'normal': 1, 'low': 2}
+
+JOBS_SUBMITTED = metrics.REGISTRY.register(metrics.Counter(
+    "botmanut_jobs_submitted_total", "Tarefas assíncronas recebidas, por prioridade.", ("priority",)))
+JOBS_REJECTED = metrics.REGISTRY.register(metrics.Counter(
+    "botmanut_jobs_rejected_total", "Tarefas recusadas porque a fila estava cheia, por limite atingido.",
+    ("limit",)))
+JOBS_FINISHED = metrics.REGISTRY.register(metrics.Counter(
+    "botmanut_jobs_finished_total", "Tarefas assíncronas concluídas, por estado final.", ("status",)))
+JOB_QUEUE_WAIT = metrics.REGISTRY.register(metrics.Histogram(
+    "botmanut_job_queue_wait_seconds", "Tempo entre o envio da tarefa e o início da execução.", ("priority",)))
+
+
+class QueueFullError(RuntimeError):
+    """
+    A fila atingiu o limite de tarefas (ou de bytes) pendentes; 'retry_after' sugere quando
+    tentar de novo (s).
+    """
+
+    def __init__(self, message, retry_after=5):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class Job:
+    """Uma tarefa enfileirada: a entrada, o estado atual e, ao final, o resultado ou o erro."""
+
+    def __init__(self, payload, priority, size=0):
+        self.id = uuid.uuid4().hex
+        self.payload = payload
+        self.size = size
+        self.priority = priority
+        self.status = QUEUED
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+
+    def to_dict(self):
+        """Representação pública da tarefa (sem a entrada, que pode ser uma imagem grande)."""
+        data = {
+            'job_id': self.id,
+            'status': self.status,
+            'priority': self.priority,
+            'created_at': self.created_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at,
+        }
+        if self.status == DONE:
+            data['result'] = self.result
+        elif self.status == FAILED:
+            data['error'] = self.error
+        return data
+
+
+class JobQueue:
+    """
+    Fila de prioridade limitada, atendida por 'workers' threads que chamam handler(job).
+    O valor retornado pelo handler vira o resultado da tarefa; uma exceção a marca como falha,
+    com a mensagem da exceção em job.error.
+    As tarefas concluídas são descartadas 'ttl_seconds' após o término.
+    'max_queued_bytes' limita a soma dos tamanhos das entradas ainda em memória (tarefas na
+    fila ou em execução); None = sem limite.
+    """
+
+    def __init__(self, handler, workers=4, max_queued=100, ttl_seconds=900, name='tarefas', max_queued_bytes=None):
+        self.handler = handler
+        self.workers = workers
+        self.max_queued = max_queued
+        self.max_queued_bytes = max_queued_bytes
+        self.ttl_seconds = ttl_seconds
+        self.name = name
+        self._jobs = OrderedDict()  # job_id -> Job, em ordem de envio
+        self._heap = []
+        self._sequence = 0  # desempate: mesma prioridade, ordem de chegada
+        self._pending_bytes = 0  # entradas ainda em memória (na fila ou em execução)
+        self._condition = threading.Condition()
+        self._threads = []
+
+    def _start_workers(self):
+        # Chamado com o lock adquirido. As threads só são criadas no primeiro envio.
+        if self._threads:
+            return
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._work, name=f'{self.name}-{i}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def _purge_expired(self):
+        # Chamado com o lock adquirido.
+        limit = time.time() - self.ttl_seconds
+        expired = [job_id for job_id, job in self._jobs.items()
+                   if job.status in FINISHED_STATES and job.finished_at < limit]
+        for job_id in expired:
+            del self._jobs[job_id]
+
+    def submit(self, payload, priority='normal'):
+        """
+        Enfileira uma tarefa e retorna o Job; levanta QueueFullError se a fila estiver cheia
+        (em número de tarefas ou em bytes, quando a entrada tem tamanho, como bytes de imagem).
+        """
+        if priority not in PRIORITIES:
+            raise ValueError(f"Prioridade inválida: {priority!r} (use {', '.join(PRIORITIES)}).")
+        size = len(payload) if isinstance(payload, (bytes, bytearray)) else 0
+        with self._condition:
+            self._purge_expired()
+            if len(self._heap) >= self.max_queued:
+                JOBS_REJECTED.inc(limit='jobs')
+                raise QueueFullError("A fila de processamento está cheia. Tente novamente em instantes.")
+            if self.max_queued_bytes is not None and self._pending_bytes + size > self.max_queued_bytes:
+                JOBS_REJECTED.inc(limit='bytes')
+                raise QueueFullError("A fila de processamento está cheia. Tente novamente em instantes.")
+            job = Job(payload, priority, size)
+            self._pending_bytes += size
+            self._jobs[job.id] = job
+            self._sequence += 1
+            heapq.heappush(self._heap, (PRIORITIES[priority], self._sequence, job))
+            JOBS_SUBMITTED.inc(priority=priority)
+            self._start_workers()
+            self._condition.notify_all()
+        return job
+
+    def get(self, job_id):
+        """Retorna o Job, ou None se não existir ou já tiver expirado."""
+        with self._condition:
+            self._purge_expired()
+            return self._jobs.get(job_id)
+
+    def wait(self, job_id, timeout):
+        """Como 'get', mas espera até 'timeout' segundos pelo término da tarefa (long polling)."""
+        deadline = time.monotonic() + timeout
+        with self._condition:
+            job = self._jobs.get(job_id)
+            while job is not None and job.status not in FINISHED_STATES:
+                time_left = deadline - time.monotonic()
+                if time_left <= 0:
+                    break
+                self._condition.wait(time_left)
+            return job
+
+    def stats(self):
+        with self._condition:
+            counts = {state: 0 for state in (QUEUED, RUNNING, DONE, FAILED)}
+            for job in self._jobs.values():
+                counts[job.status] += 1
+            pending_bytes = self._pending_bytes
+        return {'workers': self.workers, 'max_queued': self.max_queued, 'pending_bytes': pending_bytes, **counts}
+
+    def _next_job(self):
+        with self._condition:
+            while not self._heap:
+                self._condition.wait()
+            _, _, job = heapq.heappop(self._heap)
+            job.status = RUNNING
+            job.started_at = time.time()
+        JOB_QUEUE_WAIT.observe(job.started_at - job.created_at, priority=job.priority)
+        return job
+
+    def _work(self):
+        while True:
+            job = self._next_job()
+            try:
+                result = self.handler(job)
+            except Exception as e:
+                print(f"ERRO: Falha na tarefa {job.id}: {e}", file=sys.stderr)
+                status, result, error = FAILED, None, str(e)
+            else:
+                status, error = DONE, None
+            with self._condition:
+                job.result = result
+                job.error = error
+                job.payload = None  # libera a imagem da memória
+                self._pending_bytes -= job.size
+                job.finished_at = time.time()
+                job.status = status  # por último: quem lê o estado sem o lock já encontra o resultado
+                self._condition.notify_all()
+            JOBS_FINISHED.inc(status=status)
@@ -0,0 +1,147 @@
+import os
+import sqlite3
+import sys
+import threading
+import time
+
+from near_duplicate import NEAR_DUPLICATE_TEXT_EDITS, normalize_text, same_page
+
+# --- Índice de Páginas de Manuais Pré-processadas ---
+# A frota usa um conjunto fixo de manuais. Em vez de simplificar as mesmas páginas pela Gemini
+# a cada requisição, as páginas são processadas antecipadamente (ingest_manuals.py) e guardadas
+# em um banco SQLite com índice de texto completo (FTS5). Em uma requisição, o texto do OCR é
+# procurado no índice (FTS5 com bm25, que acha candidatas mesmo com palavras lidas com erro); se
+# uma página for confirmada (mesmos números e negações, mesmas palavras a menos de poucas letras
+# trocadas pelo OCR, ver near_duplicate.same_page), a tradução e a simplificação pré-calculadas
+# são devolvidas sem chamar Translate nem Gemini.
+
+MANUAL_INDEX_PATH = os.getenv("MANUAL_INDEX_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                                "manual_index.sqlite3"))
+# Palavras do texto do OCR usadas na consulta FTS5 e número de candidatos verificados.
+QUERY_MAX_TERMS = 24
+MAX_CANDIDATES = 5
+# Edições toleradas por palavra ao confirmar uma candidata (0 = texto normalizado idêntico).
+# Uma foto de celular de uma página indexada a partir de um escaneamento raramente sai idêntica.
+MANUAL_INDEX_TEXT_EDITS = int(os.getenv("MANUAL_INDEX_TEXT_EDITS", str(NEAR_DUPLICATE_TEXT_EDITS)))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS paginas (
+    id INTEGER PRIMARY KEY,
+    hash_imagem TEXT UNIQUE NOT NULL,
+    manual TEXT,
+    origem TEXT,
+    texto_original TEXT NOT NULL,
+    texto_traduzido TEXT NOT NULL,
+    texto_simplificado TEXT NOT NULL,
+    criado_em REAL NOT NULL
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS paginas_fts USING fts5(texto, tokenize = 'unicode61 remove_diacritics 2');
+"""
+
+
+class ManualIndex:
+    """
+    Páginas pré-processadas com busca por texto completo. Aberto somente para leitura no app
+    (o arquivo é gerado offline e enviado junto no deploy) e para escrita pelo script de ingestão.
+    """
+
+    def __init__(self, db_path, writable=False):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._stats = {"lookups": 0, "matches": 0, "rejected": 0}
+        if writable:
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            self._db.executescript(SCHEMA)
+        else:
+            # Somente leitura: o sistema de arquivos do App Engine não permite escrita fora de /tmp.
+            self._db = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True, check_same_thread=False)
+        self.pages = self._db.execute("SELECT COUNT(*) FROM paginas").fetchone()[0]
+
+    def has_image(self, image_hash):
+        with self._lock:
+            return self._db.execute("SELECT 1 FROM paginas WHERE hash_imagem = ?", (image_hash,)).fetchone() is not None
+
+    def add_page(self, image_hash, original_text, translated_text, simplified_text, manual=None, source=None):
+        """Grava (ou substitui) uma página processada e a indexa pelo texto do OCR."""
+        with self._lock, self._db:
+            row = self._db.execute("SELECT id FROM paginas WHERE hash_imagem = ?", (image_hash,)).fetchone()
+            if row is not None:
+                self._db.execute("DELETE FROM paginas WHERE id = ?", row)
+                self._db.execute("DELETE FROM paginas_fts WHERE rowid = ?", row)
+            cursor = self._db.execute(
+                "INSERT INTO paginas (hash_imagem, manual, origem, texto_original, texto_traduzido, "
+                "texto_simplificado, criado_em) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (image_hash, manual, source, original_text, translated_text, simplified_text, time.time()),
+            )
+            self._db.execute("INSERT INTO paginas_fts (rowid, texto) VALUES (?, ?)",
+                             (cursor.lastrowid, normalize_text(original_text)))
+            if row is None:
+                self.pages += 1
+
+    def finish_ingestion(self):
+        """Compacta o banco e sai do modo WAL, para que possa ser aberto somente para leitura."""
+        with self._lock:
+            self._db.execute("INSERT INTO paginas_fts (paginas_fts) VALUES ('optimize')")
+            self._db.commit()
+            self._db.execute("PRAGMA journal_mode=DELETE")
+            self._db.execute("VACUUM")
+
+    @staticmethod
+    def _query(ocr_text):
+        """Consulta FTS5 (OR) com as palavras mais longas do texto, que são as mais distintivas."""
+        words = sorted(set(normalize_text(ocr_text).split()), key=len, reverse=True)
+        terms = [f'"{word}"' for word in words if len(word) > 2][:QUERY_MAX_TERMS]
+        return " OR ".join(terms)
+
+    def match(self, ocr_text):
+        """
+        Procura a página do manual correspondente ao texto do OCR. Retorna um dicionário com
+        'original_text', 'translated_text', 'simplified_text', 'manual' e 'source' da página
+        indexada, ou None se nenhuma candidata for confirmada. Letras trocadas pelo OCR em
+        palavras longas são toleradas (até MANUAL_INDEX_TEXT_EDITS por palavra); uma página que
+        difere em um número, uma negação ou na ordem dos passos não é confirmada.
+        """
+        query = self._query(ocr_text)
+        if not query:
+            return None
+        with self._lock:
+            self._stats["lookups"] += 1
+            rows = self._db.execute(
+                "SELECT p.texto_original, p.texto_traduzido, p.texto_simplificado, p.manual, p.origem "
+                "FROM paginas_fts JOIN paginas p ON p.id = paginas_fts.rowid "
+                "WHERE paginas_fts MATCH ? ORDER BY bm25(paginas_fts) LIMIT ?",
+                (query, MAX_CANDIDATES),
+            ).fetchall()
+        for original, translated, simplified, manual, source in rows:
+            if same_page(original, ocr_text, MANUAL_INDEX_TEXT_EDITS):
+                with self._lock:
+                    self._stats["matches"] += 1
+                return {
+                    'original_text': original,
+                    'translated_text': translated,
+                    'simplified_text': simplified,
+                    'manual': manual,
+                    'source': source,
+                }
+        if rows:
+            with self._lock:
+                self._stats["rejected"] += 1
+        return None
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats, pages=self.pages)
+        stats["hit_rate"] = stats["matches"] / stats["lookups"] if stats["lookups"] else 0.0
+        return stats
+
+
+def open_manual_index(db_path=None):
+    """Abre o índice para consultas, ou retorna None se o arquivo não existir (recurso desativado)."""
+    db_path = MANUAL_INDEX_PATH if db_path is None else db_path
+    if not db_path or not os.path.exists(db_path):
+        return None
+    try:
+        return ManualIndex(db_path)
+    except sqlite3.Error as e:
+        print(f"AVISO: Índice de manuais desativado ({db_path}): {e}", file=sys.stderr)
+        return None
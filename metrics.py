@@ -0,0 +1,265 @@
+import contextvars
+import json
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+# --- Métricas e Instrumentação do Pipeline ---
+# Antes, a única telemetria era o print(..., file=sys.stderr) nos erros, e não dava para saber
+# se um /process_image lento era culpa do Vision, do Translate ou da Gemini. Este módulo mantém,
+# sem dependências externas, contadores, gauges e histogramas no formato de texto do Prometheus
+# (exposto em /metrics), e um registro por requisição com o tempo de cada etapa, usado para
+# o cabeçalho Server-Timing e para uma linha de log estruturado (JSON) ao final da requisição.
+
+# Limites dos histogramas de latência, em segundos.
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+# Tamanho do upload, em bytes (10 KB a 16 MB).
+SIZE_BUCKETS = (10e3, 50e3, 100e3, 250e3, 500e3, 1e6, 2e6, 4e6, 8e6, 16e6)
+# Tamanho do texto do OCR, em caracteres.
+CHARS_BUCKETS = (0, 100, 250, 500, 1000, 2000, 4000, 8000, 16000)
+
+
+def _escape_label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names, values):
+    if not names:
+        return ""
+    pairs = ",".join(f'{name}="{_escape_label(value)}"' for name, value in zip(names, values))
+    return "{" + pairs + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    type_name = "untyped"
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(labels.get(name, "") for name in self.labelnames)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type_name}"]
+        with self._lock:
+            items = list(self._values.items())
+        for key, value in items:
+            lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}")
+        return lines
+
+
+class Counter(_Metric):
+    type_name = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+
+class Gauge(_Metric):
+    type_name = "gauge"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+
+class Histogram(_Metric):
+    type_name = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets) + (float("inf"),)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = {"counts": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state["counts"][i] += 1
+                    break
+            state["sum"] += value
+            state["count"] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type_name}"]
+        with self._lock:
+            items = [(key, dict(state, counts=list(state["counts"]))) for key, state in self._values.items()]
+        names = self.labelnames + ("le",)
+        for key, state in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, state["counts"]):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_format_labels(names, key + (_format_value(bound),))} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {state['sum']!r}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {state['count']}")
+        return lines
+
+
+class Registry:
+    """Conjunto de métricas e de coletores (funções chamadas a cada leitura de /metrics)."""
+
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def add_collector(self, collector):
+        """
+        'collector' é uma função sem argumentos que devolve uma lista de métricas já
+        preenchidas (útil para expor contadores mantidos por outros módulos, como o cache).
+        """
+        self._collectors.append(collector)
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        for collector in self._collectors:
+            try:
+                for metric in collector():
+                    lines.extend(metric.render())
+            except Exception as e:
+                print(f"AVISO: Falha em um coletor de métricas: {e}", file=sys.stderr)
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+REQUEST_LATENCY = REGISTRY.register(Histogram(
+    "botmanut_http_request_duration_seconds", "Duração das requisições HTTP.", ("route", "status")))
+STAGE_LATENCY = REGISTRY.register(Histogram(
+    "botmanut_stage_duration_seconds", "Duração de cada etapa do pipeline.", ("stage", "backend")))
+STAGE_IN_FLIGHT = REGISTRY.register(Gauge(
+    "botmanut_stage_in_flight", "Chamadas em andamento em cada etapa do pipeline.", ("stage", "backend")))
+STAGE_ERRORS = REGISTRY.register(Counter(
+    "botmanut_stage_errors_total", "Erros em cada etapa do pipeline, por backend e tipo de erro.",
+    ("stage", "backend", "error")))
+REQUEST_BYTES = REGISTRY.register(Histogram(
+    "botmanut_upload_bytes", "Tamanho das imagens recebidas, em bytes.", (), buckets=SIZE_BUCKETS))
+OCR_TEXT_CHARS = REGISTRY.register(Histogram(
+    "botmanut_ocr_text_chars", "Tamanho do texto retornado pelo OCR, em caracteres.", (), buckets=CHARS_BUCKETS))
+
+
+# --- Registro por requisição ---
+
+class RequestRecord:
+    """Tempo de cada etapa e campos extras de uma requisição (seguro entre threads)."""
+
+    def __init__(self, request_id):
+        self.request_id = request_id
+        self.started_at = time.perf_counter()
+        self.stages = {}
+        self.fields = {}
+        self._lock = threading.Lock()
+
+    def add_stage(self, stage, seconds):
+        with self._lock:
+            self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    def set_field(self, name, value):
+        with self._lock:
+            self.fields[name] = value
+
+    def add_to_field(self, name, amount):
+        """Soma 'amount' a um campo numérico (iniciado em zero), de forma atômica."""
+        with self._lock:
+            self.fields[name] = self.fields.get(name, 0) + amount
+
+    def server_timing(self):
+        """Formata os tempos por etapa no cabeçalho padrão Server-Timing (em milissegundos)."""
+        with self._lock:
+            stages = list(self.stages.items())
+        return ", ".join(f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in stages)
+
+    def log_line(self, **extra):
+        """Linha de log estruturado (JSON), reconhecida pelo Cloud Logging no App Engine."""
+        with self._lock:
+            entry = {
+                "severity": "INFO",
+                "message": "requisição concluída",
+                "request_id": self.request_id,
+                "duration_ms": round((time.perf_counter() - self.started_at) * 1000, 1),
+                "stages_ms": {stage: round(seconds * 1000, 1) for stage, seconds in self.stages.items()},
+                **self.fields,
+            }
+        entry.update(extra)
+        return json.dumps(entry, ensure_ascii=False)
+
+
+_current_request = contextvars.ContextVar("botmanut_request", default=None)
+
+
+def start_request(request_id):
+    """Cria o registro da requisição atual e o associa ao contexto de execução."""
+    record = RequestRecord(request_id)
+    _current_request.set(record)
+    return record
+
+
+def current_request():
+    """Registro da requisição em andamento, ou None (ex.: fora de uma requisição)."""
+    return _current_request.get()
+
+
+@contextmanager
+def track_stage(stage, backend):
+    """
+    Instrumenta uma etapa do pipeline: histograma de latência, gauge de chamadas em andamento,
+    contador de erros por backend e o tempo acumulado no registro da requisição atual.
+    """
+    STAGE_IN_FLIGHT.inc(stage=stage, backend=backend)
+    started_at = time.perf_counter()
+    try:
+        yield
+    except Exception as e:
+        STAGE_ERRORS.inc(stage=stage, backend=backend, error=type(e).__name__)
+        raise
+    finally:
+        elapsed = time.perf_counter() - started_at
+        STAGE_IN_FLIGHT.dec(stage=stage, backend=backend)
+        STAGE_LATENCY.observe(elapsed, stage=stage, backend=backend)
+        record = _current_request.get()
+        if record is not None:
+            record.add_stage(stage, elapsed)
+
+
+def gauges_from_stats(prefix, documentation, stats):
+    """Converte um dicionário de contadores (ex.: ResultCache.stats()) em gauges para o /metrics."""
+    gauges = []
+    for key, value in stats.items():
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            gauge = Gauge(f"{prefix}_{key}", f"{documentation} ({key}).")
+            gauge.set(value)
+            gauges.append(gauge)
+    return gauges
@@ -0,0 +1,363 @@
+import os
+import re
+import threading
+import weakref
+
+import clients
+import metrics
+import resilience
+from chunking import NOTICE_START, STEP_START, estimate_tokens
+
+# --- Roteamento de Modelo e Orçamento de Saída da Simplificação ---
+# Toda simplificação ia para o mesmo modelo (gemini-1.5-flash), sem limite de tokens de saída.
+# Agora, cada texto (ou trecho, ver chunking.py) recebe uma rota conforme o tamanho e a
+# complexidade:
+#   - 'skip': texto curto, já simples e em português; volta como está, sem chamar a Gemini;
+#   - 'light': texto curto e sem elementos críticos (muitos valores numéricos, passos) vai para
+#     um modelo mais leve e barato;
+#   - 'standard': os demais vão para o modelo padrão, e sempre que houver um aviso de segurança
+#     (WARNING/CAUTION/ATENÇÃO/CUIDADO etc.).
+# Em todas as rotas, max_output_tokens acompanha o tamanho da entrada (a simplificação deve ser
+# mais curta que o original). Uma resposta cortada pelo limite é refeita uma única vez no
+# modelo padrão com o dobro do limite; se vier cortada de novo, a simplificação falha (uma
+# instrução incompleta não pode ser servida nem ir para os caches).
+# Os tokens de entrada e saída (usage_metadata) e a latência são contabilizados por rota.
+# Cada página tem um orçamento de tokens dimensionado pelos seus trechos (page_budget), com
+# folga para as novas tentativas. Um trecho que não cabe mais no orçamento da página não falha:
+# vai para o modelo leve (mais barato) e é enviado mesmo acima do orçamento, o que é contado em
+# botmanut_gemini_budget_overruns_total. O limite rígido é o da requisição (request_budget,
+# somando todas as páginas, ex.: um lote de 20 páginas): esgotado, o trecho falha com a rota
+# 'exhausted', sem chamar a Gemini. Com pouco tempo restante no prazo da requisição, a rota
+# 'standard' também é trocada pela 'light'; trechos com avisos de segurança ficam sempre no
+# modelo padrão.
+#
+# MODEL_ROUTING=0 desativa o roteamento (sempre o modelo padrão, sem limite de saída).
+
+ROUTING_ENABLED = os.getenv('MODEL_ROUTING', '1') != '0'
+
+STANDARD_MODEL = clients.GEMINI_MODEL_NAME
+LIGHT_MODEL = os.getenv('GEMINI_LIGHT_MODEL', 'gemini-1.5-flash-8b')
+
+# Textos de até ROUTING_SKIP_MAX_WORDS palavras, em português e simples, dispensam a Gemini.
+SKIP_MAX_WORDS = int(os.getenv('ROUTING_SKIP_MAX_WORDS', '30'))
+SKIP_MAX_SENTENCE_WORDS = 15
+# Rota 'light': até ROUTING_LIGHT_MAX_TOKENS tokens de entrada e complexidade abaixo do limite.
+LIGHT_MAX_TOKENS = int(os.getenv('ROUTING_LIGHT_MAX_TOKENS', '250'))
+LIGHT_MAX_COMPLEXITY = float(os.getenv('ROUTING_LIGHT_MAX_COMPLEXITY', '3'))
+
+# max_output_tokens = tokens de entrada * razão + margem, dentro dos limites.
+OUTPUT_RATIO = float(os.getenv('ROUTING_OUTPUT_RATIO', '1.0'))
+OUTPUT_MARGIN_TOKENS = 64
+MIN_OUTPUT_TOKENS = 128
+MAX_OUTPUT_TOKENS = int(os.getenv('ROUTING_MAX_OUTPUT_TOKENS', '1024'))
+
+# Orçamento de tokens (entrada + saída) por página, somando todos os trechos e novas tentativas:
+# o previsto para os trechos (entrada + limite de saída de cada um) vezes PAGE_BUDGET_FACTOR,
+# e no mínimo ROUTING_PAGE_TOKEN_BUDGET.
+PAGE_TOKEN_BUDGET = int(os.getenv('ROUTING_PAGE_TOKEN_BUDGET', '12000'))
+PAGE_BUDGET_FACTOR = float(os.getenv('ROUTING_PAGE_BUDGET_FACTOR', '1.5'))
+# Limite de tokens (entrada + saída) de uma requisição inteira, somando as páginas.
+REQUEST_TOKEN_BUDGET = int(os.getenv('ROUTING_REQUEST_TOKEN_BUDGET', '200000'))
+
+# Preços de tabela (USD por milhão de tokens: entrada, saída), usados apenas para estimar o custo.
+MODEL_PRICES = {
+    'gemini-1.5-flash': (0.075, 0.30),
+    'gemini-1.5-flash-8b': (0.0375, 0.15),
+}
+
+# Latência esperada (s) de cada rota antes das primeiras medições; depois, média móvel exponencial.
+INITIAL_LATENCY_SECONDS = {'light': 1.5, 'standard': 3.0}
+LATENCY_SMOOTHING = 0.2
+
+# Palavras muito comuns, para distinguir português de inglês sem chamar a API.
+PORTUGUESE_WORDS = {'o', 'os', 'de', 'da', 'das', 'dos', 'e', 'em', 'no', 'na', 'nos', 'nas', 'um', 'uma',
+                    'para', 'com', 'não', 'que', 'por', 'se', 'ao', 'é', 'mais', 'seu', 'sua', 'antes', 'após'}
+ENGLISH_WORDS = {'the', 'of', 'and', 'to', 'in', 'is', 'with', 'for', 'on', 'be', 'that', 'this', 'it',
+                 'are', 'by', 'or', 'from', 'all', 'must', 'before', 'after', 'make', 'sure'}
+WORD = re.compile(r"[^\W\d_]+")
+# Valores com unidade ou tolerância (torques, pressões, folgas): erros aqui são críticos.
+MEASUREMENT = re.compile(r"\d+(?:[.,]\d+)?\s*(?:-|a|to)?\s*\d*(?:[.,]\d+)?\s*"
+                         r"(?:N\.?m|lbf\.?in|lbf\.?ft|psi|bar|kPa|mm|in|°C|°F|kg|lb)\b", re.IGNORECASE)
+SENTENCE = re.compile(r"[.!?]+(?:\s|$)")
+# Avisos de segurança, em qualquer ponto do texto (no original em inglês ou já traduzidos).
+SAFETY_NOTICE = re.compile(r"\b(?:WARNING|CAUTION|DANGER|ATENÇÃO|CUIDADO|AVISO|ADVERTÊNCIA|PRECAUÇÃO|PERIGO)\b",
+                           re.IGNORECASE)
+
+ROUTE_DECISIONS = metrics.REGISTRY.register(metrics.Counter(
+    "botmanut_simplify_routes_total", "Rotas escolhidas para a simplificação, por motivo.", ("route", "reason")))
+ROUTE_TOKENS = metrics.REGISTRY.register(metrics.Counter(
+    "botmanut_gemini_tokens_total", "Tokens usados na Gemini (usage_metadata), por rota e tipo.", ("route", "kind")))
+ROUTE_LATENCY = metrics.REGISTRY.register(metrics.Histogram(
+    "botmanut_gemini_route_latency_seconds", "Latência das chamadas à Gemini, por rota.", ("route",)))
+ROUTE_COST = metrics.REGISTRY.register(metrics.Counter(
+    "botmanut_gemini_cost_usd_total", "Custo estimado das chamadas à Gemini (preços de tabela), por rota.", ("route",)))
+TRUNCATIONS = metrics.REGISTRY.register(metrics.Counter(
+    "botmanut_gemini_truncated_total", "Respostas cortadas pelo limite de tokens de saída, por rota.", ("route",)))
+BUDGET_OVERRUNS = metrics.REGISTRY.register(metrics.Counter(
+    "botmanut_gemini_budget_overruns_total",
+    "Chamadas enviadas acima do orçamento de tokens da página (reservas forçadas), por rota.", ("route",)))
+BUDGET_OVERRUN_TOKENS = metrics.REGISTRY.register(metrics.Counter(
+    "botmanut_gemini_budget_overrun_tokens_total",
+    "Tokens reservados acima do orçamento da página pelas reservas forçadas, por rota.", ("route",)))
+
+
+class Route:
+    """Destino de uma simplificação: o modelo e o limite de tokens de saída (None = sem limite)."""
+
+    def __init__(self, name, model=None, max_output_tokens=None, reason=''):
+        self.name = name
+        self.model = model
+        self.max_output_tokens = max_output_tokens
+        self.reason = reason
+        # Tokens reservados no orçamento da página para esta chamada (ver _reserve).
+        self.reserved = 0
+
+    @property
+    def skip(self):
+        return self.name == 'skip'
+
+    @property
+    def exhausted(self):
+        """O orçamento da requisição acabou: o trecho falha sem chamar a Gemini."""
+        return self.name == 'exhausted'
+
+    def __repr__(self):
+        return f"Route({self.name!r}, {self.model!r}, {self.max_output_tokens!r}, {self.reason!r})"
+
+
+class TokenBudget:
+    """
+    Orçamento de tokens de uma página (ou de uma requisição). Cada chamada reserva antes o
+    máximo que pode gastar (entrada + limite de saída) e, ao final, devolve o que não usou.
+    Com 'parent' (o orçamento da requisição), cada reserva também precisa caber nele. Seguro
+    entre threads, já que os trechos e as páginas são simplificados em paralelo.
+    """
+
+    def __init__(self, max_tokens=None, parent=None):
+        self.max_tokens = PAGE_TOKEN_BUDGET if max_tokens is None else max_tokens
+        self.parent = parent
+        self._used = 0
+        self._lock = threading.Lock()
+
+    def reserve(self, tokens, force=False):
+        """
+        Reserva 'tokens' tokens se couberem no orçamento; retorna se a reserva foi feita.
+        Com force=True, reserva mesmo acima do limite deste orçamento (a chamada precisa
+        acontecer), mas nunca acima do limite de 'parent'.
+        """
+        with self._lock:
+            if not force and self._used + tokens > self.max_tokens:
+                return False
+            if self.parent is not None and not self.parent.reserve(tokens):
+                return False
+            self._used += tokens
+            return True
+
+    def settle(self, reserved, used):
+        """Troca a reserva pelo consumo real informado pela API."""
+        with self._lock:
+            self._used += used - reserved
+        if self.parent is not None:
+            self.parent.settle(reserved, used)
+
+    def overrun(self, tokens):
+        """Quanto de uma reserva de 'tokens' já feita ficou acima do limite (0 se coube)."""
+        with self._lock:
+            return max(0, min(tokens, self._used - self.max_tokens))
+
+    @property
+    def used(self):
+        with self._lock:
+            return self._used
+
+
+class _LatencyTracker:
+    """Média móvel exponencial da latência de cada rota."""
+
+    def __init__(self):
+        self._averages = dict(INITIAL_LATENCY_SECONDS)
+        self._lock = threading.Lock()
+
+    def observe(self, route, seconds):
+        with self._lock:
+            previous = self._averages.get(route, seconds)
+            self._averages[route] = previous + LATENCY_SMOOTHING * (seconds - previous)
+
+    def expected(self, route):
+        with self._lock:
+            return self._averages.get(route, 0.0)
+
+
+latency_tracker = _LatencyTracker()
+
+
+def is_portuguese(text):
+    """Heurística: o texto tem mais palavras comuns do português que do inglês."""
+    words = [word.lower() for word in WORD.findall(text)]
+    portuguese = sum(word in PORTUGUESE_WORDS for word in words)
+    english = sum(word in ENGLISH_WORDS for word in words)
+    return portuguese > english
+
+
+def complexity(text):
+    """
+    Pontuação de complexidade: avisos (WARNING/ATENÇÃO) e valores com unidade pesam mais,
+    porque um erro neles é crítico; passos numerados e palavras longas (jargão) somam menos.
+    """
+    lines = text.splitlines()
+    notices = sum(1 for line in lines if NOTICE_START.match(line))
+    steps = sum(1 for line in lines if STEP_START.match(line))
+    words = WORD.findall(text)
+    long_words = sum(1 for word in words if len(word) >= 13) / len(words) if words else 0.0
+    return 2 * notices + len(MEASUREMENT.findall(text)) + 0.5 * steps + 10 * long_words
+
+
+def is_simple(text):
+    """Texto curto, sem avisos nem passos, com frases curtas: não há o que simplificar."""
+    words = WORD.findall(text)
+    if not words or len(words) > SKIP_MAX_WORDS:
+        return False
+    if any(NOTICE_START.match(line) or STEP_START.match(line) for line in text.splitlines()):
+        return False
+    sentences = max(len(SENTENCE.findall(text)), 1)
+    return len(words) / sentences <= SKIP_MAX_SENTENCE_WORDS
+
+
+def output_limit(input_tokens):
+    """Limite de tokens de saída proporcional à entrada."""
+    return max(MIN_OUTPUT_TOKENS, min(MAX_OUTPUT_TOKENS, int(input_tokens * OUTPUT_RATIO) + OUTPUT_MARGIN_TOKENS))
+
+
+_request_budgets = weakref.WeakKeyDictionary()  # RequestRecord -> TokenBudget
+_request_budgets_lock = threading.Lock()
+
+
+def request_budget():
+    """
+    Orçamento de tokens da requisição atual (metrics.current_request()), compartilhado por
+    todas as suas páginas e trechos; None fora de uma requisição (ex.: ingestão offline).
+    """
+    record = metrics.current_request()
+    if record is None:
+        return None
+    with _request_budgets_lock:
+        budget = _request_budgets.get(record)
+        if budget is None:
+            budget = _request_budgets[record] = TokenBudget(REQUEST_TOKEN_BUDGET)
+        return budget
+
+
+def page_budget(texts, prompt_overhead_tokens=0):
+    """
+    Orçamento para simplificar os trechos 'texts' de uma página: entrada (texto + partes fixas
+    do prompt) e limite de saída de cada trecho, com folga para novas tentativas. Cada reserva
+    também conta no orçamento da requisição (request_budget).
+    """
+    needed = sum(estimate_tokens(text) + prompt_overhead_tokens + output_limit(estimate_tokens(text))
+                 for text in texts)
+    return TokenBudget(max(PAGE_TOKEN_BUDGET, int(needed * PAGE_BUDGET_FACTOR)), parent=request_budget())
+
+
+def choose_route(text, prompt, budget=None):
+    """
+    Escolhe a rota para simplificar 'text' (o prompt já montado é usado para estimar os tokens
+    de entrada). Com um orçamento, reserva os tokens da chamada; se o orçamento da página tiver
+    acabado, o trecho vai para o modelo leve, com o mesmo limite de saída, em vez de falhar. Se
+    o da requisição tiver acabado, retorna a rota 'exhausted'.
+    """
+    if not ROUTING_ENABLED:
+        return _decided(Route('standard', STANDARD_MODEL, None, 'disabled'))
+
+    if is_simple(text) and is_portuguese(text):
+        return _decided(Route('skip', reason='simple'))
+
+    input_tokens = estimate_tokens(text)
+    if SAFETY_NOTICE.search(text):
+        route = Route('standard', STANDARD_MODEL, output_limit(input_tokens), 'notice')
+    elif input_tokens <= LIGHT_MAX_TOKENS and complexity(text) < LIGHT_MAX_COMPLEXITY:
+        route = Route('light', LIGHT_MODEL, output_limit(input_tokens), 'short')
+    else:
+        route = Route('standard', STANDARD_MODEL, output_limit(input_tokens), 'complex')
+
+    # Prazo curto: o modelo leve responde antes. Avisos de segurança nunca vão para ele.
+    time_left = resilience.remaining()
+    if route.reason == 'complex' and time_left is not None and time_left < latency_tracker.expected('standard'):
+        route = Route('light', LIGHT_MODEL, route.max_output_tokens, 'deadline')
+
+    if budget is not None and not _reserve(route, estimate_tokens(prompt), budget):
+        if route.reason == 'complex':
+            route = Route('light', LIGHT_MODEL, route.max_output_tokens, 'budget')
+        if not _reserve(route, estimate_tokens(prompt), budget, force=True):
+            return _decided(Route('exhausted', reason='request_budget'))
+        overrun = budget.overrun(route.reserved)
+        if overrun:
+            BUDGET_OVERRUNS.inc(route=route.name)
+            BUDGET_OVERRUN_TOKENS.inc(overrun, route=route.name)
+            record = metrics.current_request()
+            if record is not None:
+                record.add_to_field('gemini_budget_overrun_tokens', overrun)
+    return _decided(route)
+
+
+def escalate(route, prompt, budget=None):
+    """
+    Rota para refazer uma resposta cortada: modelo padrão com o dobro do limite, ou None.
+    Só há uma nova tentativa: uma rota que já é a refeita não é refeita de novo.
+    """
+    if route.reason == 'truncated' or route.max_output_tokens is None:
+        return None
+    retry = Route('standard', STANDARD_MODEL, 2 * route.max_output_tokens, 'truncated')
+    if budget is not None and not _reserve(retry, estimate_tokens(prompt), budget):
+        return None
+    return _decided(retry)
+
+
+def _reserve(route, prompt_tokens, budget, force=False):
+    """
+    Reserva entrada + limite de saída no orçamento. O limite não é reduzido para caber: uma
+    resposta cortada teria de ser refeita (ou descartada), o que custa mais.
+    """
+    tokens = prompt_tokens + route.max_output_tokens
+    if not budget.reserve(tokens, force):
+        return False
+    route.reserved = tokens
+    return True
+
+
+def _decided(route):
+    ROUTE_DECISIONS.inc(route=route.name, reason=route.reason)
+    record = metrics.current_request()
+    if record is not None:
+        record.set_field('simplify_route', route.name)
+    return route
+
+
+def estimated_cost(model, prompt_tokens, response_tokens):
+    """Custo estimado em USD (0 para modelos sem preço conhecido)."""
+    input_price, output_price = MODEL_PRICES.get(model, (0.0, 0.0))
+    return (prompt_tokens * input_price + response_tokens * output_price) / 1e6
+
+
+def record_generation(route, generation, seconds, budget=None):
+    """Contabiliza tokens, custo e latência de uma chamada e acerta a reserva no orçamento."""
+    ROUTE_TOKENS.inc(generation.prompt_tokens, route=route.name, kind='prompt')
+    ROUTE_TOKENS.inc(generation.response_tokens, route=route.name, kind='response')
+    ROUTE_COST.inc(estimated_cost(route.model, generation.prompt_tokens, generation.response_tokens), route=route.name)
+    ROUTE_LATENCY.observe(seconds, route=route.name)
+    latency_tracker.observe(route.name, seconds)
+    if generation.truncated:
+        TRUNCATIONS.inc(route=route.name)
+    if budget is not None and route.reserved:
+        budget.settle(route.reserved, generation.prompt_tokens + generation.response_tokens)
+        route.reserved = 0
+    record = metrics.current_request()
+    if record is not None:
+        record.add_to_field('gemini_prompt_tokens', generation.prompt_tokens)
+        record.add_to_field('gemini_response_tokens', generation.response_tokens)
+
+
+def release(route, budget=None):
+    """Devolve ao orçamento a reserva de uma chamada que falhou sem resposta."""
+    if budget is not None and route.reserved:
+        budget.settle(route.reserved, 0)
+        route.reserved = 0
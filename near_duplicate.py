@@ -0,0 +1,315 @@
+import hashlib
+import io
+import os
+import re
+import sqlite3
+import sys
+import threading
+import time
+import unicodedata
+
+import numpy as np
+from PIL import Image, ImageOps
+
+# --- Detecção de Quase Duplicatas ---
+# Duas fotos da mesma página do manual nunca têm os mesmos bytes (ângulo, iluminação, ruído
+# do JPEG), então o cache indexado pelo hash SHA-256 da imagem quase nunca acerta repetições
+# reais. Este módulo calcula impressões digitais tolerantes a essas variações:
+#   - da imagem: pHash (DCT) e dHash (gradientes), comparados pela distância de Hamming;
+#   - do texto do OCR normalizado: SimHash de trigramas de palavras.
+# As impressões ficam em um índice persistente (SQLite), carregado em memória em uma matriz
+# NumPy na qual a busca por raio de Hamming é vetorizada.
+# O índice guarda apenas a chave do resultado no cache de resultados (ResultCache).
+#
+# A busca pelo texto (depois do OCR) acha candidatos pelo SimHash e só reaproveita um resultado
+# se same_page confirmar a mesma página: a mesma sequência de palavras depois de removido o
+# ruído do OCR (maiúsculas, acentos, pontuação, espaços), tolerando poucas letras trocadas em
+# palavras longas, com os números e as negações idênticos. Uma similaridade alta não basta:
+# "DO NOT OPERATE" e "DO OPERATE", ou dois passos trocados de ordem, são instruções diferentes.
+# A busca pela imagem (antes do OCR) não tem como ser confirmada e fotos de páginas que diferem
+# só em um valor (ex.: torque 25 vs. 35) ficam a poucos bits de distância; por isso ela vem
+# desativada e deve ser ligada (NEAR_DUPLICATE_IMAGE=1) apenas com limites bem estritos.
+
+NEAR_DUPLICATE = os.getenv("NEAR_DUPLICATE", "1") != "0"
+NEAR_DUPLICATE_IMAGE = os.getenv("NEAR_DUPLICATE_IMAGE", "0") != "0"
+NEAR_DUPLICATE_PATH = os.getenv("NEAR_DUPLICATE_PATH", "/tmp/botmanut_quase_duplicatas.sqlite3")
+NEAR_DUPLICATE_TTL_SECONDS = int(os.getenv("NEAR_DUPLICATE_TTL_SECONDS", str(7 * 24 * 3600)))
+# Máximo de itens por índice (em memória e no SQLite, que por padrão fica em /tmp, na RAM da
+# instância do App Engine Standard). Acima dele, o quarto mais antigo é descartado.
+NEAR_DUPLICATE_MAX_ENTRIES = int(os.getenv("NEAR_DUPLICATE_MAX_ENTRIES", "20000"))
+# Distâncias máximas (em bits) para considerar duas imagens a mesma página.
+# pHash e dHash têm 256 bits cada; as duas condições precisam ser satisfeitas.
+NEAR_DUPLICATE_PHASH_DISTANCE = int(os.getenv("NEAR_DUPLICATE_PHASH_DISTANCE", "16"))
+NEAR_DUPLICATE_DHASH_DISTANCE = int(os.getenv("NEAR_DUPLICATE_DHASH_DISTANCE", "16"))
+# Distância máxima do SimHash do texto (64 bits) na busca por candidatos: cada palavra lida
+# com erro muda três trigramas e alguns bits. Os candidatos ainda passam por same_page.
+NEAR_DUPLICATE_TEXT_DISTANCE = int(os.getenv("NEAR_DUPLICATE_TEXT_DISTANCE", "10"))
+# Edições (letra trocada, incluída ou removida) toleradas por palavra na confirmação (same_page);
+# 0 exige o mesmo texto normalizado. Palavras curtas, com dígitos ou negações nunca são toleradas,
+# e no máximo 1 em cada 10 palavras pode diferir.
+NEAR_DUPLICATE_TEXT_EDITS = int(os.getenv("NEAR_DUPLICATE_TEXT_EDITS", "1"))
+MIN_TOLERANT_WORD_LENGTH = 6
+MAX_DIFFERING_WORDS_RATIO = 0.1
+# Negações (já normalizadas, ver normalize_text): trocá-las inverte a instrução.
+NEGATIONS = {"no", "not", "never", "nor", "none", "cannot", "dont", "without", "nao", "nunca", "nem",
+             "nenhum", "nenhuma", "sem", "jamais"}
+
+HASH_SIZE = 16  # pHash e dHash de 16x16 = 256 bits
+PHASH_FACTOR = 4  # a DCT é calculada sobre uma imagem 4x maior que o hash (64x64)
+
+NUMBER = re.compile(r"\d+(?:[.,]\d+)*")
+
+
+def hamming(a, b):
+    """Número de bits diferentes entre dois hashes inteiros."""
+    return (a ^ b).bit_count()
+
+
+def _bits_to_int(bits):
+    value = 0
+    for bit in bits.flatten():
+        value = (value << 1) | int(bit)
+    return value
+
+
+def _dct_matrix(n):
+    """Matriz da DCT-II ortonormal de tamanho n (a DCT 2D é M @ X @ M.T)."""
+    k = np.arange(n)[:, None]
+    i = np.arange(n)[None, :]
+    matrix = np.cos(np.pi * (2 * i + 1) * k / (2 * n)) * np.sqrt(2.0 / n)
+    matrix[0] /= np.sqrt(2.0)
+    return matrix
+
+
+_DCT = _dct_matrix(HASH_SIZE * PHASH_FACTOR)
+
+
+def phash(image):
+    """pHash: sinal das frequências baixas da DCT em relação à mediana (imagem em tons de cinza)."""
+    size = HASH_SIZE * PHASH_FACTOR
+    pixels = np.asarray(image.resize((size, size), Image.Resampling.LANCZOS), dtype=np.float64)
+    low = (_DCT @ pixels @ _DCT.T)[:HASH_SIZE, :HASH_SIZE]
+    return _bits_to_int(low > np.median(low))
+
+
+def dhash(image):
+    """dHash: se cada pixel é mais claro que o vizinho à direita (imagem em tons de cinza)."""
+    pixels = np.asarray(image.resize((HASH_SIZE + 1, HASH_SIZE), Image.Resampling.LANCZOS), dtype=np.int16)
+    return _bits_to_int(pixels[:, 1:] > pixels[:, :-1])
+
+
+def image_fingerprint(image_content):
+    """Retorna (phash, dhash) da imagem, ou None se ela não puder ser decodificada."""
+    try:
+        with Image.open(io.BytesIO(image_content)) as original:
+            # draft() deixa o decodificador JPEG reduzir a imagem já na leitura (muito mais rápido).
+            original.draft("L", (HASH_SIZE * PHASH_FACTOR * 4, HASH_SIZE * PHASH_FACTOR * 4))
+            image = ImageOps.exif_transpose(original).convert("L")
+            return phash(image), dhash(image)
+    except Exception as e:
+        print(f"AVISO: Falha ao calcular o hash perceptual da imagem: {e}", file=sys.stderr)
+        return None
+
+
+def normalize_text(text):
+    """Minúsculas, sem acentos, sem pontuação e com espaços simples (o ruído típico do OCR)."""
+    text = unicodedata.normalize("NFKD", text.lower())
+    text = "".join(ch for ch in text if not unicodedata.combining(ch))
+    return " ".join(re.findall(r"\w+", text))
+
+
+def simhash(text, bits=64):
+    """SimHash dos trigramas de palavras do texto normalizado."""
+    words = normalize_text(text).split()
+    shingles = [" ".join(words[i:i + 3]) for i in range(max(len(words) - 2, 1))]
+    weights = [0] * bits
+    for shingle in shingles:
+        value = int.from_bytes(hashlib.blake2b(shingle.encode("utf-8"), digest_size=bits // 8).digest(), "big")
+        for bit in range(bits):
+            weights[bit] += 1 if value >> bit & 1 else -1
+    return sum(1 << bit for bit in range(bits) if weights[bit] > 0)
+
+
+def within_edits(a, b, max_edits):
+    """Se a distância de edição (Levenshtein) entre 'a' e 'b' é no máximo 'max_edits'."""
+    if abs(len(a) - len(b)) > max_edits:
+        return False
+    previous = list(range(len(b) + 1))
+    for i, char_a in enumerate(a, 1):
+        current = [i]
+        for j, char_b in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (char_a != char_b)))
+        if min(current) > max_edits:
+            return False
+        previous = current
+    return previous[-1] <= max_edits
+
+
+def _tolerated(word_a, word_b, max_edits):
+    """Se duas palavras diferentes podem ser a mesma lida com ruído pelo OCR."""
+    if word_a in NEGATIONS or word_b in NEGATIONS:
+        return False
+    if min(len(word_a), len(word_b)) < MIN_TOLERANT_WORD_LENGTH or not (word_a.isalpha() and word_b.isalpha()):
+        return False
+    return within_edits(word_a, word_b, max_edits)
+
+
+def same_page(text_a, text_b, max_edits=None):
+    """
+    Confirma que dois textos do OCR são a mesma página: os mesmos números (torques, medidas,
+    códigos de peças, com os separadores decimais) e as mesmas palavras normalizadas
+    (normalize_text), na mesma ordem. Palavras longas podem diferir em até 'max_edits' letras
+    (padrão: NEAR_DUPLICATE_TEXT_EDITS), em no máximo 1 de cada 10 palavras; negações,
+    palavras curtas e palavras com dígitos precisam ser idênticas. Qualquer palavra a mais ou
+    a menos, ou passos em outra ordem, é tratada como outra página.
+    """
+    if NUMBER.findall(text_a) != NUMBER.findall(text_b):
+        return False
+    words_a, words_b = normalize_text(text_a).split(), normalize_text(text_b).split()
+    if len(words_a) != len(words_b):
+        return False
+    max_edits = NEAR_DUPLICATE_TEXT_EDITS if max_edits is None else max_edits
+    differing = 0
+    for word_a, word_b in zip(words_a, words_b):
+        if word_a == word_b:
+            continue
+        if not max_edits or not _tolerated(word_a, word_b, max_edits):
+            return False
+        differing += 1
+    return differing <= MAX_DIFFERING_WORDS_RATIO * len(words_a)
+
+
+def _to_words(value, words):
+    """Divide um hash inteiro em palavras de 64 bits (para comparação vetorizada no NumPy)."""
+    return [(value >> (64 * i)) & 0xFFFFFFFFFFFFFFFF for i in range(words)]
+
+
+class NearDuplicateIndex:
+    """
+    Índice de impressões digitais -> chave no cache de resultados, persistido em SQLite e
+    mantido em memória em uma matriz NumPy. Cada item pode ter um hash extra de confirmação
+    (o dHash das imagens). Seguro para uso entre threads.
+
+    A busca compara a consulta com todos os itens de uma vez (XOR + contagem de bits
+    vetorizados): poucos milissegundos para 200 mil hashes de 64 bits. Com os raios usados aqui (10 de 64
+    bits), uma BK-tree em Python visitaria boa parte dos nós e seria mais lenta que isso.
+    """
+
+    def __init__(self, db_path=None, table="impressoes", bits=64, extra_bits=0,
+                 ttl_seconds=NEAR_DUPLICATE_TTL_SECONDS, max_entries=NEAR_DUPLICATE_MAX_ENTRIES):
+        self.table = table
+        self.max_entries = max_entries
+        self._words = (bits + 63) // 64
+        self._extra_words = (extra_bits + 63) // 64
+        self._rows = np.zeros((1024, self._words + self._extra_words), dtype=np.uint64)
+        self._keys = []
+        self._lock = threading.Lock()
+        self._stats = {"lookups": 0, "matches": 0, "rejected": 0, "added": 0, "evicted": 0}
+
+        self._db = None
+        if db_path:
+            try:
+                self._db = sqlite3.connect(db_path, check_same_thread=False)
+                self._db.execute("PRAGMA journal_mode=WAL")
+                self._db.execute(
+                    f"CREATE TABLE IF NOT EXISTS {table} ("
+                    "hash TEXT NOT NULL, extra TEXT, chave TEXT NOT NULL, criado_em REAL NOT NULL)"
+                )
+                # Entradas antigas apontam para resultados que já saíram do cache.
+                self._db.execute(f"DELETE FROM {table} WHERE criado_em < ?", (time.time() - ttl_seconds,))
+                self._db.commit()
+                for value, extra, key in self._db.execute(
+                        f"SELECT hash, extra, chave FROM {table} ORDER BY criado_em DESC LIMIT ?", (max_entries,)):
+                    self._append(int(value, 16), key, int(extra, 16) if extra else 0)
+                # Do mais antigo para o mais recente, como nas inclusões seguintes.
+                count = len(self._keys)
+                self._rows[:count] = self._rows[:count][::-1].copy()
+                self._keys.reverse()
+                self._evict_from_disk()
+            except sqlite3.Error as e:
+                print(f"AVISO: Índice de quase duplicatas em disco desativado ({db_path}): {e}", file=sys.stderr)
+                self._db = None
+
+    def __len__(self):
+        with self._lock:
+            return len(self._keys)
+
+    def _append(self, value, key, extra):
+        # Chamado com o lock adquirido (ou durante a construção).
+        count = len(self._keys)
+        if count == len(self._rows):
+            self._rows = np.concatenate([self._rows, np.zeros_like(self._rows)])
+        self._rows[count] = _to_words(value, self._words) + _to_words(extra, self._extra_words)
+        self._keys.append(key)
+
+    def _evict(self):
+        # Chamado com o lock adquirido: descarta o quarto mais antigo dos itens.
+        count = len(self._keys)
+        dropped = max(count // 4, 1)
+        self._rows[:count - dropped] = self._rows[dropped:count].copy()
+        self._keys = self._keys[dropped:]
+        self._stats["evicted"] += dropped
+        self._evict_from_disk()
+
+    def _evict_from_disk(self):
+        # Chamado com o lock adquirido (ou durante a construção).
+        if self._db is None:
+            return
+        try:
+            self._db.execute(
+                f"DELETE FROM {self.table} WHERE rowid NOT IN "
+                f"(SELECT rowid FROM {self.table} ORDER BY criado_em DESC LIMIT ?)",
+                (len(self._keys),),
+            )
+            self._db.commit()
+        except sqlite3.Error as e:
+            print(f"AVISO: Falha ao limpar o índice de quase duplicatas: {e}", file=sys.stderr)
+
+    def add(self, value, key, extra=None):
+        with self._lock:
+            if len(self._keys) >= self.max_entries:
+                self._evict()
+            self._append(value, key, extra or 0)
+            self._stats["added"] += 1
+            if self._db is not None:
+                try:
+                    self._db.execute(
+                        f"INSERT INTO {self.table} (hash, extra, chave, criado_em) VALUES (?, ?, ?, ?)",
+                        (format(value, "x"), format(extra, "x") if extra is not None else None, key, time.time()),
+                    )
+                    self._db.commit()
+                except sqlite3.Error as e:
+                    print(f"AVISO: Falha ao gravar no índice de quase duplicatas: {e}", file=sys.stderr)
+
+    def candidates(self, value, max_distance, extra=None, max_extra_distance=None):
+        """
+        Chaves dos itens a até 'max_distance' bits de 'value' (e, se informado, com o hash
+        extra a até 'max_extra_distance' bits de 'extra'), da mais próxima à mais distante.
+        """
+        query = np.array(_to_words(value, self._words) + _to_words(extra or 0, self._extra_words), dtype=np.uint64)
+        with self._lock:
+            self._stats["lookups"] += 1
+            count = len(self._keys)
+            differing = np.bitwise_count(self._rows[:count] ^ query)
+            keys = self._keys[:count]
+        distances = differing[:, :self._words].sum(axis=1)
+        selected = distances <= max_distance
+        if extra is not None and self._extra_words:
+            selected &= differing[:, self._words:].sum(axis=1) <= max_extra_distance
+        found = []
+        for index in np.flatnonzero(selected)[np.argsort(distances[selected], kind="stable")]:
+            if keys[index] not in found:
+                found.append(keys[index])
+        return found
+
+    def record(self, matched):
+        """Contabiliza o desfecho de uma consulta confirmada (ou rejeitada) pelo chamador."""
+        with self._lock:
+            self._stats["matches" if matched else "rejected"] += 1
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["entries"] = len(self._keys)
+        stats["hit_rate"] = stats["matches"] / stats["lookups"] if stats["lookups"] else 0.0
+        return stats
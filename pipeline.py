@@ -0,0 +1,891 @@
+import asyncio
+import contextvars
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+import model_routing
+import near_duplicate
+import resilience
+from backends import Generation, TruncatedResponseError, create_backends
+from cache import cache_from_env, content_hash
+from chunking import estimate_tokens, split_into_chunks
+from manual_index import open_manual_index
+from preprocessing import normalize_image_for_ocr
+from singleflight import AsyncSingleFlight, SingleFlight
+from translation_memory import TranslationEngine
+
+# --- Núcleo do Pipeline (OCR -> tradução -> simplificação) ---
+# Compartilhado pelo app Flask (app.py) e pelo app Streamlit (streamlit_app.py): backends,
+# caches, resiliência e as funções de cada etapa ficam aqui, para que uma melhoria no
+# pipeline chegue às duas implantações. As interfaces (rotas, widgets) ficam nos apps.
+
+# PIPELINE_BACKEND=google (padrão) usa Vision, Translate e Gemini; 'fake' usa os substitutos locais.
+PIPELINE_BACKEND = os.getenv('PIPELINE_BACKEND', 'google')
+
+# --- Backends (ver backends.py) ---
+ocr_backend, translation_backend, llm_backend = create_backends(PIPELINE_BACKEND)
+
+# --- Cache de Resultados ---
+# Indexado pelo hash dos bytes da imagem. No App Engine Standard apenas /tmp é gravável;
+# aponte RESULT_CACHE_PATH para um disco persistente se quiser sobreviver a reinícios.
+result_cache = cache_from_env("RESULT_CACHE", "/tmp/botmanut_resultados.sqlite3")
+
+# --- Memória de Tradução ---
+# Segmentos (linhas/frases) já traduzidos são reaproveitados entre requisições e reinícios.
+translation_memory = cache_from_env(
+    "TRANSLATION_MEMORY", "/tmp/botmanut_traducoes.sqlite3",
+    table="memoria_traducao", max_entries=20000, ttl_seconds=90 * 24 * 3600, max_disk_entries=100000,
+)
+
+# --- Cache de Trechos Simplificados ---
+# Páginas longas são simplificadas por trechos (ver chunking.py); trechos idênticos (avisos e
+# passos padronizados se repetem entre tarefas) são servidos daqui, indexados pelo prompt.
+chunk_cache = cache_from_env(
+    "CHUNK_CACHE", "/tmp/botmanut_trechos.sqlite3",
+    table="trechos_simplificados", max_entries=5000, ttl_seconds=30 * 24 * 3600, max_disk_entries=20000,
+)
+
+# --- Índices de Quase Duplicatas (ver near_duplicate.py) ---
+# Fotos diferentes da mesma página reaproveitam o resultado já guardado no cache de resultados:
+# pelo texto do OCR (padrão) e, opcionalmente, pela própria imagem, antes do OCR.
+image_index = None
+if near_duplicate.NEAR_DUPLICATE_IMAGE:
+    image_index = near_duplicate.NearDuplicateIndex(
+        near_duplicate.NEAR_DUPLICATE_PATH, table="impressoes_imagem",
+        bits=near_duplicate.HASH_SIZE ** 2, extra_bits=near_duplicate.HASH_SIZE ** 2,
+    )
+text_index = None
+if near_duplicate.NEAR_DUPLICATE:
+    text_index = near_duplicate.NearDuplicateIndex(
+        near_duplicate.NEAR_DUPLICATE_PATH, table="impressoes_texto", bits=64,
+    )
+
+# --- Índice de Páginas de Manuais (ver manual_index.py e ingest_manuals.py) ---
+# Páginas processadas antecipadamente; None quando o arquivo do índice não existe.
+manual_index = open_manual_index()
+
+# --- Resiliência (ver resilience.py) ---
+# Cada backend tem seu limite de concorrência, novas tentativas e circuit breaker. A Gemini,
+# a etapa mais lenta, fica com menos vagas que as 8 threads do Gunicorn, para que as threads
+# restantes continuem atendendo mesmo quando ela degrada.
+ocr_guard = resilience.BackendGuard.from_env('OCR', ocr_backend.name, max_concurrency=8)
+translate_guard = resilience.BackendGuard.from_env('TRANSLATE', translation_backend.name, max_concurrency=8)
+llm_guard = resilience.BackendGuard.from_env('GEMINI', llm_backend.name, max_concurrency=6)
+
+translation_engine = TranslationEngine(
+    lambda values: translate_guard.call(translation_backend.translate, values),
+    translation_memory,
+    translate_batch_async=lambda values: translate_guard.call_async(translation_backend.translate_async, values),
+)
+
+# --- Agrupamento de Chamadas Idênticas (ver singleflight.py) ---
+# Requisições simultâneas com a mesma imagem, o mesmo texto do OCR ou o mesmo texto traduzido
+# compartilham uma única chamada ao backend da etapa correspondente.
+ocr_flight = SingleFlight('ocr')
+translate_flight = SingleFlight('translate')
+simplify_flight = SingleFlight('simplify')
+# Equivalentes para as versões assíncronas das etapas (servidor async_app.py).
+ocr_flight_async = AsyncSingleFlight('ocr')
+translate_flight_async = AsyncSingleFlight('translate')
+simplify_flight_async = AsyncSingleFlight('simplify')
+
+def collect_cache_metrics():
+    """Gauges com os contadores dos caches e índices do pipeline, para o /metrics dos apps."""
+    return (metrics.gauges_from_stats('botmanut_result_cache', 'Cache de resultados', result_cache.stats())
+            + metrics.gauges_from_stats('botmanut_translation_memory', 'Memória de tradução', translation_engine.stats())
+            + metrics.gauges_from_stats('botmanut_chunk_cache', 'Cache de trechos simplificados', chunk_cache.stats())
+            + (metrics.gauges_from_stats('botmanut_near_duplicate_text', 'Quase duplicatas pelo texto do OCR',
+                                         text_index.stats()) if text_index is not None else [])
+            + (metrics.gauges_from_stats('botmanut_near_duplicate_image', 'Quase duplicatas pela imagem',
+                                         image_index.stats()) if image_index is not None else [])
+            + (metrics.gauges_from_stats('botmanut_manual_index', 'Índice de páginas de manuais',
+                                         manual_index.stats()) if manual_index is not None else []))
+
+MENSAGEM_SEM_TEXTO_NA_IMAGEM = "Não foi possível detectar texto na imagem. Certifique-se de que o texto está legível."
+
+# Mensagens devolvidas pela simplificação em caso de falha. Não devem ser armazenadas no cache.
+MENSAGEM_TEXTO_VAZIO = "O texto fornecido para simplificação está vazio."
+MENSAGEM_GEMINI_SEM_CONTEUDO = "A Gemini API não conseguiu gerar uma explicação simplificada para o texto fornecido. O texto é legível e relevante?"
+MENSAGEM_GEMINI_ERRO = "Ocorreu um erro ao simplificar a instrução. Por favor, tente novamente."
+MENSAGEM_GEMINI_INCOMPLETA = "A explicação simplificada ficou longa demais e veio incompleta. Por favor, tente novamente."
+MENSAGEM_ORCAMENTO_ESGOTADO = "Limite de processamento desta requisição atingido. Envie as páginas restantes novamente."
+MENSAGENS_DE_FALHA = {MENSAGEM_TEXTO_VAZIO, MENSAGEM_GEMINI_SEM_CONTEUDO, MENSAGEM_GEMINI_ERRO,
+                      MENSAGEM_GEMINI_INCOMPLETA, MENSAGEM_ORCAMENTO_ESGOTADO}
+# Produzido pelo streaming da simplificação quando os trechos já enviados devem ser descartados
+# (resposta cortada, refeita sem streaming); vira o evento 'simplified_reset' (ver iter_image_events).
+STREAM_RESET = object()
+
+# --- Funções de Processamento de Imagem/Texto ---
+# Essas funções usam os backends globais (Google Cloud ou substitutos locais).
+
+def detect_text_from_image(image_content):
+    """
+    Detecta texto em uma imagem usando Google Cloud Vision API (ou o backend de OCR configurado).
+    A imagem é normalizada antes do envio (orientação, tamanho, tons de cinza).
+    Chamadas simultâneas com a mesma imagem (mesmo hash) compartilham um único OCR.
+    """
+    return ocr_flight.do(content_hash(image_content), _detect_text_from_image, image_content)
+
+def _detect_text_from_image(image_content):
+    with metrics.track_stage('preprocess', 'pillow'):
+        normalized_content = normalize_image_for_ocr(image_content)
+    with metrics.track_stage('ocr', ocr_backend.name):
+        text = ocr_guard.call(ocr_backend.detect_text, normalized_content)
+    metrics.OCR_TEXT_CHARS.observe(len(text or ''))
+    return text
+
+def detect_and_translate_language(text_content):
+    """
+    Detecta o idioma de um texto e o traduz para português, se necessário.
+    Utiliza a Translation API V2 em uma única chamada (a detecção vem na própria resposta),
+    servindo da memória de tradução os segmentos já conhecidos.
+    """
+    if not text_content: # Adição: Verificação para texto vazio
+        return ""
+
+    return translate_flight.do(text_content, _translate_text, text_content)
+
+def _translate_text(text_content):
+    with metrics.track_stage('translate', translation_backend.name):
+        return translation_engine.translate([text_content])[0]
+
+# Executor das simplificações por trecho. É separado do executor dos lotes, que também
+# chama simplify_text_with_gemini: compartilhar o mesmo poderia esgotá-lo em espera mútua.
+gemini_chunk_executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv('GEMINI_CHUNK_CONCURRENCY', '6')),
+    thread_name_prefix='gemini-trecho',
+)
+
+# Partes fixas do prompt de simplificação, montadas uma vez; cada chamada só concatena o texto.
+SIMPLIFICATION_PROMPT_HEAD = '''
+        Você é um assistente especializado em manutenção de aeronaves, com a tarefa de simplificar instruções técnicas. Recebi a seguinte instrução de manutenção de um manual:
+
+        "'''
+SIMPLIFICATION_PROMPT_TAIL = '''"
+
+        Por favor, reescreva esta instrução de forma mais simples, clara e sucinta,
+        mantendo apenas as informações essenciais para um técnico realizar a tarefa.
+        Use linguagem direta e evite jargões desnecessários, se possível.
+        '''
+SIMPLIFICATION_PROMPT_PARTIAL = """
+        Este texto é apenas um trecho de uma página maior do manual. Simplifique somente este trecho,
+        preservando a numeração dos passos e todos os avisos (ATENÇÃO/CUIDADO), sem introdução nem conclusão.
+        """
+
+# Tokens das partes fixas do prompt, para o orçamento de tokens da página (ver model_routing.py).
+SIMPLIFICATION_PROMPT_OVERHEAD_TOKENS = estimate_tokens(
+    SIMPLIFICATION_PROMPT_HEAD + SIMPLIFICATION_PROMPT_TAIL + SIMPLIFICATION_PROMPT_PARTIAL)
+
+def build_simplification_prompt(original_text, partial=False):
+    """
+    Monta o prompt de simplificação enviado à Gemini API.
+    Com partial=True, o texto é um trecho de uma página maior (ver chunking.py).
+    """
+    prompt = SIMPLIFICATION_PROMPT_HEAD + original_text + SIMPLIFICATION_PROMPT_TAIL
+    if partial:
+        prompt += SIMPLIFICATION_PROMPT_PARTIAL
+    return prompt
+
+def simplify_text_with_gemini(original_text):
+    """
+    Simplifica e resume um texto usando a Gemini API.
+    Utiliza o backend de LLM global (por padrão, o modelo Gemini de clients.get_text_model()).
+    Chamadas simultâneas com o mesmo texto compartilham uma única chamada à Gemini.
+    Textos longos são divididos em trechos (passos, avisos e parágrafos), simplificados em
+    paralelo e unidos na ordem original; o tempo total tende ao do trecho mais lento.
+    O modelo e o limite de saída de cada trecho são escolhidos pelo model_routing.py, dentro
+    dos orçamentos de tokens da página e da requisição; textos curtos e já simples voltam sem
+    chamar a Gemini.
+    """
+    if not original_text: # Adição: Verificação para texto vazio
+        return MENSAGEM_TEXTO_VAZIO
+
+    return simplify_flight.do(original_text, _simplify_text, original_text)
+
+def _simplify_text(original_text):
+    chunks = split_into_chunks(original_text)
+    budget = model_routing.page_budget(chunks, SIMPLIFICATION_PROMPT_OVERHEAD_TOKENS)
+    if len(chunks) == 1:
+        return _simplify_chunk(original_text, budget=budget)
+
+    record = metrics.current_request()
+    if record is not None:
+        record.set_field('simplify_chunks', len(chunks))
+    with metrics.track_stage('simplify', llm_backend.name):
+        futures = [
+            gemini_chunk_executor.submit(contextvars.copy_context().run, _simplify_chunk, chunk, True, budget)
+            for chunk in chunks
+        ]
+        try:
+            simplified_chunks = [future.result() for future in futures]
+        except BaseException:
+            for future in futures:
+                future.cancel()
+            raise
+
+    # Se um trecho falhar, a página inteira é tratada como falha (e não entra no cache de
+    # resultados); os trechos que deram certo já estão no cache de trechos para a nova tentativa.
+    for simplified in simplified_chunks:
+        if simplified in MENSAGENS_DE_FALHA:
+            return simplified
+    return "\n\n".join(simplified_chunks)
+
+def _chunk_cache_key(prompt):
+    return content_hash(f"{llm_backend.name}\n{prompt}")
+
+def _simplify_chunk(text, partial=False, budget=None):
+    """
+    Simplifica um trecho (ou o texto inteiro), consultando antes o cache de trechos.
+    'budget' é o orçamento de tokens da página (model_routing.TokenBudget).
+    """
+    prompt = build_simplification_prompt(text, partial)
+    cache_key = _chunk_cache_key(prompt)
+    cached = chunk_cache.get(cache_key)
+    if cached is not None:
+        return cached
+
+    route = model_routing.choose_route(text, prompt, budget)
+    if route.skip:
+        return text
+    if route.exhausted:
+        return MENSAGEM_ORCAMENTO_ESGOTADO
+
+    started_at = time.perf_counter()
+    simplified = _generate_simplification(prompt, 'simplify_chunk' if partial else 'simplify', route, budget)
+    if simplified not in MENSAGENS_DE_FALHA:
+        chunk_cache.set(cache_key, simplified, time.perf_counter() - started_at)
+    return simplified
+
+def _generate_simplification(prompt, stage, route, budget=None):
+    try:
+        # Usando a instância de modelo inicializada globalmente.
+        # Removendo a linha 'text_model = genai.GenerativeModel('gemini-1.5-flash')' daqui.
+        with metrics.track_stage(stage, llm_backend.name):
+            simplified_text = _complete_routed(prompt, route, budget) # Usando o backend global
+
+        # Removendo TODOS os logs de depuração internos da função.
+        # print(f"DEBUG: Resposta completa da Gemini API (objeto): {response}", file=sys.stderr)
+        # if hasattr(response, 'text') and response.text:
+        #     print(f"DEBUG: Resposta da Gemini API (texto direto): {response.text[:200]}...", file=sys.stderr)
+        # else:
+        #     print(f"DEBUG: Resposta da Gemini API não tem atributo 'text' ou está vazia.", file=sys.stderr)
+        # if response and hasattr(response, 'candidates') and response.candidates:
+        #     print(f"DEBUG: Candidates presentes na resposta. Total: {len(response.candidates)}", file=sys.stderr)
+        #     if response.candidates[0].content.parts:
+        #         print(f"DEBUG: Conteúdo do candidato presente. Tipo: {type(response.candidates[0].content.parts[0])}", file=sys.stderr)
+        #     else:
+        #         print(f"DEBUG: Conteúdo do candidato vazio ou sem partes.", file=sys.stderr)
+        # else:
+        #     print(f"DEBUG: Resposta da Gemini API sem candidates ou vazia.", file=sys.stderr)
+
+        if simplified_text:
+            return simplified_text
+        else:
+            # Mantendo um aviso no log caso a Gemini API não retorne conteúdo.
+            print("AVISO: Gemini API retornou resposta vazia ou sem conteúdo gerado na parte esperada.", file=sys.stderr)
+            return MENSAGEM_GEMINI_SEM_CONTEUDO
+    except resilience.ResilienceError:
+        # Sobrecarga, circuito aberto ou prazo esgotado: a rota responde 503/504 com Retry-After.
+        raise
+    except Exception as e:
+        # Mantendo um log de erro claro.
+        print(f"ERRO: Exceção capturada na Gemini API. Tipo: {type(e).__name__}. Mensagem: {str(e)}", file=sys.stderr)
+        # Removendo a impressão de traceback completa, pois o App Engine já registra erros e tracebacks.
+        # print("ERRO: Traceback completa para o erro da Gemini API:", file=sys.stderr)
+        # traceback.print_exc(file=sys.stderr)
+        return MENSAGEM_GEMINI_ERRO
+
+def _complete_routed(prompt, route, budget):
+    """
+    Chama o backend na rota escolhida e contabiliza tokens e latência. Uma resposta cortada
+    pelo limite de saída é refeita uma única vez no modelo padrão com limite maior (se o
+    orçamento permitir). Se continuar cortada, retorna MENSAGEM_GEMINI_INCOMPLETA, que não
+    entra nos caches.
+    """
+    generation = _call_route(prompt, route, budget)
+    if generation.truncated:
+        retry = model_routing.escalate(route, prompt, budget)
+        if retry is not None:
+            route, generation = retry, _call_route(prompt, retry, budget)
+    if generation.truncated:
+        print(f"AVISO: Resposta da Gemini cortada no limite de {route.max_output_tokens} tokens.", file=sys.stderr)
+        return MENSAGEM_GEMINI_INCOMPLETA
+    return generation.text
+
+def _call_route(prompt, route, budget):
+    started_at = time.perf_counter()
+    try:
+        generation = llm_guard.call(llm_backend.complete, prompt, model=route.model,
+                                    max_output_tokens=route.max_output_tokens)
+    except BaseException:
+        model_routing.release(route, budget)
+        raise
+    model_routing.record_generation(route, generation, time.perf_counter() - started_at, budget)
+    return generation
+
+
+def stream_simplify_text_with_gemini(original_text):
+    """
+    Versão em streaming de 'simplify_text_with_gemini': produz os trechos do texto
+    à medida que a Gemini API os gera (generate_content com stream=True).
+    Se a falha ocorrer antes do primeiro trecho, produz a mesma mensagem de erro da
+    versão síncrona; se ocorrer no meio da geração, a exceção é propagada. Se a resposta for
+    cortada pelo limite de saída, produz STREAM_RESET (os trechos já enviados devem ser
+    descartados) e, em seguida, a simplificação refeita sem streaming ou MENSAGEM_GEMINI_INCOMPLETA.
+    Textos longos são simplificados por trechos em paralelo, produzidos na ordem original
+    assim que cada um (e os anteriores) fica pronto.
+    """
+    if not original_text:
+        yield MENSAGEM_TEXTO_VAZIO
+        return
+
+    chunks = split_into_chunks(original_text)
+    if len(chunks) > 1:
+        yield from _stream_simplified_chunks(chunks)
+        return
+
+    prompt = build_simplification_prompt(original_text)
+    cache_key = _chunk_cache_key(prompt)
+    cached = chunk_cache.get(cache_key)
+    if cached is not None:
+        yield cached
+        return
+
+    budget = model_routing.page_budget(chunks, SIMPLIFICATION_PROMPT_OVERHEAD_TOKENS)
+    route = model_routing.choose_route(original_text, prompt, budget)
+    if route.skip:
+        yield original_text
+        return
+    if route.exhausted:
+        yield MENSAGEM_ORCAMENTO_ESGOTADO
+        return
+
+    started_at = time.perf_counter()
+    pieces = []
+    truncated = False
+    try:
+        # O tempo medido inclui o consumo de cada trecho pelo cliente (a geração é sob demanda).
+        with metrics.track_stage('simplify', llm_backend.name):
+            for piece in llm_guard.stream(llm_backend.generate_stream, prompt, model=route.model,
+                                          max_output_tokens=route.max_output_tokens):
+                pieces.append(piece)
+                yield piece
+    except TruncatedResponseError:
+        truncated = True
+    except resilience.ResilienceError:
+        model_routing.release(route, budget)
+        raise
+    except Exception as e:
+        model_routing.release(route, budget)
+        print(f"ERRO: Exceção capturada no streaming da Gemini API. Tipo: {type(e).__name__}. Mensagem: {str(e)}", file=sys.stderr)
+        if pieces:
+            raise
+        yield MENSAGEM_GEMINI_ERRO
+        return
+
+    # O streaming não informa o uso de tokens ao chamador: a contabilidade usa estimativas.
+    generation = Generation.estimated(prompt, ''.join(pieces))
+    generation.truncated = truncated
+    model_routing.record_generation(route, generation, time.perf_counter() - started_at, budget)
+    if truncated:
+        # Resposta cortada: os trechos enviados são descartados e a simplificação é refeita uma
+        # única vez sem streaming, como em '_simplify_chunk' (mesma escalada e mesmos caches).
+        yield STREAM_RESET
+        retry = model_routing.escalate(route, prompt, budget)
+        if retry is None:
+            print(f"AVISO: Resposta da Gemini cortada no limite de {route.max_output_tokens} tokens.", file=sys.stderr)
+            yield MENSAGEM_GEMINI_INCOMPLETA
+            return
+        simplified = _generate_simplification(prompt, 'simplify', retry, budget)
+        if simplified not in MENSAGENS_DE_FALHA:
+            chunk_cache.set(cache_key, simplified, time.perf_counter() - started_at)
+        yield simplified
+        return
+    if not pieces:
+        print("AVISO: Gemini API (streaming) retornou resposta vazia.", file=sys.stderr)
+        yield MENSAGEM_GEMINI_SEM_CONTEUDO
+        return
+    chunk_cache.set(cache_key, ''.join(pieces), time.perf_counter() - started_at)
+
+def _stream_simplified_chunks(chunks):
+    budget = model_routing.page_budget(chunks, SIMPLIFICATION_PROMPT_OVERHEAD_TOKENS)
+    record = metrics.current_request()
+    if record is not None:
+        record.set_field('simplify_chunks', len(chunks))
+    futures = [
+        gemini_chunk_executor.submit(contextvars.copy_context().run, _simplify_chunk, chunk, True, budget)
+        for chunk in chunks
+    ]
+    try:
+        with metrics.track_stage('simplify', llm_backend.name):
+            for index, future in enumerate(futures):
+                simplified = future.result()
+                if simplified in MENSAGENS_DE_FALHA:
+                    if index == 0:
+                        yield simplified
+                        return
+                    if simplified == MENSAGEM_GEMINI_INCOMPLETA:
+                        yield STREAM_RESET
+                        yield simplified
+                        return
+                    raise RuntimeError(simplified)
+                yield simplified if index == 0 else "\n\n" + simplified
+    finally:
+        for future in futures:
+            future.cancel()
+
+def _image_fingerprint(image_content):
+    if image_index is None:
+        return None
+    with metrics.track_stage('near_duplicate', 'phash'):
+        return near_duplicate.image_fingerprint(image_content)
+
+def _find_near_duplicate_image(fingerprint):
+    """Resultado de uma foto quase idêntica já processada, ou None."""
+    if fingerprint is None:
+        return None
+    phash, dhash = fingerprint
+    keys = image_index.candidates(phash, near_duplicate.NEAR_DUPLICATE_PHASH_DISTANCE,
+                                  dhash, near_duplicate.NEAR_DUPLICATE_DHASH_DISTANCE)
+    for key in keys:
+        cached = result_cache.get(key)
+        if cached is not None and cached['original_text']:
+            image_index.record(True)
+            _mark_near_duplicate('image')
+            return cached
+    if keys:
+        image_index.record(False)
+    return None
+
+def _find_near_duplicate_text(ocr_text):
+    """
+    Tradução e simplificação de uma página com o mesmo texto do OCR (a menos do ruído do OCR,
+    ver near_duplicate.same_page), já processada a partir de outra foto, ou None.
+    """
+    if text_index is None:
+        return None
+    with metrics.track_stage('near_duplicate', 'simhash'):
+        keys = text_index.candidates(near_duplicate.simhash(ocr_text), near_duplicate.NEAR_DUPLICATE_TEXT_DISTANCE)
+        for key in keys:
+            cached = result_cache.get(key)
+            if (cached is not None and cached['original_text']
+                    and near_duplicate.same_page(cached['original_text'], ocr_text)):
+                text_index.record(True)
+                _mark_near_duplicate('text')
+                return {
+                    'original_text': ocr_text,
+                    'translated_text': cached['translated_text'],
+                    'simplified_text': cached['simplified_text'],
+                }
+        if keys:
+            text_index.record(False)
+    return None
+
+def _find_in_manual_index(ocr_text):
+    """Tradução e simplificação pré-calculadas da página do manual com o mesmo texto, ou None."""
+    if manual_index is None:
+        return None
+    with metrics.track_stage('manual_index', 'fts5'):
+        page = manual_index.match(ocr_text)
+    if page is None:
+        return None
+    record = metrics.current_request()
+    if record is not None:
+        record.set_field('manual_page', page['source'])
+    return {
+        'original_text': ocr_text,
+        'translated_text': page['translated_text'],
+        'simplified_text': page['simplified_text'],
+    }
+
+def _find_known_page(ocr_text):
+    """Página já processada com o mesmo texto: primeiro nos manuais indexados, depois nas fotos anteriores."""
+    return _find_in_manual_index(ocr_text) or _find_near_duplicate_text(ocr_text)
+
+def _mark_near_duplicate(kind):
+    record = metrics.current_request()
+    if record is not None:
+        record.set_field('near_duplicate', kind)
+
+def _remember_page(cache_key, fingerprint, ocr_text):
+    """Registra uma página recém-processada nos índices de quase duplicatas."""
+    if image_index is not None and fingerprint is not None:
+        image_index.add(fingerprint[0], cache_key, fingerprint[1])
+    if text_index is not None and ocr_text:
+        text_index.add(near_duplicate.simhash(ocr_text), cache_key)
+
+def process_image_content(image_content):
+    """
+    Executa o pipeline completo (OCR -> tradução -> simplificação) para os bytes de uma imagem,
+    consultando antes o cache de resultados, o índice de manuais e os índices de quase duplicatas.
+    Retorna um dicionário com 'original_text', 'translated_text' e 'simplified_text';
+    'original_text' é None quando nenhum texto foi detectado.
+    """
+    cache_key = content_hash(image_content)
+    with metrics.track_stage('cache', 'result_cache'):
+        cached = result_cache.get(cache_key)
+    if cached is not None:
+        return cached
+
+    started_at = time.perf_counter()
+
+    # 0. Foto quase idêntica a uma já processada (desativado por padrão)
+    fingerprint = _image_fingerprint(image_content)
+    near = _find_near_duplicate_image(fingerprint)
+    if near is not None:
+        result_cache.set(cache_key, near, time.perf_counter() - started_at)
+        return near
+
+    # 1. Detectar texto na imagem (OCR)
+    original_text_from_ocr = detect_text_from_image(image_content)
+    if not original_text_from_ocr:
+        result = {'original_text': None, 'translated_text': None, 'simplified_text': None}
+        result_cache.set(cache_key, result, time.perf_counter() - started_at)
+        return result
+
+    # Página de manual indexada ou já processada a partir de outra foto: dispensa tradução e Gemini.
+    result = _find_known_page(original_text_from_ocr)
+    if result is not None:
+        result_cache.set(cache_key, result, time.perf_counter() - started_at)
+        return result
+
+    # 2. Detectar e traduzir idioma
+    processed_text = detect_and_translate_language(original_text_from_ocr)
+
+    # 3. Simplificar o texto com a Gemini API
+    simplified_explanation = simplify_text_with_gemini(processed_text)
+
+    result = {
+        'original_text': original_text_from_ocr,
+        'translated_text': processed_text,
+        'simplified_text': simplified_explanation,
+    }
+    # Falhas da Gemini são transitórias: não as guardamos para não servi-las repetidamente.
+    if simplified_explanation not in MENSAGENS_DE_FALHA:
+        result_cache.set(cache_key, result, time.perf_counter() - started_at)
+        _remember_page(cache_key, fingerprint, original_text_from_ocr)
+    return result
+
+def _result_events(result, skip_ocr=False):
+    """Eventos de streaming de um resultado já pronto (cache, quase duplicata ou índice de manuais)."""
+    if not skip_ocr:
+        yield 'ocr', {'text': result['original_text']}
+    yield 'translation', {'text': result['translated_text'],
+                          'translated': result['translated_text'] != result['original_text']}
+    yield 'simplified_chunk', {'text': result['simplified_text']}
+    yield 'done', {'simplified_text': result['simplified_text'], 'cached': True}
+
+def iter_image_events(image_content):
+    """
+    Executa o pipeline produzindo eventos à medida que cada etapa termina, no formato
+    (evento, dados): 'ocr', 'translation', vários 'simplified_chunk' e, por fim, 'done'
+    (ou 'error' quando não há texto na imagem ou a simplificação veio incompleta).
+    'simplified_reset' indica que os trechos recebidos até ali devem ser descartados
+    (resposta cortada pelo limite de saída, refeita). Usado pela rota de streaming.
+    """
+    cache_key = content_hash(image_content)
+    with metrics.track_stage('cache', 'result_cache'):
+        cached = result_cache.get(cache_key)
+    if cached is not None:
+        if not cached['original_text']:
+            yield 'error', {'error': MENSAGEM_SEM_TEXTO_NA_IMAGEM}
+            return
+        yield from _result_events(cached)
+        return
+
+    started_at = time.perf_counter()
+
+    fingerprint = _image_fingerprint(image_content)
+    near = _find_near_duplicate_image(fingerprint)
+    if near is not None:
+        result_cache.set(cache_key, near, time.perf_counter() - started_at)
+        yield from _result_events(near)
+        return
+
+    original_text_from_ocr = detect_text_from_image(image_content)
+    if not original_text_from_ocr:
+        result_cache.set(cache_key, {'original_text': None, 'translated_text': None, 'simplified_text': None},
+                         time.perf_counter() - started_at)
+        yield 'error', {'error': MENSAGEM_SEM_TEXTO_NA_IMAGEM}
+        return
+    yield 'ocr', {'text': original_text_from_ocr}
+
+    near = _find_known_page(original_text_from_ocr)
+    if near is not None:
+        result_cache.set(cache_key, near, time.perf_counter() - started_at)
+        yield from _result_events(near, skip_ocr=True)
+        return
+
+    processed_text = detect_and_translate_language(original_text_from_ocr)
+    yield 'translation', {'text': processed_text, 'translated': processed_text != original_text_from_ocr}
+
+    pieces = []
+    for piece in stream_simplify_text_with_gemini(processed_text):
+        if piece is STREAM_RESET:
+            pieces = []
+            yield 'simplified_reset', {}
+            continue
+        if piece == MENSAGEM_GEMINI_INCOMPLETA:
+            # Uma instrução incompleta não é servida: a rota termina com 'error'.
+            yield 'error', {'error': piece}
+            return
+        pieces.append(piece)
+        yield 'simplified_chunk', {'text': piece}
+    simplified_explanation = ''.join(pieces)
+
+    if simplified_explanation not in MENSAGENS_DE_FALHA:
+        result_cache.set(cache_key, {
+            'original_text': original_text_from_ocr,
+            'translated_text': processed_text,
+            'simplified_text': simplified_explanation,
+        }, time.perf_counter() - started_at)
+        _remember_page(cache_key, fingerprint, original_text_from_ocr)
+    yield 'done', {'simplified_text': simplified_explanation, 'cached': False}
+
+# --- Versões Assíncronas (servidor async_app.py) ---
+# Mesmo pipeline, com as mesmas proteções, caches e índices, mas com as chamadas de rede
+# feitas pelos clientes assíncronos (backends *_async): enquanto uma requisição espera o
+# Vision, o Translate ou a Gemini, o event loop atende as outras, sem uma thread por requisição.
+# O trabalho de CPU (normalização da imagem e hash perceptual) e todo acesso aos caches e
+# índices em SQLite (resultados, trechos, memória de tradução, FTS5 dos manuais, quase
+# duplicatas) rodam em threads (asyncio.to_thread): uma leitura ou um commit no disco
+# travaria o event loop e, com ele, todas as requisições em andamento.
+
+async def detect_text_from_image_async(image_content):
+    """Versão assíncrona de 'detect_text_from_image'."""
+    return await ocr_flight_async.do(content_hash(image_content), _detect_text_from_image_async, image_content)
+
+async def _detect_text_from_image_async(image_content):
+    with metrics.track_stage('preprocess', 'pillow'):
+        normalized_content = await asyncio.to_thread(normalize_image_for_ocr, image_content)
+    with metrics.track_stage('ocr', ocr_backend.name):
+        text = await ocr_guard.call_async(ocr_backend.detect_text_async, normalized_content)
+    metrics.OCR_TEXT_CHARS.observe(len(text or ''))
+    return text
+
+async def detect_and_translate_language_async(text_content):
+    """Versão assíncrona de 'detect_and_translate_language'."""
+    if not text_content:
+        return ""
+    return await translate_flight_async.do(text_content, _translate_text_async, text_content)
+
+async def _translate_text_async(text_content):
+    with metrics.track_stage('translate', translation_backend.name):
+        return (await translation_engine.translate_async([text_content]))[0]
+
+async def simplify_text_with_gemini_async(original_text):
+    """Versão assíncrona de 'simplify_text_with_gemini' (generate_content_async na Gemini)."""
+    if not original_text:
+        return MENSAGEM_TEXTO_VAZIO
+    return await simplify_flight_async.do(original_text, _simplify_text_async, original_text)
+
+async def _simplify_text_async(original_text):
+    chunks = split_into_chunks(original_text)
+    budget = model_routing.page_budget(chunks, SIMPLIFICATION_PROMPT_OVERHEAD_TOKENS)
+    if len(chunks) == 1:
+        return await _simplify_chunk_async(original_text, budget=budget)
+
+    record = metrics.current_request()
+    if record is not None:
+        record.set_field('simplify_chunks', len(chunks))
+    with metrics.track_stage('simplify', llm_backend.name):
+        tasks = [asyncio.ensure_future(_simplify_chunk_async(chunk, True, budget)) for chunk in chunks]
+        try:
+            simplified_chunks = await asyncio.gather(*tasks)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            raise
+
+    for simplified in simplified_chunks:
+        if simplified in MENSAGENS_DE_FALHA:
+            return simplified
+    return "\n\n".join(simplified_chunks)
+
+async def _simplify_chunk_async(text, partial=False, budget=None):
+    prompt = build_simplification_prompt(text, partial)
+    cache_key = _chunk_cache_key(prompt)
+    cached = await asyncio.to_thread(chunk_cache.get, cache_key)
+    if cached is not None:
+        return cached
+
+    route = model_routing.choose_route(text, prompt, budget)
+    if route.skip:
+        return text
+    if route.exhausted:
+        return MENSAGEM_ORCAMENTO_ESGOTADO
+
+    started_at = time.perf_counter()
+    simplified = await _generate_simplification_async(prompt, 'simplify_chunk' if partial else 'simplify', route, budget)
+    if simplified not in MENSAGENS_DE_FALHA:
+        await asyncio.to_thread(chunk_cache.set, cache_key, simplified, time.perf_counter() - started_at)
+    return simplified
+
+async def _generate_simplification_async(prompt, stage, route, budget=None):
+    try:
+        with metrics.track_stage(stage, llm_backend.name):
+            simplified_text = await _complete_routed_async(prompt, route, budget)
+    except resilience.ResilienceError:
+        raise
+    except Exception as e:
+        print(f"ERRO: Exceção capturada na Gemini API. Tipo: {type(e).__name__}. Mensagem: {str(e)}", file=sys.stderr)
+        return MENSAGEM_GEMINI_ERRO
+    if simplified_text:
+        return simplified_text
+    print("AVISO: Gemini API retornou resposta vazia ou sem conteúdo gerado na parte esperada.", file=sys.stderr)
+    return MENSAGEM_GEMINI_SEM_CONTEUDO
+
+async def _complete_routed_async(prompt, route, budget):
+    """Versão assíncrona de '_complete_routed'."""
+    generation = await _call_route_async(prompt, route, budget)
+    if generation.truncated:
+        retry = model_routing.escalate(route, prompt, budget)
+        if retry is not None:
+            route, generation = retry, await _call_route_async(prompt, retry, budget)
+    if generation.truncated:
+        print(f"AVISO: Resposta da Gemini cortada no limite de {route.max_output_tokens} tokens.", file=sys.stderr)
+        return MENSAGEM_GEMINI_INCOMPLETA
+    return generation.text
+
+async def _call_route_async(prompt, route, budget):
+    started_at = time.perf_counter()
+    try:
+        generation = await llm_guard.call_async(llm_backend.complete_async, prompt, model=route.model,
+                                                max_output_tokens=route.max_output_tokens)
+    except BaseException:
+        model_routing.release(route, budget)
+        raise
+    model_routing.record_generation(route, generation, time.perf_counter() - started_at, budget)
+    return generation
+
+async def process_image_content_async(image_content):
+    """Versão assíncrona de 'process_image_content' (mesmo formato de resultado)."""
+    cache_key = content_hash(image_content)
+    with metrics.track_stage('cache', 'result_cache'):
+        cached = await asyncio.to_thread(result_cache.get, cache_key)
+    if cached is not None:
+        return cached
+
+    started_at = time.perf_counter()
+
+    fingerprint = await asyncio.to_thread(_image_fingerprint, image_content) if image_index is not None else None
+    near = await asyncio.to_thread(_find_near_duplicate_image, fingerprint) if fingerprint is not None else None
+    if near is not None:
+        await asyncio.to_thread(result_cache.set, cache_key, near, time.perf_counter() - started_at)
+        return near
+
+    original_text_from_ocr = await detect_text_from_image_async(image_content)
+    if not original_text_from_ocr:
+        result = {'original_text': None, 'translated_text': None, 'simplified_text': None}
+        await asyncio.to_thread(result_cache.set, cache_key, result, time.perf_counter() - started_at)
+        return result
+
+    result = await asyncio.to_thread(_find_known_page, original_text_from_ocr)
+    if result is not None:
+        await asyncio.to_thread(result_cache.set, cache_key, result, time.perf_counter() - started_at)
+        return result
+
+    processed_text = await detect_and_translate_language_async(original_text_from_ocr)
+    simplified_explanation = await simplify_text_with_gemini_async(processed_text)
+
+    result = {
+        'original_text': original_text_from_ocr,
+        'translated_text': processed_text,
+        'simplified_text': simplified_explanation,
+    }
+    if simplified_explanation not in MENSAGENS_DE_FALHA:
+        await asyncio.to_thread(_remember_result, cache_key, result, time.perf_counter() - started_at,
+                                fingerprint, original_text_from_ocr)
+    return result
+
+def _remember_result(cache_key, result, cost, fingerprint, ocr_text):
+    result_cache.set(cache_key, result, cost)
+    _remember_page(cache_key, fingerprint, ocr_text)
+
+# --- Processamento em Lote (várias páginas de um cartão de tarefa) ---
+
+MAX_BATCH_PAGES = int(os.getenv('MAX_BATCH_PAGES', '20'))
+
+# Executor compartilhado entre as requisições: limita o total de chamadas simultâneas
+# à Gemini feitas pelos lotes, independentemente de quantos lotes chegam ao mesmo tempo.
+gemini_batch_executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv('GEMINI_BATCH_CONCURRENCY', '4')),
+    thread_name_prefix='gemini-lote',
+)
+
+def detect_text_from_images(image_contents):
+    """
+    Detecta texto em várias imagens com uma chamada em lote ao backend de OCR
+    (no Vision, batch_annotate_images com até 16 imagens, em vez de uma chamada por imagem).
+    Retorna uma lista, na mesma ordem, com o texto completo ou None.
+    """
+    with metrics.track_stage('preprocess', 'pillow'):
+        normalized_contents = [normalize_image_for_ocr(content) for content in image_contents]
+    with metrics.track_stage('ocr', ocr_backend.name):
+        texts = ocr_guard.call(ocr_backend.detect_texts, normalized_contents)
+    for text in texts:
+        metrics.OCR_TEXT_CHARS.observe(len(text or ''))
+    return texts
+
+def translate_texts(text_contents):
+    """
+    Traduz vários textos para português. Os segmentos inéditos de todas as páginas
+    seguem juntos em uma única chamada de lista à Translation API V2.
+    """
+    with metrics.track_stage('translate', translation_backend.name):
+        return translation_engine.translate(text_contents)
+
+def process_image_batch(image_contents):
+    """
+    Executa o pipeline para várias páginas: OCR em lote, tradução em uma única chamada
+    e simplificações em paralelo (com concorrência limitada). Páginas já presentes no
+    cache de resultados não são reprocessadas, e as encontradas no índice de manuais
+    não passam pela tradução nem pela Gemini. Retorna os resultados na ordem de entrada.
+    """
+    started_at = time.perf_counter()
+    cache_keys = [content_hash(content) for content in image_contents]
+    results = [result_cache.get(key) for key in cache_keys]
+    missing = [i for i, result in enumerate(results) if result is None]
+    if not missing:
+        return results
+
+    # 1. OCR de todas as páginas ausentes do cache
+    ocr_texts = detect_text_from_images([image_contents[i] for i in missing])
+
+    # Páginas dos manuais indexados já têm tradução e simplificação prontas.
+    for i, ocr_text in zip(missing, ocr_texts):
+        if ocr_text:
+            results[i] = _find_in_manual_index(ocr_text)
+    from_manual_index = [i for i in missing if results[i] is not None]
+    ocr_texts = [ocr_text for i, ocr_text in zip(missing, ocr_texts) if results[i] is None]
+    missing = [i for i in missing if results[i] is None]
+
+    # 2. Tradução de todos os textos em uma única chamada
+    processed_texts = translate_texts(ocr_texts) if ocr_texts else []
+
+    # 3. Simplificações em paralelo; o tempo total tende ao da página mais lenta.
+    # Cada tarefa roda em uma cópia do contexto atual, para que os tempos entrem no
+    # registro da requisição (metrics.current_request()).
+    futures = {
+        i: gemini_batch_executor.submit(contextvars.copy_context().run, simplify_text_with_gemini, processed)
+        for i, processed in zip(missing, processed_texts) if processed
+    }
+
+    # O custo por página é aproximado pelo tempo total do lote dividido entre as páginas.
+    for i, ocr_text, processed in zip(missing, ocr_texts, processed_texts):
+        if not ocr_text:
+            results[i] = {'original_text': None, 'translated_text': None, 'simplified_text': None}
+        else:
+            results[i] = {
+                'original_text': ocr_text,
+                'translated_text': processed,
+                'simplified_text': futures[i].result(),
+            }
+    page_cost = (time.perf_counter() - started_at) / (len(missing) + len(from_manual_index))
+    for i in missing + from_manual_index:
+        if results[i]['simplified_text'] not in MENSAGENS_DE_FALHA:
+            result_cache.set(cache_keys[i], results[i], page_cost)
+    return results
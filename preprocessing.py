@@ -0,0 +1,58 @@
+import io
+import os
+import sys
+
+from PIL import Image, ImageOps
+
+# --- Normalização da Imagem antes do OCR ---
+# Câmeras de celular geram JPEGs de 4 a 12 MB. O Vision não precisa dessa resolução para ler
+# texto de manual, e enviar esses bytes custa tempo de upload a cada requisição. Antes do OCR:
+#   1. Corrigimos a orientação indicada no EXIF (fotos "deitadas").
+#   2. Reduzimos a maior dimensão para OCR_MAX_DIMENSION (sem ampliar imagens menores).
+#   3. Convertemos para tons de cinza (a cor não ajuda no reconhecimento de texto).
+#   4. Recodificamos em JPEG compacto.
+
+OCR_PREPROCESS = os.getenv("OCR_PREPROCESS", "1") != "0"
+OCR_MAX_DIMENSION = int(os.getenv("OCR_MAX_DIMENSION", "2048"))
+OCR_JPEG_QUALITY = int(os.getenv("OCR_JPEG_QUALITY", "85"))
+OCR_GRAYSCALE = os.getenv("OCR_GRAYSCALE", "1") != "0"
+
+
+def normalize_image_for_ocr(image_content, max_dimension=None, grayscale=None, quality=None):
+    """
+    Normaliza os bytes de uma imagem para o OCR (orientação, tamanho, cor e compressão).
+    Em caso de falha ao decodificar, ou se o resultado não ficar menor que o original
+    (e a orientação não precisar de correção), devolve os bytes originais.
+    """
+    if not OCR_PREPROCESS:
+        return image_content
+
+    max_dimension = max_dimension or OCR_MAX_DIMENSION
+    grayscale = OCR_GRAYSCALE if grayscale is None else grayscale
+    quality = quality or OCR_JPEG_QUALITY
+
+    try:
+        with Image.open(io.BytesIO(image_content)) as original:
+            # 0x0112 é a tag EXIF de orientação; 1 significa "já na posição correta".
+            rotated = original.getexif().get(0x0112, 1) != 1
+            image = ImageOps.exif_transpose(original)
+
+            if grayscale:
+                image = image.convert("L")
+            elif image.mode not in ("RGB", "L"):
+                image = image.convert("RGB")
+
+            # thumbnail() preserva a proporção e nunca amplia a imagem.
+            image.thumbnail((max_dimension, max_dimension), Image.Resampling.LANCZOS)
+
+            output = io.BytesIO()
+            image.save(output, format="JPEG", quality=quality, optimize=True)
+            normalized = output.getvalue()
+    except Exception as e:
+        # A normalização é uma otimização: se falhar, o Vision recebe a imagem original.
+        print(f"AVISO: Falha ao normalizar a imagem para OCR; usando os bytes originais: {e}", file=sys.stderr)
+        return image_content
+
+    if len(normalized) >= len(image_content) and not rotated:
+        return image_content
+    return normalized
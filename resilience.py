@@ -0,0 +1,314 @@
+import asyncio
+import contextvars
+import os
+import random
+import threading
+import time
+
+import metrics
+
+# --- Resiliência das Chamadas aos Backends ---
+# Em rajadas, as 8 threads do Gunicorn podiam ficar todas presas em uma chamada lenta à
+# Gemini, sem timeout, e erros de cota (429) chegavam ao usuário como um 500 genérico.
+# Cada backend (OCR, tradução, LLM) passa a ser chamado através de um BackendGuard, que combina:
+#   - limite de concorrência por backend (as threads restantes continuam atendendo o resto);
+#   - prazo (deadline) da requisição, repassado como timeout a cada chamada;
+#   - novas tentativas com backoff exponencial e jitter para erros transitórios;
+#   - circuit breaker, que falha rápido enquanto o backend está instável.
+# No servidor assíncrono (async_app.py), call_async aplica as mesmas proteções a corrotinas,
+# com um semáforo do asyncio no lugar do semáforo de threads.
+
+# Status HTTP (atributo 'code' das exceções do google.api_core) considerados transitórios.
+RETRYABLE_CODES = {408, 429, 500, 502, 503, 504}
+
+REQUEST_DEADLINE_SECONDS = float(os.getenv('REQUEST_DEADLINE_SECONDS', '60'))
+# Fração do prazo restante que uma chamada pode passar na fila por uma vaga do backend.
+QUEUE_DEADLINE_FRACTION = float(os.getenv('QUEUE_DEADLINE_FRACTION', '0.5'))
+
+RETRIES = metrics.REGISTRY.register(metrics.Counter(
+    "botmanut_backend_retries_total", "Novas tentativas de chamadas aos backends.", ("backend",)))
+REJECTIONS = metrics.REGISTRY.register(metrics.Counter(
+    "botmanut_backend_rejections_total", "Chamadas recusadas sem chegar ao backend.", ("backend", "reason")))
+CIRCUIT_STATE = metrics.REGISTRY.register(metrics.Gauge(
+    "botmanut_circuit_open", "1 se o circuit breaker do backend está aberto.", ("backend",)))
+
+
+class ResilienceError(RuntimeError):
+    """Base dos erros produzidos pela camada de resiliência."""
+
+
+class BackendUnavailableError(ResilienceError):
+    """O backend está indisponível ou sobrecarregado; 'retry_after' sugere quando tentar de novo (s)."""
+
+    def __init__(self, message, retry_after=5):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class DeadlineExceededError(ResilienceError):
+    """O prazo total da requisição acabou antes de o pipeline terminar."""
+
+
+def is_retryable(exc):
+    """Erros transitórios: cota (429), indisponibilidade (5xx), timeouts e falhas de conexão."""
+    if isinstance(exc, (TimeoutError, ConnectionError)):
+        return True
+    return getattr(exc, 'code', None) in RETRYABLE_CODES
+
+
+# --- Prazo (deadline) da requisição ---
+
+_deadline = contextvars.ContextVar('botmanut_deadline', default=None)
+
+
+def start_deadline(seconds=None):
+    """Define o prazo da requisição/tarefa atual (em segundos a partir de agora)."""
+    _deadline.set(time.monotonic() + (seconds if seconds is not None else REQUEST_DEADLINE_SECONDS))
+
+
+def remaining():
+    """Segundos restantes até o prazo atual, ou None se nenhum prazo foi definido."""
+    deadline = _deadline.get()
+    if deadline is None:
+        return None
+    return deadline - time.monotonic()
+
+
+# --- Circuit breaker ---
+
+class CircuitBreaker:
+    """
+    Abre após 'failure_threshold' falhas transitórias consecutivas e recusa chamadas por
+    'reset_timeout' segundos. Depois disso, deixa passar uma chamada de teste (meio-aberto):
+    se ela funcionar, o circuito fecha; se falhar, abre de novo.
+    """
+
+    def __init__(self, name, failure_threshold=5, reset_timeout=30.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened_at = None
+        self._trial_in_progress = False
+        self._lock = threading.Lock()
+
+    def before_call(self):
+        """
+        Levanta BackendUnavailableError se o circuito estiver aberto. Retorna True se esta
+        for a chamada de teste (meio-aberto), que deve terminar com 'end_call'.
+        """
+        with self._lock:
+            if self._opened_at is None:
+                return False
+            waited = time.monotonic() - self._opened_at
+            if waited >= self.reset_timeout and not self._trial_in_progress:
+                self._trial_in_progress = True
+                return True
+        REJECTIONS.inc(backend=self.name, reason='circuit_open')
+        raise BackendUnavailableError(
+            f"O serviço '{self.name}' está instável no momento. Tente novamente em instantes.",
+            retry_after=max(1, int(self.reset_timeout - waited)),
+        )
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial_in_progress = False
+        CIRCUIT_STATE.set(0, backend=self.name)
+
+    def end_call(self, trial):
+        """
+        Libera a vaga de teste se a chamada terminou sem resultado (ex.: GeneratorExit quando o
+        cliente desconecta no meio do stream); senão o circuito ficaria aberto para sempre.
+        """
+        if trial:
+            with self._lock:
+                self._trial_in_progress = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._trial_in_progress = False
+            if self._opened_at is not None or self._failures >= self.failure_threshold:
+                self._opened_at = time.monotonic()
+                opened = True
+            else:
+                opened = False
+        if opened:
+            CIRCUIT_STATE.set(1, backend=self.name)
+
+
+# --- Guarda por backend ---
+
+class BackendGuard:
+    """Aplica limite de concorrência, prazo, novas tentativas e circuit breaker às chamadas de um backend."""
+
+    def __init__(self, name, max_concurrency=8, max_attempts=3, base_delay=0.25, max_delay=4.0,
+                 queue_timeout=5.0, failure_threshold=5, reset_timeout=30.0, async_max_concurrency=None):
+        self.name = name
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.queue_timeout = queue_timeout
+        self.breaker = CircuitBreaker(name, failure_threshold, reset_timeout)
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+        # Chamadas assíncronas não prendem threads enquanto esperam; o limite delas protege
+        # apenas a cota e a latência do backend, e por isso é bem maior.
+        self.async_max_concurrency = async_max_concurrency or max_concurrency * 8
+        self._async_slots = None  # criado no primeiro uso, já dentro do event loop
+
+    @classmethod
+    def from_env(cls, prefix, name, max_concurrency):
+        """Lê <PREFIXO>_MAX_CONCURRENCY, <PREFIXO>_MAX_ATTEMPTS etc. das variáveis de ambiente."""
+        return cls(
+            name,
+            max_concurrency=int(os.getenv(f'{prefix}_MAX_CONCURRENCY', str(max_concurrency))),
+            async_max_concurrency=int(os.getenv(f'{prefix}_ASYNC_MAX_CONCURRENCY', str(max_concurrency * 8))),
+            max_attempts=int(os.getenv(f'{prefix}_MAX_ATTEMPTS', '3')),
+            queue_timeout=float(os.getenv(f'{prefix}_QUEUE_TIMEOUT_SECONDS', '5')),
+            failure_threshold=int(os.getenv(f'{prefix}_BREAKER_FAILURES', '5')),
+            reset_timeout=float(os.getenv(f'{prefix}_BREAKER_RESET_SECONDS', '30')),
+        )
+
+    def _time_left(self):
+        time_left = remaining()
+        if time_left is not None and time_left <= 0:
+            REJECTIONS.inc(backend=self.name, reason='deadline')
+            raise DeadlineExceededError(f"O prazo da requisição acabou antes da chamada ao serviço '{self.name}'.")
+        return time_left
+
+    def _queue_wait(self):
+        """
+        Quanto esperar por uma vaga. Com prazo, até metade do tempo restante (e no mínimo
+        'queue_timeout', se couber): os trechos de uma página e os itens de um lote disputam as
+        mesmas vagas, e recusar com 503 enquanto sobra prazo só faria o cliente repetir tudo.
+        Sem prazo, 'queue_timeout'.
+        """
+        time_left = self._time_left()
+        if time_left is None:
+            return self.queue_timeout
+        return min(time_left, max(self.queue_timeout, time_left * QUEUE_DEADLINE_FRACTION))
+
+    def _acquire(self):
+        wait = self._queue_wait()
+        if not self._slots.acquire(timeout=wait):
+            REJECTIONS.inc(backend=self.name, reason='concurrency')
+            raise BackendUnavailableError(f"O serviço '{self.name}' está sobrecarregado. Tente novamente em instantes.")
+
+    def _enter(self):
+        """Ocupa uma vaga de concorrência e consulta o circuit breaker (retorna se é a chamada de teste)."""
+        self._acquire()
+        try:
+            return self.breaker.before_call()
+        except BaseException:
+            self._slots.release()
+            raise
+
+    def _retry_delay(self, attempt, exc):
+        """Espera antes da próxima tentativa (full jitter); propaga o erro se não houver tempo."""
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+        time_left = remaining()
+        if time_left is not None and delay >= time_left:
+            raise DeadlineExceededError(
+                f"O prazo da requisição acabou durante as chamadas ao serviço '{self.name}': {exc}"
+            ) from exc
+        if attempt + 1 >= self.max_attempts:
+            raise BackendUnavailableError(
+                f"O serviço '{self.name}' não respondeu após {attempt + 1} tentativa(s): {exc}"
+            ) from exc
+        RETRIES.inc(backend=self.name)
+        return delay
+
+    def _backoff(self, attempt, exc):
+        time.sleep(self._retry_delay(attempt, exc))
+
+    def call(self, fn, *args, **kwargs):
+        """
+        Chama fn(*args, timeout=<segundos restantes>, **kwargs) com as proteções do backend.
+        Erros não transitórios (ex.: argumento inválido) são propagados sem novas tentativas.
+        """
+        for attempt in range(self.max_attempts):
+            trial = self._enter()
+            try:
+                result = fn(*args, timeout=remaining(), **kwargs)
+            except Exception as e:
+                if not is_retryable(e):
+                    # O backend respondeu (o erro é do pedido, não do serviço): não conta como falha.
+                    self.breaker.record_success()
+                    raise
+                self.breaker.record_failure()
+                failure = e
+            else:
+                self.breaker.record_success()
+                return result
+            finally:
+                self.breaker.end_call(trial)
+                self._slots.release()
+            self._backoff(attempt, failure)
+
+    def stream(self, fn, *args, **kwargs):
+        """
+        Versão de 'call' para geradores (streaming). Só há novas tentativas se a falha
+        ocorrer antes do primeiro trecho; a vaga de concorrência fica ocupada até o fim do stream.
+        """
+        for attempt in range(self.max_attempts):
+            trial = self._enter()
+            started = False
+            try:
+                for piece in fn(*args, timeout=remaining(), **kwargs):
+                    started = True
+                    yield piece
+            except Exception as e:
+                if not is_retryable(e):
+                    # O backend respondeu (o erro é do pedido, não do serviço): não conta como falha.
+                    self.breaker.record_success()
+                    raise
+                self.breaker.record_failure()
+                if started:
+                    raise
+                failure = e
+            else:
+                self.breaker.record_success()
+                return
+            finally:
+                self.breaker.end_call(trial)
+                self._slots.release()
+            self._backoff(attempt, failure)
+
+    async def _enter_async(self):
+        """Como '_enter', mas aguardando a vaga sem bloquear o event loop."""
+        if self._async_slots is None:
+            self._async_slots = asyncio.Semaphore(self.async_max_concurrency)
+        wait = self._queue_wait()
+        try:
+            await asyncio.wait_for(self._async_slots.acquire(), wait)
+        except asyncio.TimeoutError:
+            REJECTIONS.inc(backend=self.name, reason='concurrency')
+            raise BackendUnavailableError(f"O serviço '{self.name}' está sobrecarregado. Tente novamente em instantes.")
+        try:
+            return self.breaker.before_call()
+        except BaseException:
+            self._async_slots.release()
+            raise
+
+    async def call_async(self, fn, *args, **kwargs):
+        """Versão de 'call' para corrotinas: await fn(*args, timeout=<segundos restantes>, **kwargs)."""
+        for attempt in range(self.max_attempts):
+            trial = await self._enter_async()
+            try:
+                result = await fn(*args, timeout=remaining(), **kwargs)
+            except Exception as e:
+                if not is_retryable(e):
+                    self.breaker.record_success()
+                    raise
+                self.breaker.record_failure()
+                failure = e
+            else:
+                self.breaker.record_success()
+                return result
+            finally:
+                # Inclui asyncio.CancelledError (ex.: gather cancelando os outros trechos da página).
+                self.breaker.end_call(trial)
+                self._async_slots.release()
+            await asyncio.sleep(self._retry_delay(attempt, failure))
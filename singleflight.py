@@ -0,0 +1,117 @@
+import asyncio
+import threading
+import time
+
+import metrics
+import resilience
+
+# --- Agrupamento de Chamadas Idênticas em Andamento (single-flight) ---
+# Toques duplos no botão da câmera e vários técnicos fotografando o mesmo cartão de tarefa ao
+# mesmo tempo faziam o pipeline inteiro rodar N vezes para a mesma entrada. Com o SingleFlight,
+# a primeira chamada para uma chave executa o trabalho e as chamadas concorrentes com a mesma
+# chave apenas esperam e recebem o mesmo resultado (ou a mesma exceção). Diferente do cache,
+# nada é guardado após o término: só o trabalho simultâneo é compartilhado.
+# AsyncSingleFlight faz o mesmo para corrotinas, no servidor assíncrono (async_app.py).
+
+COALESCED = metrics.REGISTRY.register(metrics.Counter(
+    "botmanut_coalesced_calls_total", "Chamadas que aguardaram uma chamada idêntica em andamento.", ("stage",)))
+LEADERS = metrics.REGISTRY.register(metrics.Counter(
+    "botmanut_singleflight_calls_total", "Chamadas que executaram o trabalho (uma por chave em andamento).", ("stage",)))
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Executa fn uma única vez por chave entre chamadas concorrentes."""
+
+    def __init__(self, name):
+        self.name = name
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, fn, *args, **kwargs):
+        """
+        Chama fn(*args, **kwargs), a menos que já exista uma chamada em andamento com a mesma
+        chave: nesse caso, espera por ela (no máximo até o prazo da requisição atual) e
+        devolve o mesmo resultado, ou levanta a mesma exceção.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if leader:
+            LEADERS.inc(stage=self.name)
+            try:
+                call.result = fn(*args, **kwargs)
+            except BaseException as e:
+                call.error = e
+                raise
+            finally:
+                with self._lock:
+                    del self._calls[key]
+                call.done.set()
+            return call.result
+
+        COALESCED.inc(stage=self.name)
+        started_at = time.perf_counter()
+        finished = call.done.wait(resilience.remaining())
+        record = metrics.current_request()
+        if record is not None:
+            # Aparece no Server-Timing como, por exemplo, "ocr-coalesced;dur=640.2".
+            record.add_stage(f'{self.name}-coalesced', time.perf_counter() - started_at)
+        if not finished:
+            raise resilience.DeadlineExceededError(
+                f"O prazo da requisição acabou aguardando uma chamada idêntica ('{self.name}') em andamento.")
+        if call.error is not None:
+            raise call.error
+        return call.result
+
+
+class AsyncSingleFlight:
+    """Versão de SingleFlight para corrotinas, dentro de um único event loop."""
+
+    def __init__(self, name):
+        self.name = name
+        self._calls = {}
+
+    async def do(self, key, fn, *args, **kwargs):
+        """Aguarda fn(*args, **kwargs) uma única vez por chave entre chamadas concorrentes."""
+        future = self._calls.get(key)
+        if future is None:
+            LEADERS.inc(stage=self.name)
+            future = self._calls[key] = asyncio.get_running_loop().create_future()
+            try:
+                result = await fn(*args, **kwargs)
+            except asyncio.CancelledError:
+                future.cancel()
+                raise
+            except Exception as e:
+                future.set_exception(e)
+                # Marca a exceção como lida: sem seguidores, o asyncio avisaria no log.
+                future.exception()
+                raise
+            else:
+                future.set_result(result)
+                return result
+            finally:
+                del self._calls[key]
+
+        COALESCED.inc(stage=self.name)
+        started_at = time.perf_counter()
+        try:
+            # shield: o prazo de um seguidor não cancela a chamada compartilhada.
+            return await asyncio.wait_for(asyncio.shield(future), resilience.remaining())
+        except asyncio.TimeoutError:
+            raise resilience.DeadlineExceededError(
+                f"O prazo da requisição acabou aguardando uma chamada idêntica ('{self.name}') em andamento.")
+        finally:
+            record = metrics.current_request()
+            if record is not None:
+                record.add_stage(f'{self.name}-coalesced', time.perf_counter() - started_at)
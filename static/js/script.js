@@ -29,6 +29,34 @@ document.addEventListener('DOMContentLoaded', () => {
 
         chatMessages.appendChild(messageDiv);
         chatMessages.scrollTop = chatMessages.scrollHeight; // Rola para o final
+        return paragraph; // Permite atualizar a mensagem depois (usado no streaming)
+    }
+
+    // Atualiza o texto de uma mensagem já exibida (ex.: trechos chegando da Gemini)
+    function updateMessage(paragraph, text) {
+        paragraph.innerHTML = text.replace(/\n/g, '<br>');
+        chatMessages.scrollTop = chatMessages.scrollHeight;
+    }
+
+    // Lê uma resposta NDJSON (um evento JSON por linha) e chama onEvent para cada evento
+    async function readNdjsonStream(response, onEvent) {
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = '';
+
+        while (true) {
+            const { value, done } = await reader.read();
+            if (done) break;
+            buffer += decoder.decode(value, { stream: true });
+
+            let newlineIndex;
+            while ((newlineIndex = buffer.indexOf('\n')) >= 0) {
+                const line = buffer.slice(0, newlineIndex).trim();
+                buffer = buffer.slice(newlineIndex + 1);
+                if (line) onEvent(JSON.parse(line));
+            }
+        }
+        if (buffer.trim()) onEvent(JSON.parse(buffer));
     }
 
     // Evento quando uma imagem é selecionada/tirada
@@ -50,8 +78,9 @@ document.addEventListener('DOMContentLoaded', () => {
         formData.append('image', file);
 
         try {
-            // Requisição POST para o nosso servidor Flask
-            const response = await fetch('/process_image', {
+            // Requisição POST para o nosso servidor Flask (variante em streaming):
+            // cada etapa do pipeline é exibida assim que fica pronta.
+            const response = await fetch('/process_image_stream', {
                 method: 'POST',
                 body: formData
             });
@@ -61,10 +90,35 @@ document.addEventListener('DOMContentLoaded', () => {
                 throw new Error(errorData.error || 'Erro desconhecido do servidor.');
             }
 
-            const data = await response.json(); // Recebe o JSON com os resultados
+            let simplifiedParagraph = null;
+            let simplifiedText = '';
+            let streamError = null;
 
-            addMessage(`**Texto Original:**<br>${data.original_text}`);
-            addMessage(`**Explicação Simplificada:**<br>${data.simplified_text}`);
+            await readNdjsonStream(response, (data) => {
+                if (data.event === 'ocr') {
+                    addMessage(`**Texto Original:**<br>${data.text}`);
+                } else if (data.event === 'translation' && data.translated) {
+                    addMessage(`**Texto Traduzido:**<br>${data.text}`);
+                } else if (data.event === 'simplified_chunk') {
+                    simplifiedText += data.text;
+                    if (!simplifiedParagraph) {
+                        simplifiedParagraph = addMessage('');
+                    }
+                    updateMessage(simplifiedParagraph, `**Explicação Simplificada:**<br>${simplifiedText}`);
+                } else if (data.event === 'simplified_reset') {
+                    // Resposta cortada e refeita no servidor: descarta o que já foi exibido
+                    simplifiedText = '';
+                    if (simplifiedParagraph) {
+                        updateMessage(simplifiedParagraph, '**Explicação Simplificada:**<br>');
+                    }
+                } else if (data.event === 'error') {
+                    streamError = data.error;
+                }
+            });
+
+            if (streamError) {
+                throw new Error(streamError);
+            }
 
         } catch (error) {
             console.error("Erro ao processar a imagem:", error);
@@ -1,6 +1,7 @@
 import os
 import sys
 import json
+import uuid
 import streamlit as st
 
 st.markdown("""
@@ -27,11 +28,15 @@ div[data-testid="stFileUploader"] button:active {
 </style>
 """, unsafe_allow_html=True)
 
-import google.generativeai as genai
-from google.cloud import vision
-from google.cloud import translate_v2 as translate
 from google.oauth2 import service_account
 
+# O pipeline (OCR -> tradução -> simplificação) é o mesmo do app Flask (ver pipeline.py).
+import clients
+import metrics
+import pipeline
+import resilience
+from cache import content_hash
+
 # --- Funções de Configuração e Inicialização de APIs ---
 
 # --- 1. Carregar ID do Projeto e Chave API Gemini DOS SEGREDOS DO STREAMLIT ---
@@ -60,87 +65,71 @@ except Exception as e:
     st.stop()
 
 
-# --- 3. Inicialização das APIs (usando st.cache_resource para otimizar) ---
-@st.cache_resource
-def initialize_api_clients(gemini_key, _credentials):
-    """Inicializa os clientes das APIs Google Cloud."""
-    try:
-        genai.configure(api_key=gemini_key)
-        global_text_model = genai.GenerativeModel('gemini-1.5-flash')
-        
-        # Inicializa Vision e Translate com as credenciais da conta de serviço
-        vision_client = vision.ImageAnnotatorClient(credentials=_credentials)
-        translate_client = translate.Client(credentials=_credentials)
-
-        return global_text_model, vision_client, translate_client
-    except Exception as e:
-        st.error(f"ERRO FATAL: Falha ao inicializar clientes das APIs Google Cloud. Verifique suas credenciais e permissões de API no GCP. Detalhes: {e}")
-        st.stop()
+# --- 3. Inicialização das APIs ---
+# Os clientes são construídos uma única vez por processo, no primeiro uso (ver clients.py);
+# aqui apenas informamos as credenciais lidas dos segredos do Streamlit.
+clients.configure(credentials=credentials, gemini_api_key=gemini_api_key)
 
-# --- 4. Chama a função de inicialização uma única vez ---
-global_text_model, vision_client, translate_client = initialize_api_clients(gemini_api_key, credentials)
-
-# --- Funções de Processamento de Imagem/Texto (Mantidas) ---
-
-def detect_text_from_image(image_content):
-    """Detecta texto em uma imagem usando Google Cloud Vision API."""
-    image = vision.Image(content=image_content)
-    response = vision_client.text_detection(image=image)
-    texts = response.text_annotations
-    if texts:
-        return texts[0].description
-    return None
-
-def detect_and_translate_language(text_content):
-    """
-    Detecta o idioma de um texto e o traduz para português, se necessário.
-    Utiliza a Translation API V2.
-    """
-    if not text_content:
-        return ""
-
-    result = translate_client.detect_language(text_content)
-    detected_lang = result['language']
-
-    translated_text = text_content
-    if detected_lang and detected_lang != 'pt':
-        translation = translate_client.translate(
-            text_content,
-            target_language='pt',
-            source_language=detected_lang
-        )
-        translated_text = translation['translatedText']
-    
-    return translated_text
-
-def simplify_text_with_gemini(original_text):
-    """
-    Simplifica e resume um texto usando a Gemini API.
-    Utiliza o modelo de texto global 'global_text_model'.
-    """
-    if not original_text:
-        return "O texto fornecido para simplificação está vazio."
+# --- 4. Cache dos Resultados entre Reruns ---
+# O Streamlit reexecuta o script inteiro a cada interação com a página. O upload passa pelo
+# mesmo ponto de entrada do app Flask (pipeline.process_image_content, ou process_image_batch
+# para várias páginas), com o cache de resultados, o índice de manuais e os índices de quase
+# duplicatas. Por cima, st.cache_data memoriza o resultado pelo hash das imagens (os
+# argumentos com "_" não entram na chave): um rerun com o mesmo arquivo não chama o pipeline.
+STAGE_CACHE_MAX_ENTRIES = 256
+STAGE_CACHE_TTL_SECONDS = 24 * 3600
+
+
+class FalhaNaSimplificacao(Exception):
+    """A simplificação falhou; a exceção impede que o resultado com a falha vá para o cache."""
+
+    def __init__(self, results):
+        super().__init__(next(result['simplified_text'] for result in results
+                              if result['simplified_text'] in pipeline.MENSAGENS_DE_FALHA))
+        self.results = results
+
+
+def _check(results):
+    if any(result['simplified_text'] in pipeline.MENSAGENS_DE_FALHA for result in results):
+        raise FalhaNaSimplificacao(results)
+    return results
+
+
+@st.cache_data(max_entries=STAGE_CACHE_MAX_ENTRIES, ttl=STAGE_CACHE_TTL_SECONDS, show_spinner=False)
+def cached_process(image_hashes, _image_contents):
+    if len(_image_contents) == 1:
+        return _check([pipeline.process_image_content(_image_contents[0])])
+    return _check(pipeline.process_image_batch(list(_image_contents)))
 
-    try:
-        prompt = f"""
-        Você é um assistente especializado em manutenção de aeronaves, com a tarefa de simplificar instruções técnicas. Recebi a seguinte instrução de manutenção de um manual:
-
-        "{original_text}"
-
-        Por favor, reescreva esta instrução de forma mais simples, clara e sucinta,
-        mantendo apenas as informações essenciais para um técnico realizar a tarefa.
-        Use linguagem direta e evite jargões desnecessários, se possível.
-        """
-        response = global_text_model.generate_content(prompt)
-
-        if response and response.candidates and response.candidates[0].content.parts:
-            return response.candidates[0].content.parts[0].text
-        else:
-            st.warning("A Gemini API retornou resposta vazia ou sem conteúdo gerado na parte esperada.")
-            return "A Gemini API não conseguiu gerar uma explicação simplificada para o texto fornecido. O texto é legível e relevante?"
-    except Exception as e:
-        st.error(f"Ocorreu um erro ao simplificar a instrução: {str(e)}")
-        return "Ocorreu um erro ao simplificar a instrução. Por favor, tente novamente."
+
+def show_result(result):
+    """Exibe os textos de um resultado já processado."""
+    if not result['original_text']:
+        st.warning(pipeline.MENSAGEM_SEM_TEXTO_NA_IMAGEM)
+        return
+
+    st.subheader("Texto Detectado (OCR):")
+    st.write(result['original_text'])
+
+    if result['original_text'] != result['translated_text']:
+        st.subheader("Texto Traduzido (para Português):")
+        st.write(result['translated_text'])
+    else:
+        st.info("O texto detectado já está em português ou não exigiu tradução.")
+
+    st.subheader("Instrução Simplificada (Gemini AI):")
+    if result['simplified_text'] in pipeline.MENSAGENS_DE_FALHA:
+        st.error(result['simplified_text'])
+    else:
+        st.success(result['simplified_text'])
+
+
+def show_results(results):
+    """Exibe os resultados de uma ou mais páginas, na ordem do envio."""
+    for number, result in enumerate(results, start=1):
+        if len(results) > 1:
+            st.header(f"Página {number}")
+        show_result(result)
 
 # --- Interface do Streamlit (Substitui as Rotas Flask) ---
 
@@ -151,41 +140,43 @@ st.markdown("""
 Esta ferramenta utiliza **Visão Computacional (OCR)**, **Tradução Automática** e **Inteligência Artificial Generativa (Gemini AI)** para simplificar instruções de manutenção de manuais de aeronaves a partir de imagens.
 """)
 
-uploaded_file = st.file_uploader("Envie uma imagem com a instrução de manutenção", type=["png", "jpg", "jpeg"])
+uploaded_files = st.file_uploader("Envie uma ou mais imagens com a instrução de manutenção (páginas de uma mesma tarefa)",
+                                  type=["png", "jpg", "jpeg"], accept_multiple_files=True)
 
-if uploaded_file is not None:
-    st.image(uploaded_file, caption='Imagem Carregada.', use_column_width=True)
+if uploaded_files:
+    if len(uploaded_files) > pipeline.MAX_BATCH_PAGES:
+        st.error(f"Envie no máximo {pipeline.MAX_BATCH_PAGES} imagens por vez.")
+        st.stop()
+
+    for uploaded_file in uploaded_files:
+        st.image(uploaded_file, caption=f'Imagem Carregada: {uploaded_file.name}', use_column_width=True)
     st.write("")
-    st.info("Processando a imagem... Por favor, aguarde.")
 
-    image_content = uploaded_file.read()
+    image_contents = tuple(uploaded_file.getvalue() for uploaded_file in uploaded_files)
+    image_hashes = tuple(content_hash(content) for content in image_contents)
 
-    try:
-        with st.spinner('Detectando texto (OCR) na imagem...'):
-            original_text_from_ocr = detect_text_from_image(image_content)
-        
-        if not original_text_from_ocr:
-            st.warning("Não foi possível detectar texto na imagem. Certifique-se de que o texto está legível.")
-            st.stop()
-
-        st.subheader("Texto Detectado (OCR):")
-        st.write(original_text_from_ocr)
-
-        with st.spinner('Traduzindo texto, se necessário...'):
-            processed_text = detect_and_translate_language(original_text_from_ocr)
-        
-        if original_text_from_ocr != processed_text:
-            st.subheader("Texto Traduzido (para Português):")
-            st.write(processed_text)
-        else:
-            st.info("O texto detectado já está em português ou não exigiu tradução.")
-
-        with st.spinner('Simplificando a instrução com Gemini AI...'):
-            simplified_explanation = simplify_text_with_gemini(processed_text)
-        
-        st.subheader("Instrução Simplificada (Gemini AI):")
-        st.success(simplified_explanation)
+    # O resultado dos arquivos atuais fica no session_state: nos reruns da mesma sessão
+    # (ex.: interação com outros widgets), ele é exibido sem passar pelo pipeline.
+    saved = st.session_state.get('resultado')
+    if saved is not None and saved['image_hashes'] == image_hashes:
+        show_results(saved['results'])
+        st.stop()
+
+    st.info("Processando... Por favor, aguarde.")
+    # Registro da execução: dá a ela um orçamento de tokens próprio (ver model_routing.request_budget).
+    metrics.start_request(uuid.uuid4().hex)
+    resilience.start_deadline()
 
+    try:
+        with st.spinner('Detectando, traduzindo e simplificando o texto...'):
+            results = cached_process(image_hashes, image_contents)
+        show_results(results)
+        st.session_state['resultado'] = {'image_hashes': image_hashes, 'results': results}
+
+    except FalhaNaSimplificacao as e:
+        show_results(e.results)
+    except resilience.ResilienceError as e:
+        st.error(f"O serviço está sobrecarregado ou instável no momento. Tente novamente em instantes. Detalhes: {e}")
     except Exception as e:
         st.error(f"Ocorreu um erro inesperado durante o processamento: {str(e)}")
-        st.write("Verifique os logs para mais detalhes.")
\ No newline at end of file
+        st.write("Verifique os logs para mais detalhes.")
@@ -0,0 +1,207 @@
+import asyncio
+import re
+import threading
+
+from cache import content_hash
+
+# --- Tradução com Memória de Segmentos ---
+# Os manuais repetem as mesmas frases o tempo todo ("Make sure that the area is clean",
+# avisos, notas de torque). Em vez de detectar o idioma e depois traduzir o texto inteiro
+# (duas chamadas sequenciais), o texto do OCR é dividido em segmentos (frases, passos e parágrafos):
+#   - segmentos já conhecidos vêm da memória de tradução (persistente);
+#   - apenas os inéditos vão para a API, todos juntos em uma única chamada de lista,
+#     que já informa o idioma detectado ('detectedSourceLanguage').
+
+# O OCR quebra o texto a cada linha visual, então uma frase pode vir em várias linhas.
+# Candidatos a separador: quebras de linha (com os espaços em volta) e espaços após
+# pontuação final (mas não após numeração como "1." ou "2.3."). Veja _is_boundary.
+BOUNDARY_CANDIDATE = re.compile(r"[ \t]*\n\s*|(?<=[^\d\s][.!?])[ \t]+")
+# Linha que abre um novo item: passo numerado, marcador de lista ou aviso.
+ITEM_START = re.compile(
+    r"(?:\(?\d{1,3}(?:\.\d{1,3})*[.)]|\(?[A-Za-z][.)]|[-•*])\s"
+    r"|(?:WARNING|CAUTION|NOTE|AVISO|ATENÇÃO|ADVERTÊNCIA|CUIDADO|PRECAUÇÃO|NOTA|OBSERVAÇÃO)\b"
+)
+SENTENCE_END = re.compile(r"[^\d\s][.!?:]$")
+LAST_WORD = re.compile(r"\S+$")
+# Abreviações comuns nos manuais: o ponto final delas não encerra a frase.
+ABBREVIATIONS = {
+    'fig.', 'figs.', 'e.g.', 'i.e.', 'ref.', 'refs.', 'para.', 'approx.', 'no.', 'nos.', 'nr.',
+    'p.', 'pp.', 'pg.', 'vol.', 'min.', 'max.', 'cf.', 'vs.', 'fwd.', 'ch.', 'sect.', 'qty.',
+    'dia.', 'assy.', 'ex.', 'obs.', 'aprox.', 'pág.', 'nº.', 'sr.', 'sra.',
+}
+# Iniciais e siglas com pontos ("A.", "e.g.", "P.N."): também não encerram a frase.
+INITIALS = re.compile(r"(?:[^\W\d_]\.){1,3}")
+# Segmentos sem nenhuma letra (números, códigos de torque, pontuação) não precisam de tradução.
+HAS_LETTER = re.compile(r"[^\W\d_]")
+
+# Limite de textos por chamada da Translation API V2.
+TRANSLATE_BATCH_MAX_TEXTS = 128
+
+
+def _ends_with_abbreviation(before):
+    word = LAST_WORD.search(before)
+    if word is None:
+        return False
+    word = word.group().lstrip('([{"\'').lower()
+    return word in ABBREVIATIONS or INITIALS.fullmatch(word) is not None
+
+
+def _is_boundary(text, match):
+    """
+    Um candidato só separa segmentos se for: linha em branco; quebra antes de um novo item
+    (passo, lista, aviso); quebra ou espaço após fim de frase que não seja abreviação.
+    Quebras simples no meio de uma frase são apenas a quebra de linha visual do OCR.
+    """
+    before = text[max(0, match.start() - 24):match.start()]
+    if '\n' in match.group():
+        if match.group().count('\n') > 1 or ITEM_START.match(text, match.end()):
+            return True
+        return SENTENCE_END.search(before) is not None and not _ends_with_abbreviation(before)
+    return not _ends_with_abbreviation(before)
+
+
+def split_segments(text):
+    """
+    Divide um texto em partes alternadas [segmento, separador, segmento, ...].
+    As posições pares são segmentos (frases ou parágrafos, com as linhas quebradas pelo OCR
+    ainda dentro deles); as ímpares, separadores preservados.
+    """
+    parts = []
+    start = 0
+    for match in BOUNDARY_CANDIDATE.finditer(text):
+        if match.start() > start and _is_boundary(text, match):
+            parts.append(text[start:match.start()])
+            parts.append(match.group())
+            start = match.end()
+    parts.append(text[start:])
+    return parts
+
+
+def segment_key(segment):
+    """Segmento com as linhas quebradas unidas por espaço: é o que vai para a API e para a memória."""
+    return " ".join(segment.split())
+
+
+class TranslationEngine:
+    """
+    Traduz textos para português segmento a segmento, servindo da memória de tradução
+    os segmentos já vistos e enviando os inéditos em uma única chamada em lote.
+
+    'translate_batch' recebe uma lista de textos e devolve uma lista de dicionários no
+    formato da Translation API V2 ('translatedText' e 'detectedSourceLanguage').
+    'memory' é um ResultCache (memória + SQLite) usado como memória de tradução.
+    """
+
+    def __init__(self, translate_batch, memory, target_language="pt", translate_batch_async=None):
+        self.translate_batch = translate_batch
+        self.translate_batch_async = translate_batch_async
+        self.memory = memory
+        self.target_language = target_language
+        self._lock = threading.Lock()
+        self._stats = {
+            "segments": 0,
+            "segments_from_memory": 0,
+            "segments_translated": 0,
+            "characters_saved": 0,
+            "characters_sent": 0,
+            "api_calls": 0,
+        }
+
+    def translate(self, texts):
+        """
+        Traduz uma lista de textos para o idioma de destino.
+        Retorna uma lista, na mesma ordem, com o texto traduzido (textos vazios são mantidos).
+        """
+        plan = self._plan(texts)
+        # Apenas os segmentos inéditos vão para a API, em lote.
+        batches = self._batches(plan)
+        for batch in batches:
+            self._store(batch, self.translate_batch(batch), plan)
+        return self._finish(texts, plan, len(batches))
+
+    async def translate_async(self, texts):
+        """
+        Como 'translate', usando 'translate_batch_async' (uma corrotina) para os segmentos inéditos.
+        As leituras e gravações da memória (SQLite) rodam em threads, fora do event loop.
+        """
+        plan = await asyncio.to_thread(self._plan, texts)
+        batches = self._batches(plan)
+        for batch in batches:
+            results = await self.translate_batch_async(batch)
+            await asyncio.to_thread(self._store, batch, results, plan)
+        return self._finish(texts, plan, len(batches))
+
+    def _plan(self, texts):
+        """Divide os textos em segmentos e separa os já conhecidos (memória) dos inéditos."""
+        split_texts = [split_segments(text) if text else [] for text in texts]
+
+        # Reúne os segmentos distintos que precisam de tradução (sem espaços nas pontas).
+        known = {}
+        unseen = []
+        segments_total = 0
+        chars_saved = 0
+        for parts in split_texts:
+            for segment in parts[::2]:
+                key = segment_key(segment)
+                if not key or not HAS_LETTER.search(key):
+                    continue
+                segments_total += 1
+                if key in known:
+                    chars_saved += len(key)
+                    continue
+                stored = self.memory.get(content_hash(key))
+                if stored is not None:
+                    known[key] = stored["text"]
+                    chars_saved += len(key)
+                else:
+                    known[key] = None
+                    unseen.append(key)
+        return split_texts, known, unseen, segments_total, chars_saved
+
+    @staticmethod
+    def _batches(plan):
+        unseen = plan[2]
+        return [unseen[start:start + TRANSLATE_BATCH_MAX_TEXTS]
+                for start in range(0, len(unseen), TRANSLATE_BATCH_MAX_TEXTS)]
+
+    def _store(self, batch, results, plan):
+        """Registra as traduções de um lote (no plano e na memória de tradução)."""
+        known = plan[1]
+        for segment, result in zip(batch, results):
+            language = result.get("detectedSourceLanguage")
+            translated = segment if language == self.target_language else result["translatedText"]
+            known[segment] = translated
+            self.memory.set(content_hash(segment), {"text": translated, "language": language})
+
+    def _finish(self, texts, plan, api_calls):
+        split_texts, known, unseen, segments_total, chars_saved = plan
+        with self._lock:
+            self._stats["segments"] += segments_total
+            self._stats["segments_from_memory"] += segments_total - len(unseen)
+            self._stats["segments_translated"] += len(unseen)
+            self._stats["characters_saved"] += chars_saved
+            self._stats["characters_sent"] += sum(len(segment) for segment in unseen)
+            self._stats["api_calls"] += api_calls
+
+        return [self._reassemble(parts, known) if parts else text for parts, text in zip(split_texts, texts)]
+
+    @staticmethod
+    def _reassemble(parts, known):
+        output = []
+        for position, part in enumerate(parts):
+            key = segment_key(part)
+            if position % 2 == 1 or known.get(key) is None:
+                output.append(part)
+                continue
+            # Preserva os espaços das pontas (ex.: recuo de itens numerados).
+            leading = part[:len(part) - len(part.lstrip())]
+            trailing = part[len(part.rstrip()):]
+            output.append(f"{leading}{known[key]}{trailing}")
+        return "".join(output)
+
+    def stats(self):
+        """Retorna os contadores da memória de tradução (taxa de acerto e caracteres economizados)."""
+        with self._lock:
+            stats = dict(self._stats)
+        stats["hit_rate"] = stats["segments_from_memory"] / stats["segments"] if stats["segments"] else 0.0
+        return stats